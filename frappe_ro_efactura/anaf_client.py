@@ -6,34 +6,93 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from requests.exceptions import RequestException, Timeout
 from frappe import _
-from frappe.utils import cint, get_bench_path
-from pathlib import Path
+from frappe.utils import cint
+import atexit
+import hashlib
+import json
+import ssl
 import tempfile
+import threading
+import time
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from .metrics import get_recorder, record_http_response, record_retry, timed
+from .rate_limiter import THROTTLE_STATUS_CODES, get_rate_limiter
 
 logger = logging.getLogger(__name__)
-RETRY_STATUS_CODES = [500, 502, 503, 504]
+# 429/503 are left to the shared rate limiter so workers do not retry in lockstep
+RETRY_STATUS_CODES = [500, 502, 504]
+THROTTLE_RETRIES = 3
+TOKEN_REFRESH_MARGIN = 120  # seconds before expiry at which a token is renewed
+TOKEN_LOCK_TIMEOUT = 30
+DEFAULT_TOKEN_TTL = 3600
+
+# In-process fallback for the Redis token cache, plus per-key fetch locks
+_token_cache = {}
+_token_locks = {}
+_token_locks_guard = threading.Lock()
+
+class SSLContextAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections use a preloaded SSLContext (client certificate held in memory)"""
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.ssl_context:
+            kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+# Warm clients per site, owned by the worker process that created them
+_client_pool = {}
+_client_pool_lock = threading.Lock()
 
 class ANAFClient:
-    def __init__(self, settings_doc):
+    def __init__(self, settings_doc, config=None):
         """Initialize ANAF API client with connection settings"""
         self.settings = settings_doc
-        self.config = self.settings.configure_connection()
+        self.config = config or self.settings.configure_connection()
+        self.pid = os.getpid()
+        self.fingerprint = _config_fingerprint(self.config)
+        self._token = None
+        self.limiters = {
+            'upload': get_rate_limiter('upload', self.config),
+            'status': get_rate_limiter('status', self.config)
+        }
         self.session = self._configure_session()
         self._setup_authentication()
 
     def _configure_session(self):
-        """Create requests session with retry logic"""
+        """Create keep-alive requests session with retry logic and a sized connection pool"""
         session = requests.Session()
+        session.mount("https://", self._build_adapter())
+        return session
+
+    def _build_adapter(self, ssl_context=None):
+        """HTTPAdapter with retries, pool sizing and an optional client-certificate SSLContext"""
         retries = Retry(
             total=3,
             backoff_factor=0.5,
             status_forcelist=RETRY_STATUS_CODES,
-            allowed_methods=["POST", "GET"]
+            allowed_methods=["POST", "GET"],
+            # Otherwise urllib3 retries 429/503 carrying Retry-After itself, whatever status_forcelist says
+            respect_retry_after_header=False
+        )
+        # Never fewer pooled connections than concurrent uploads, or urllib3 discards them
+        pool_size = max(cint(self.config.get('pool_size')), cint(self.config.get('concurrency')), 1)
+        return SSLContextAdapter(
+            ssl_context=ssl_context,
+            max_retries=retries,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
         )
-        adapter = HTTPAdapter(max_retries=retries)
-        session.mount("https://", adapter)
-        return session
 
     def _setup_authentication(self):
         """Configure authentication based on settings"""
@@ -51,47 +110,78 @@ class ANAFClient:
             frappe.throw(_("Client certificate missing in configuration"))
 
         try:
-            # Write certificate to temporary file
-            with tempfile.NamedTemporaryFile(delete=False) as cert_file:
-                cert_file.write(cert_content.encode())
-                self.cert_path = cert_file.name
-        except IOError as e:
+            ssl_context = _build_client_ssl_context(cert_content, self.config.get('private_key'))
+        except (IOError, ssl.SSLError) as e:
             frappe.throw(_("Failed to process certificate: {0}").format(str(e)))
 
+        # The client certificate now lives in the SSLContext for the whole client lifetime
+        self.session.mount("https://", self._build_adapter(ssl_context))
+
     def _handle_oauth_auth(self):
         """Configure OAuth2 authentication flow"""
         oauth_creds = self.config.get('oauth_creds')
         if not oauth_creds:
             frappe.throw(_("OAuth credentials missing in configuration"))
 
-        token_url = f"{self.config['api_url']}/oauth2/token"
-        try:
-            response = requests.post(
-                token_url,
-                data={
-                    'client_id': oauth_creds['client_id'],
-                    'client_secret': oauth_creds['client_secret'],
-                    'grant_type': 'client_credentials'
-                }
-            )
-            response.raise_for_status()
-            token_data = response.json()
-            self.session.headers.update({
-                'Authorization': f"Bearer {token_data['access_token']}"
-            })
-        except RequestException as e:
-            logger.error(f"OAuth2 Token Error: {str(e)}")
-            frappe.throw(_("ANAF OAuth2 authentication failed"))
+        self._apply_token(get_oauth_token(self.config))
+
+    def _apply_token(self, token):
+        """Attach a cached bearer token to the session"""
+        self._token = token
+        self.session.headers.update({
+            'Authorization': f"Bearer {token['access_token']}"
+        })
+
+    def _ensure_fresh_token(self):
+        """Swap in a renewed token shortly before the current one expires"""
+        if self.config['auth_type'] == 'OAuth2' and not _is_token_usable(self._token):
+            self._apply_token(get_oauth_token(self.config))
+
+    def _request(self, bucket, method, endpoint, **kwargs):
+        """Send a request, re-authenticating once if ANAF rejects the bearer token"""
+        self._ensure_fresh_token()
+        recorder = get_recorder()
+        response = self._throttled_request(bucket, method, endpoint, recorder=recorder, **kwargs)
+        if response.status_code == 401 and self.config['auth_type'] == 'OAuth2':
+            logger.info("ANAF rejected bearer token, re-authenticating")
+            record_retry(recorder, bucket, "unauthorized")
+            self._apply_token(get_oauth_token(self.config, rejected_token=self._token['access_token']))
+            response = self._throttled_request(bucket, method, endpoint, recorder=recorder, **kwargs)
+        return response
 
+    def _throttled_request(self, bucket, method, endpoint, recorder=None, **kwargs):
+        """Send through the shared rate limiter, honouring Retry-After on 429/503.
+
+        recorder is taken by the caller, since worker threads have no site context to look it up.
+        """
+        limiter = self.limiters[bucket]
+        for attempt in range(THROTTLE_RETRIES + 1):
+            if attempt:
+                record_retry(recorder, bucket, "throttled")
+            limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, endpoint, **kwargs)
+            except RequestException as e:
+                record_http_response(recorder, bucket, time.perf_counter() - start, error=e)
+                raise
+            record_http_response(recorder, bucket, time.perf_counter() - start, response)
+            limiter.on_response(response.status_code, response.headers.get('Retry-After'))
+            if response.status_code not in THROTTLE_STATUS_CODES:
+                break
+        return response
+
+    @timed("send")
     def send_xml(self, xml_data):
         """Submit signed XML to ANAF API with proper error handling"""
         endpoint = f"{self.config['api_url']}/upload"
         try:
-            response = self.session.post(
+            response = self._request(
+                'upload',
+                'POST',
                 endpoint,
                 data=xml_data,
                 headers={'Content-Type': 'application/xml'},
-                cert=self.cert_path if self.config['auth_type'] == 'Certificate' else None,
                 timeout=10
             )
             response.raise_for_status()
@@ -101,15 +191,87 @@ class ANAFClient:
             frappe.throw(_("ANAF API request timed out"))
         except RequestException as e:
             self._log_and_handle_error(e, "XML submission failed")
-        finally:
-            if hasattr(self, 'cert_path'):
-                self._cleanup_certificate()
+
+    @timed("send_batch")
+    def send_xml_many(self, payloads, max_workers=None):
+        """Upload signed XMLs concurrently, returning normalized results keyed like payloads"""
+        endpoint = f"{self.config['api_url']}/upload"
+        requests_by_key = {
+            key: ('POST', endpoint, {
+                'data': xml_data,
+                'headers': {'Content-Type': 'application/xml'},
+                'timeout': 10
+            })
+            for key, xml_data in payloads.items()
+        }
+        outcomes = self._dispatch_concurrently(requests_by_key, 'upload', max_workers)
+        return {key: self._normalize_outcome(outcome, "XML submission failed") for key, outcome in outcomes.items()}
+
+    def _dispatch_concurrently(self, requests_by_key, bucket, max_workers=None):
+        """Run requests on a bounded thread pool, returning a Response or exception per key.
+
+        Worker threads have no Frappe context, so they only touch the session;
+        token refresh, 401 re-authentication and normalization stay on the calling thread.
+        """
+        max_workers = max_workers or cint(self.config.get('concurrency')) or 1
+        recorder = get_recorder()
+
+        def dispatch(request):
+            method, endpoint, kwargs = request
+            try:
+                return self._throttled_request(bucket, method, endpoint, recorder=recorder, **kwargs)
+            except RequestException as e:
+                return e
+
+        self._ensure_fresh_token()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = dict(zip(requests_by_key, executor.map(dispatch, requests_by_key.values())))
+
+        rejected = [
+            key for key, outcome in outcomes.items()
+            if getattr(outcome, 'status_code', None) == 401
+        ]
+        if rejected and self.config['auth_type'] == 'OAuth2':
+            logger.info(f"ANAF rejected bearer token for {len(rejected)} requests, re-authenticating")
+            record_retry(recorder, bucket, "unauthorized", len(rejected))
+            self._apply_token(get_oauth_token(self.config, rejected_token=self._token['access_token']))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                retried = executor.map(dispatch, [requests_by_key[key] for key in rejected])
+                outcomes.update(zip(rejected, retried))
+
+        return outcomes
+
+    def _normalize_outcome(self, outcome, context):
+        """Turn a concurrent request outcome into the _parse_response shape without raising"""
+        if isinstance(outcome, Timeout):
+            logger.error(f"{context}: ANAF API timeout occurred")
+            return {'status': 'error', 'error': _("ANAF API request timed out"), 'code': 'TIMEOUT'}
+        if isinstance(outcome, Exception):
+            logger.error(f"{context}: {str(outcome)}")
+            return {'status': 'error', 'error': str(outcome), 'code': 'E500'}
+
+        try:
+            outcome.raise_for_status()
+            return self._parse_response(outcome.json())
+        except (RequestException, ValueError) as e:
+            logger.error(f"{context}: {str(e)}")
+            return {'status': 'error', 'error': str(e), 'code': str(outcome.status_code)}
+
+    @timed("status_batch")
+    def check_status_many(self, uuids, max_workers=None):
+        """Check many UUIDs concurrently, returning normalized results keyed by UUID"""
+        requests_by_key = {
+            uuid: ('GET', f"{self.config['api_url']}/status/{uuid}", {'timeout': 8})
+            for uuid in uuids
+        }
+        outcomes = self._dispatch_concurrently(requests_by_key, 'status', max_workers)
+        return {uuid: self._normalize_outcome(outcome, "Status check failed") for uuid, outcome in outcomes.items()}
 
     def check_status(self, uuid):
         """Check invoice status by UUID with retry logic"""
         endpoint = f"{self.config['api_url']}/status/{uuid}"
         try:
-            response = self.session.get(endpoint, timeout=8)
+            response = self._request('status', 'GET', endpoint, timeout=8)
             response.raise_for_status()
             return self._parse_response(response.json())
         except RequestException as e:
@@ -141,10 +303,162 @@ class ANAFClient:
         )
         frappe.throw(_("ANAF API Error: {0}").format(context))
 
-    def _cleanup_certificate(self):
-        """Clean up temporary certificate files"""
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+
+def get_pooled_client(settings_doc):
+    """Return a warm ANAFClient shared by all jobs of this worker process for the current site"""
+    config = settings_doc.configure_connection()
+    fingerprint = _config_fingerprint(config)
+    site = getattr(frappe.local, 'site', None)
+
+    with _client_pool_lock:
+        client = _client_pool.get(site)
+        if client and client.pid == os.getpid() and client.fingerprint == fingerprint:
+            return client
+
+        if client and client.pid == os.getpid():
+            # Settings changed since the client was built
+            client.close()
+        # A client inherited through fork shares sockets with the parent, so it is dropped, never reused
+
+        client = ANAFClient(settings_doc, config=config)
+        _client_pool[site] = client
+        return client
+
+def close_pooled_clients():
+    """Close every pooled client created by this process"""
+    with _client_pool_lock:
+        for site, client in list(_client_pool.items()):
+            if client.pid == os.getpid():
+                client.close()
+            del _client_pool[site]
+
+def _build_client_ssl_context(certificate, private_key=None):
+    """Load the client certificate into an SSLContext.
+
+    ssl can only load certificate chains from a path, so the PEM is written once
+    to a 0600 file (on tmpfs when available) and unlinked right after loading;
+    nothing stays on disk for the lifetime of the client.
+    """
+    context = ssl.create_default_context()
+    pem = certificate if not private_key else f"{certificate.strip()}\n{private_key.strip()}\n"
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    fd, path = tempfile.mkstemp(suffix=".pem", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as pem_file:
+            pem_file.write(pem)
+        context.load_cert_chain(path)
+    finally:
+        os.unlink(path)
+    return context
+
+def get_oauth_token(config, rejected_token=None):
+    """Return a valid OAuth2 token, fetched at most once per site and client across all workers"""
+    key = _token_cache_key(config)
+    token = _read_cached_token(key)
+    if _is_token_usable(token, rejected_token):
+        return token
+
+    with _single_flight(key):
+        # Another worker may have refreshed the token while we waited for the lock
+        token = _read_cached_token(key)
+        if _is_token_usable(token, rejected_token):
+            return token
+
+        token = _fetch_oauth_token(config)
+        _store_token(key, token)
+        return token
+
+def _fetch_oauth_token(config):
+    """Request a new client-credentials token from ANAF"""
+    oauth_creds = config['oauth_creds']
+    token_url = f"{config['api_url']}/oauth2/token"
+    try:
+        response = requests.post(
+            token_url,
+            data={
+                'client_id': oauth_creds['client_id'],
+                'client_secret': oauth_creds['client_secret'],
+                'grant_type': 'client_credentials'
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        token_data = response.json()
+    except RequestException as e:
+        logger.error(f"OAuth2 Token Error: {str(e)}")
+        frappe.throw(_("ANAF OAuth2 authentication failed"))
+
+    expires_in = cint(token_data.get('expires_in')) or DEFAULT_TOKEN_TTL
+    return {
+        'access_token': token_data['access_token'],
+        'expires_at': time.time() + expires_in
+    }
+
+def _is_token_usable(token, rejected_token=None):
+    """A token is usable until the refresh margin and unless ANAF just rejected it"""
+    if not token or token['access_token'] == rejected_token:
+        return False
+    return token['expires_at'] - TOKEN_REFRESH_MARGIN > time.time()
+
+def _token_cache_key(config):
+    """Cache key per client id; frappe.cache already namespaces keys per site"""
+    client_id = config['oauth_creds']['client_id']
+    digest = hashlib.sha256(f"{config['api_url']}|{client_id}".encode()).hexdigest()[:16]
+    return f"efactura:oauth_token:{digest}"
+
+def _read_cached_token(key):
+    """Read a token from Redis, falling back to this process' copy"""
+    token = None
+    try:
+        token = frappe.cache().get_value(key, expires=True)
+    except Exception as e:
+        logger.warning(f"Token cache unavailable, using in-process copy: {str(e)}")
+    return token or _token_cache.get((getattr(frappe.local, 'site', None), key))
+
+def _store_token(key, token):
+    """Store a token in Redis until it expires, and in this process"""
+    _token_cache[(getattr(frappe.local, 'site', None), key)] = token
+    ttl = int(token['expires_at'] - time.time())
+    try:
+        frappe.cache().set_value(key, token, expires_in_sec=max(ttl, 1))
+    except Exception as e:
+        logger.warning(f"Failed to share OAuth2 token through Redis: {str(e)}")
+
+@contextmanager
+def _single_flight(key):
+    """Serialise token fetches: a thread lock within the worker, a Redis lock across workers"""
+    with _token_locks_guard:
+        local_lock = _token_locks.setdefault(key, threading.Lock())
+
+    with local_lock:
+        redis_lock = None
         try:
-            if os.path.exists(self.cert_path):
-                os.unlink(self.cert_path)
+            cache = frappe.cache()
+            redis_lock = cache.lock(
+                cache.make_key(f"{key}:lock"),
+                timeout=TOKEN_LOCK_TIMEOUT,
+                blocking_timeout=TOKEN_LOCK_TIMEOUT
+            )
+            if not redis_lock.acquire():
+                redis_lock = None
         except Exception as e:
-            logger.warning(f"Certificate cleanup failed: {str(e)}")
+            logger.warning(f"Token lock unavailable, falling back to in-process lock: {str(e)}")
+            redis_lock = None
+
+        try:
+            yield
+        finally:
+            if redis_lock:
+                try:
+                    redis_lock.release()
+                except Exception:
+                    pass
+
+def _config_fingerprint(config):
+    """Stable hash of the connection config, so secrets are never kept as pool keys"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+atexit.register(close_pooled_clients)
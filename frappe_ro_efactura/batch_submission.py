@@ -0,0 +1,190 @@
+## batch_submission.py
+import frappe
+import logging
+from frappe import _
+from frappe.utils import add_to_date, now_datetime
+from .anaf_client import get_pooled_client
+from .efactura_settings import get_efactura_settings
+from .digital_signer import SigningError, get_signing_context
+from .payload_cache import sign_many_with_cache
+from .payload_store import load_payloads, offload_response_updates
+from .invoice_status_sync import sync_invoice_statuses
+from .metrics import timed
+from .efactura_transaction import MAX_RETRIES, final_gate_errors, invoice_sync_values, lock_transactions, renew_leases, success_values, failure_values
+from .invoice_rules import format_violations
+
+logger = logging.getLogger(__name__)
+DEFAULT_BATCH_SIZE = 200
+BATCH_JOB_TIMEOUT = 1800
+
+def submit_transactions_batch(names):
+    """Claim and submit the given transactions as one batch"""
+    settings = get_efactura_settings()
+    if not settings.is_configured():
+        logger.error("e-Factura batch skipped: settings not configured")
+        return
+
+    rows = _claim_transactions(names)
+    if rows:
+        submit_claimed_transactions(rows, settings)
+
+def submit_claimed_transactions(rows, settings):
+    """Sign and submit claimed transactions with one signing context and one client"""
+    signing_context = get_signing_context(settings)
+    client = get_pooled_client(settings)
+
+    invoices = _get_invoices([row.invoice_link for row in rows])
+    transaction_updates, invoice_updates, signed = {}, {}, {}
+
+    to_sign = []
+    for row in rows:
+        invoice = invoices.get(row.invoice_link)
+        if not invoice or invoice.docstatus != 1:
+            # Invoice was cancelled or deleted after the transaction was queued; it must never be sent
+            transaction_updates[row.name] = {"status": "Cancelled"}
+            if invoice:
+                invoice_updates[row.invoice_link] = {"efactura_status": "Cancelled"}
+            continue
+        to_sign.append(row)
+
+    xml_payloads = _get_xml_payloads(to_sign)
+    to_sign = _apply_final_gate(to_sign, xml_payloads, transaction_updates, invoice_updates)
+    signatures = sign_many_with_cache(signing_context, [xml_payloads.get(row.name) for row in to_sign])
+    for row, signed_xml in zip(to_sign, signatures):
+        if isinstance(signed_xml, SigningError):
+            logger.error(f"Batch signing failed for {row.name}: {str(signed_xml)}")
+            _record_outcome(row, {"status": "error", "error": str(signed_xml)}, transaction_updates, invoice_updates)
+        else:
+            signed[row.name] = signed_xml
+
+    # Uploads under the rate limiter can be slow; keep the leases ahead of them
+    for token in {row.lease_token for row in rows}:
+        renew_leases([row.name for row in rows if row.lease_token == token and row.name in signed],
+                     token, BATCH_JOB_TIMEOUT)
+    responses = client.send_xml_many(signed) if signed else {}
+    for row in rows:
+        if row.name in responses:
+            _record_outcome(row, responses[row.name], transaction_updates, invoice_updates)
+
+    accepted = {
+        name: signed_xml for name, signed_xml in signed.items()
+        if responses.get(name, {}).get("status") == "success"
+    }
+    _write_results(rows, transaction_updates, invoice_updates, accepted)
+
+def _record_outcome(row, response, transaction_updates, invoice_updates):
+    """Collect the field updates for one transaction and its Sales Invoice"""
+    if response.get("status") == "success":
+        values = success_values(response)
+    else:
+        values = failure_values(response, row.retry_count)
+    transaction_updates[row.name] = values
+    invoice_updates[row.invoice_link] = invoice_sync_values(values)
+
+def _apply_final_gate(rows, xml_payloads, transaction_updates, invoice_updates):
+    """Drop drafts failing the Schematron final gate from the batch, recording them as Validation Failed"""
+    passed = []
+    for row in rows:
+        errors = final_gate_errors(xml_payloads.get(row.name)) if row.status == "Draft" else None
+        if not errors:
+            passed.append(row)
+            continue
+        logger.error(f"Schematron validation failed for {row.name}: {format_violations(errors)}")
+        transaction_updates[row.name] = {"status": "Validation Failed"}
+        invoice_updates[row.invoice_link] = {
+            "efactura_status": "Validation Failed",
+            "efactura_remarks": format_violations(errors)
+        }
+    return passed
+
+def _claim_transactions(names):
+    """Load the batch and mark it Processing in a single conditional statement"""
+    rows = frappe.get_all(
+        "EFactura Transaction",
+        filters={"name": ["in", names], "status": ["in", ["Draft", "Failed"]]},
+        fields=["name", "status", "invoice_link", "xml_data", "xml_hash", "retry_count", "next_attempt_at"]
+    )
+    now = now_datetime()
+    # Failed rows wait out their backoff, the same as in the work queue
+    rows = [
+        row for row in rows
+        if (row.xml_data or row.xml_hash) and (row.status == "Draft" or (
+            row.retry_count < MAX_RETRIES and (not row.next_attempt_at or row.next_attempt_at <= now)))
+    ]
+    if not rows:
+        return []
+
+    # Rows another worker moved on since they were read are not claimed, and are dropped from the batch
+    token = frappe.generate_hash(length=16)
+    frappe.db.sql(
+        """update `tabEFactura Transaction`
+        set status='Processing', submission_time=%(now)s, lease_token=%(token)s, lease_expires_at=%(expires)s
+        where name in %(names)s and status in %(sources)s
+        and (next_attempt_at is null or next_attempt_at <= %(now)s)""",
+        {
+            "now": now,
+            "token": token,
+            "expires": add_to_date(now, seconds=BATCH_JOB_TIMEOUT),
+            "names": tuple(row.name for row in rows),
+            "sources": ("Draft", "Failed")
+        }
+    )
+    frappe.db.commit()
+    claimed = set(frappe.get_all("EFactura Transaction", filters={"lease_token": token}, pluck="name"))
+    rows = [row for row in rows if row.name in claimed]
+    for row in rows:
+        row.lease_token = token
+    return rows
+
+def _get_invoices(invoice_names):
+    """Fetch the Sales Invoices of a batch in one query"""
+    return {
+        invoice.name: invoice
+        for invoice in frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", list(set(invoice_names))]},
+            fields=["name", "docstatus"]
+        )
+    }
+
+def _get_xml_payloads(rows):
+    """Unsigned XML per transaction: inline for legacy rows, else one query to the payload store"""
+    payloads = {row.name: row.xml_data for row in rows if row.xml_data}
+    payloads.update(load_payloads([row.name for row in rows if not row.xml_data], "xml"))
+    return payloads
+
+@timed("db_write")
+def _write_results(rows, transaction_updates, invoice_updates, accepted_payloads=None):
+    """Persist batch outcomes with bulk updates and a single commit, releasing the work queue leases.
+
+    Only rows still Processing under this batch's lease are written; a row whose
+    lease expired and was taken over keeps the state its new owner gives it.
+    """
+    current = lock_transactions(list(transaction_updates))
+    for row in rows:
+        held = current.get(row.name)
+        if row.name not in transaction_updates or (
+                held and held.status == "Processing" and held.lease_token == row.lease_token):
+            continue
+        values = transaction_updates.pop(row.name)
+        invoice_updates.pop(row.invoice_link, None)
+        (accepted_payloads or {}).pop(row.name, None)
+        logger.error(f"Lease of {row.name} was lost before its outcome was recorded; dropped "
+                     f"{values.get('status')} (ANAF upload {values.get('anaf_uuid') or 'none'})")
+
+    for values in transaction_updates.values():
+        values.update(lease_token=None, lease_expires_at=None)
+    offload_response_updates(transaction_updates, accepted_payloads)
+    if transaction_updates:
+        frappe.db.bulk_update("EFactura Transaction", transaction_updates)
+    sync_invoice_statuses(invoice_updates)
+    frappe.db.commit()
+
+    exhausted = [
+        name for name, values in transaction_updates.items()
+        if values.get("status") == "Failed" and values.get("retry_count", 0) >= MAX_RETRIES
+    ]
+    for name in exhausted:
+        frappe.get_doc("EFactura Transaction", name).add_comment("Info", _("Maximum retry attempts reached"))
+    if exhausted:
+        frappe.db.commit()
@@ -0,0 +1,155 @@
+## mock_anaf.py
+"""Local stand-in for the ANAF e-Factura API, for benchmarks only.
+
+Serves /upload, /status/<uuid> and /oauth2/token with configurable latency,
+error rate and throttling. Run standalone with:
+
+    python -m frappe_ro_efactura.benchmarks.mock_anaf --port 8089 --latency-ms 80 --throttle-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockANAFConfig:
+    def __init__(self, latency_ms=50, jitter_ms=10, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, pending_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate  # share of requests answered with HTTP 500
+        self.throttle_rate = throttle_rate  # share of requests answered with HTTP 429
+        self.retry_after = retry_after  # whole Retry-After seconds sent with each 429, as ANAF does
+        self.pending_rate = pending_rate  # share of status checks still "in prelucrare"
+        self.random = random.Random(seed)
+
+class MockANAFServer:
+    """Threaded HTTP server in a background thread; use as a context manager"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockANAFConfig()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def _make_handler(server):
+    config = server.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like ANAF
+
+        def do_POST(self):
+            self._read_body()
+            if self.path.rstrip("/").endswith("/oauth2/token"):
+                return self._reply("token", 200, {"access_token": uuid.uuid4().hex, "expires_in": 3600})
+            if self.path.rstrip("/").endswith("/upload"):
+                if self._injected_failure("upload"):
+                    return
+                return self._reply("upload", 200, {
+                    "success": 1,
+                    "correlationId": str(uuid.uuid4()),
+                    "processedData": {"index_incarcare": config.random.randint(10 ** 9, 10 ** 10)}
+                })
+            self._reply("unknown", 404, {"success": 0, "errorMessage": "Not found"})
+
+        def do_GET(self):
+            if "/status/" in self.path:
+                if self._injected_failure("status"):
+                    return
+                state = "in prelucrare" if config.random.random() < config.pending_rate else "ok"
+                return self._reply("status", 200, {
+                    "success": 1,
+                    "correlationId": self.path.rsplit("/", 1)[-1],
+                    "processedData": {"stare": state}
+                })
+            self._reply("unknown", 404, {"success": 0, "errorMessage": "Not found"})
+
+        def _injected_failure(self, endpoint):
+            """Simulate latency, then answer with a 429 or 500 according to the configured rates"""
+            delay = config.latency_ms + config.random.uniform(-config.jitter_ms, config.jitter_ms)
+            time.sleep(max(delay, 0) / 1000)
+            roll = config.random.random()
+            if roll < config.throttle_rate:
+                self._reply(endpoint, 429, {"success": 0, "errorMessage": "Too many requests"},
+                            {"Retry-After": str(int(config.retry_after))})
+                return True
+            if roll < config.throttle_rate + config.error_rate:
+                self._reply(endpoint, 500, {"success": 0, "errorMessage": "Internal error"})
+                return True
+            return False
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _reply(self, endpoint, status, payload, headers=None):
+            server.count(f"{endpoint}:{status}")
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local ANAF e-Factura API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--pending-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    config = MockANAFConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                            args.retry_after, args.pending_rate)
+    server = MockANAFServer(config, args.host, args.port)
+    print(f"Mock ANAF listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(dict(server.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+## runner.py
+"""End-to-end benchmarks of XML generation, Schematron validation, signing and submission.
+
+Runs against synthetic invoices and the local ANAF stand-in, so no site is
+needed; pass --site to measure with the site's Redis (shared rate limiter,
+token cache) as well. Each scenario runs in a fresh process so peak RSS is
+its own. Examples:
+
+    python -m frappe_ro_efactura.benchmarks --invoices 500 --lines 20
+    python -m frappe_ro_efactura.benchmarks --scenario submit --latency-ms 120 --throttle-rate 0.05 --concurrency 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import frappe
+from .mock_anaf import MockANAFConfig, MockANAFServer
+from .synthetic import make_invoices, make_rule_corpus, make_signing_material
+
+DEFAULT_SCHEMATRON = Path(__file__).parent / "rules" / "benchmark.sch"
+PARITY_SCHEMATRON = Path(__file__).parents[1] / "tests" / "rules" / "en16931_subset.sch"
+SCENARIOS = ("generate", "validate", "sign", "submit", "pipeline", "engine", "parity")
+
+class StageTimer:
+    """Collects per-invoice durations for each pipeline stage"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def summary(self):
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+def summarize(samples):
+    """count, mean and p50/p95/p99 in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        "p50_ms": _ms(percentile(ordered, 50)),
+        "p95_ms": _ms(percentile(ordered, 95)),
+        "p99_ms": _ms(percentile(ordered, 99))
+    }
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return None
+    return ordered[max(int(round(percent / 100 * len(ordered))) - 1, 0)]
+
+def run_scenario(name, options):
+    """Run one scenario in this process and return its report"""
+    if options.get("site"):
+        frappe.init(site=options["site"], sites_path=options.get("sites_path") or ".")
+        frappe.connect()
+
+    invoices = make_invoices(options["invoices"], lines=options["lines"], seed=options["seed"])
+    timer = StageTimer()
+    try:
+        result = SCENARIO_RUNNERS[name](invoices, timer, options)
+    finally:
+        if options.get("site"):
+            frappe.destroy()
+
+    seconds = result.pop("seconds")
+    return {
+        "scenario": name,
+        "invoices": len(invoices),
+        "lines": options["lines"],
+        "seconds": round(seconds, 3),
+        "invoices_per_sec": round(len(invoices) / seconds, 2) if seconds else None,
+        "stages": timer.summary(),
+        "peak_rss_mb": _peak_rss_mb(),
+        **result
+    }
+
+def _generate(invoices, timer, options):
+    generator = _generator(options)
+    start = time.perf_counter()
+    for invoice in invoices:
+        with timer.stage("generate"):
+            generator.generate_ubl_21(_as_invoice(invoice))
+    return {"seconds": time.perf_counter() - start}
+
+def _validate(invoices, timer, options):
+    from frappe_ro_efactura.xml_generator import get_compiled_schematron
+
+    generator = _generator(options)
+    documents = [generator.generate_ubl_21(_as_invoice(invoice)) for invoice in invoices]
+    with timer.stage("compile"):
+        get_compiled_schematron(generator.schematron_file)
+
+    invalid = 0
+    start = time.perf_counter()
+    for xml in documents:
+        with timer.stage("validate"):
+            invalid += bool(generator.schematron_errors(xml))
+    return {"seconds": time.perf_counter() - start, "invalid": invalid}
+
+def _sign(invoices, timer, options):
+    from frappe_ro_efactura.digital_signer import SigningContext
+
+    generator = _generator(options)
+    documents = [generator.generate_ubl_21(_as_invoice(invoice)) for invoice in invoices]
+    with timer.stage("load_key"):
+        context = SigningContext(*make_signing_material())
+
+    start = time.perf_counter()
+    for xml in documents:
+        with timer.stage("sign"):
+            context.sign_xml(xml)
+    return {"seconds": time.perf_counter() - start}
+
+def _submit(invoices, timer, options):
+    generator = _generator(options)
+    payloads = {invoice["name"]: generator.generate_ubl_21(_as_invoice(invoice)) for invoice in invoices}
+    client = _client(timer, options)
+
+    outcomes = Counter()
+    start = time.perf_counter()
+    for chunk in _chunks(list(payloads.items()), options["concurrency"] * 4):
+        for response in client.send_xml_many(dict(chunk)).values():
+            outcomes[response.get("status")] += 1
+    seconds = time.perf_counter() - start
+    client.close()
+    return {"seconds": seconds, "outcomes": dict(outcomes)}
+
+def _pipeline(invoices, timer, options):
+    """Generate, validate and sign each invoice, uploading in batches the way the work queue does"""
+    from frappe_ro_efactura.digital_signer import SigningContext
+
+    generator = _generator(options)
+    context = SigningContext(*make_signing_material())
+    client = _client(timer, options)
+
+    outcomes = Counter()
+    start = time.perf_counter()
+    for chunk in _chunks(invoices, options["batch_size"]):
+        signed = {}
+        for invoice in chunk:
+            with timer.stage("generate"):
+                xml = generator.generate_ubl_21(_as_invoice(invoice))
+            with timer.stage("validate"):
+                errors = generator.schematron_errors(xml)
+            if errors:
+                outcomes["invalid"] += 1
+                continue
+            with timer.stage("sign"):
+                signed[invoice["name"]] = context.sign_xml(xml)
+        for response in client.send_xml_many(signed).values():
+            outcomes[response.get("status")] += 1
+    seconds = time.perf_counter() - start
+    client.close()
+    return {"seconds": seconds, "outcomes": dict(outcomes)}
+
+def _engine(invoices, timer, options):
+    """Process-pool generation and validation; reports throughput, not per-invoice latency"""
+    from frappe_ro_efactura.xml_engine import PROCESS_POOL_MIN_INVOICES, XMLEngine
+
+    engine = XMLEngine(processes=options["processes"], schematron_file=options["schematron"])
+    try:
+        with timer.stage("warm_up"):
+            # Starts the pool and compiles the Schematron in every worker
+            engine.run(invoices[:max(PROCESS_POOL_MIN_INVOICES, options["processes"])])
+        start = time.perf_counter()
+        with timer.stage("engine_batch"):
+            results = engine.run(invoices)
+        seconds = time.perf_counter() - start
+    finally:
+        engine.close()
+    return {"seconds": seconds, "invalid": sum(1 for result in results if result["errors"])}
+
+def _parity(invoices, timer, options):
+    """Native invoice rules against the Schematron verdict, on every rule-breaking variant of each invoice.
+
+    A case passes when its expected rule fires and the native rules shared with
+    Schematron (invoice_rules.SCHEMATRON_RULES) report exactly what Schematron does.
+    The reference is the transcribed EN 16931 subset, not the reduced benchmark rules.
+    """
+    from frappe_ro_efactura.invoice_rules import SCHEMATRON_RULES, check_invoice, rule_id
+    from frappe_ro_efactura.xml_generator import XMLGenerator
+
+    generator = XMLGenerator(options["parity_schematron"])
+    cases = defaultdict(Counter)
+    mismatches = []
+    start = time.perf_counter()
+    for case, rule, snapshot in make_rule_corpus(invoices):
+        invoice = _as_invoice(snapshot)
+        with timer.stage("rules"):
+            native = {violation["rule"] for violation in check_invoice(invoice)}
+        xml = generator.generate_ubl_21(invoice)
+        with timer.stage("schematron"):
+            schematron = {rule_id(error["message"]) for error in generator.schematron_errors(xml)}
+
+        detected = rule in native if rule else not native
+        agrees = native & SCHEMATRON_RULES == schematron
+        cases[case]["total"] += 1
+        cases[case]["passed"] += detected and agrees
+        if not (detected and agrees) and len(mismatches) < 10:
+            mismatches.append({"case": case, "native": sorted(native), "schematron": sorted(schematron)})
+
+    parity = {case: f"{counts['passed']}/{counts['total']}" for case, counts in cases.items()}
+    return {"seconds": time.perf_counter() - start, "parity": parity, "mismatches": mismatches}
+
+SCENARIO_RUNNERS = {
+    "generate": _generate,
+    "validate": _validate,
+    "sign": _sign,
+    "submit": _submit,
+    "pipeline": _pipeline,
+    "engine": _engine,
+    "parity": _parity
+}
+
+def _generator(options):
+    from frappe_ro_efactura.xml_generator import XMLGenerator
+    return XMLGenerator(options["schematron"])
+
+def _client(timer, options):
+    """ANAFClient pointed at the mock, timing every HTTP exchange as the upload stage"""
+    from frappe_ro_efactura.anaf_client import ANAFClient
+
+    concurrency = options["concurrency"]
+    client = ANAFClient(None, config={
+        "api_url": options["api_url"],
+        "auth_type": "OAuth2",
+        "oauth_creds": {"client_id": "benchmark", "client_secret": "benchmark"},
+        "pool_size": concurrency,
+        "concurrency": concurrency,
+        "rate_limits": {"upload": options["rate_limit"], "status": options["rate_limit"],
+                        "burst": concurrency * 2, "backoff": 0.5}
+    })
+    # The mock speaks plain HTTP; give it the same pooled, retrying adapter as https
+    client.session.mount("http://", client._build_adapter())
+    client.session.hooks["response"].append(
+        lambda response, *args, **kwargs: timer.samples["upload"].append(response.elapsed.total_seconds())
+    )
+    return client
+
+def _as_invoice(snapshot):
+    invoice = frappe._dict(snapshot)
+    invoice["items"] = [frappe._dict(item) for item in snapshot["items"]]
+    return invoice
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def _peak_rss_mb():
+    """High-water RSS of this process or its largest child (process pools), in MB"""
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return round(peak / divisor, 1)
+
+def print_report(reports, mock_stats=None):
+    for report in reports:
+        print(f"\n{report['scenario']}: {report['invoices']} invoices x {report['lines']} lines in "
+              f"{report['seconds']}s = {report['invoices_per_sec']} invoices/s, peak RSS {report['peak_rss_mb']} MB")
+        for key in ("invalid", "outcomes", "parity", "mismatches"):
+            if key in report:
+                print(f"  {key}: {report[key]}")
+        for stage, stats in report["stages"].items():
+            print(f"  {stage:<14} n={stats['count']:<6} p50={stats['p50_ms']}ms "
+                  f"p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    if mock_stats:
+        print(f"\nmock ANAF responses: {dict(sorted(mock_stats.items()))}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="e-Factura pipeline benchmarks")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS + ("all",))
+    parser.add_argument("--invoices", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--schematron", default=str(DEFAULT_SCHEMATRON))
+    parser.add_argument("--parity-schematron", default=str(PARITY_SCHEMATRON),
+                        help="EN 16931 rules the parity scenario compares the native rules with")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rate-limit", type=float, default=1000, help="requests/s allowed by the client limiter")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--api-url", help="use a running ANAF stand-in instead of starting one")
+    parser.add_argument("--site", help="run inside this site's Frappe context (Redis rate limiter and token cache)")
+    parser.add_argument("--sites-path", default=".")
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--no-isolate", action="store_true", help="run scenarios in this process")
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS if not args.scenario or "all" in args.scenario else tuple(dict.fromkeys(args.scenario))
+    options = {
+        "invoices": args.invoices, "lines": args.lines, "seed": args.seed, "schematron": args.schematron,
+        "parity_schematron": args.parity_schematron,
+        "concurrency": args.concurrency, "batch_size": args.batch_size, "processes": args.processes,
+        "rate_limit": args.rate_limit, "site": args.site, "sites_path": args.sites_path
+    }
+
+    server = None
+    if not args.api_url and {"submit", "pipeline"} & set(scenarios):
+        server = MockANAFServer(MockANAFConfig(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate, seed=args.seed
+        )).start()
+    options["api_url"] = args.api_url or (server.url if server else None)
+
+    reports = []
+    try:
+        for name in scenarios:
+            if args.no_isolate:
+                reports.append(run_scenario(name, options))
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                reports.append(executor.submit(run_scenario, name, options).result())
+    finally:
+        if server:
+            server.stop()
+
+    print_report(reports, server.stats if server else None)
+    if args.json:
+        Path(args.json).write_text(json.dumps(reports, indent=2, default=str))
+    return reports
@@ -0,0 +1,144 @@
+## synthetic.py
+"""Synthetic Sales Invoice snapshots and signing material for benchmarks"""
+import copy
+import datetime
+import random
+
+UNIT_CODES = ("H87", "C62", "KGM", "MTR", "HUR")
+VAT_RATE = 19
+
+def make_invoice(index, lines=10, seed=None):
+    """Plain-dict invoice snapshot in the shape XMLEngine and XMLGenerator consume"""
+    rng = random.Random(f"{seed}-{index}" if seed is not None else None)
+    items = []
+    for idx in range(1, lines + 1):
+        qty = rng.randint(1, 50)
+        rate = round(rng.uniform(1, 500), 2)
+        items.append({
+            "idx": idx,
+            "item_name": f"Articol sintetic {idx}",
+            "qty": qty,
+            "uom": rng.choice(UNIT_CODES),
+            "rate": rate,
+            "amount": round(qty * rate, 2)
+        })
+
+    net_total = round(sum(item["amount"] for item in items), 2)
+    total_taxes = round(net_total * VAT_RATE / 100, 2)
+    return {
+        "name": f"BENCH-SINV-{index:06d}",
+        "posting_date": datetime.date(2026, 1, 1) + datetime.timedelta(days=index % 365),
+        "currency": "RON",
+        "company": "Benchmark SRL",
+        "customer": f"Client {index % 500}",
+        "net_total": net_total,
+        "total_taxes_and_charges": total_taxes,
+        "grand_total": round(net_total * (100 + VAT_RATE) / 100, 2),
+        "docstatus": 1,
+        "items": items,
+        "taxes": [{"idx": 1, "charge_type": "On Net Total", "account_head": "4427 - TVA colectata - BS", "account_type": "Tax",
+                   "rate": VAT_RATE, "tax_amount": total_taxes, "tax_amount_after_discount_amount": total_taxes}],
+        "supplier_party": _party("Benchmark SRL", "RO12345674", "Bucuresti", "RO-B"),
+        "customer_party": _party(f"Client {index % 500}", f"RO{10000000 + index % 500}", "Cluj-Napoca", "RO-CJ")
+    }
+
+def make_invoices(count, lines=10, seed=0):
+    return [make_invoice(index, lines=lines, seed=seed) for index in range(count)]
+
+def _set_line(field, value):
+    def mutate(invoice):
+        invoice["items"][0][field] = value
+    return mutate
+
+def _set_party(party, field, value):
+    def mutate(invoice):
+        invoice[party][field] = value
+        if field == "name":
+            invoice[party]["party_name"] = value
+    return mutate
+
+def _set(field, value):
+    def mutate(invoice):
+        invoice[field] = value
+    return mutate
+
+def _shift_net_total(invoice):
+    invoice["net_total"] = round(invoice["net_total"] + 10, 2)
+
+# Rule-breaking variants of a valid invoice: case -> (rule expected to fire, mutation)
+RULE_CASES = {
+    "valid": (None, lambda invoice: None),
+    "no_number": ("BR-02", _set("name", "")),
+    "no_issue_date": ("BR-03", _set("posting_date", None)),
+    "no_currency": ("BR-05", _set("currency", "")),
+    "unknown_currency": ("BR-CL-04", _set("currency", "LEI")),
+    "no_lines": ("BR-16", _set("items", [])),
+    "no_seller_name": ("BR-06", _set_party("supplier_party", "name", "")),
+    "no_seller_cui": ("BR-CO-26", _set_party("supplier_party", "tax_id", "")),
+    "bad_cui_check_digit": ("RO-CUI", _set_party("supplier_party", "tax_id", "RO12345678")),
+    "no_buyer_name": ("BR-07", _set_party("customer_party", "name", "")),
+    "no_line_id": ("BR-21", _set_line("idx", None)),
+    "no_quantity": ("BR-22", _set_line("qty", None)),
+    "blank_quantity": ("BR-23", _set_line("qty", "")),
+    "erpnext_unit": (None, _set_line("uom", "Nos")),
+    "unmapped_unit": ("BR-CL-23", _set_line("uom", "Palet")),
+    "no_item_name": ("BR-25", _set_line("item_name", "")),
+    "line_amount": ("RO-LINE-AMOUNT", _set_line("amount", 0.5)),
+    "net_total": ("BR-CO-10", _shift_net_total),
+    "grand_total": ("BR-CO-15", _set("grand_total", 1)),
+    "vat_breakdown": ("BR-CO-14", lambda invoice: invoice["taxes"][0].update(tax_amount_after_discount_amount=0)),
+    "vat_rate": ("RO-VAT-RATE", lambda invoice: invoice["taxes"][0].update(rate=20)),
+}
+
+def make_rule_corpus(invoices):
+    """Every RULE_CASES variant of every invoice, as (case, expected rule, invoice)"""
+    corpus = []
+    for invoice in invoices:
+        for case, (rule, mutate) in RULE_CASES.items():
+            variant = copy.deepcopy(invoice)
+            mutate(variant)
+            corpus.append((case, rule, variant))
+    return corpus
+
+def make_signing_material(common_name="e-Factura Benchmark"):
+    """Self-signed RSA certificate and key as PEM strings"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        certificate.public_bytes(serialization.Encoding.PEM).decode(),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        ).decode()
+    )
+
+def _party(name, tax_id, city, state):
+    return {
+        "name": name,
+        "party_name": name,
+        "tax_id": tax_id,
+        "address": {
+            "address_line1": "Strada Exemplu 1",
+            "city": city,
+            "state": state,
+            "pincode": "010101",
+            "country_code": "RO"
+        }
+    }
@@ -0,0 +1,24 @@
+## commands.py
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+@click.command("efactura-regenerate-xml")
+@click.option("--transaction", "transactions", multiple=True, help="Only regenerate these transactions")
+@click.option("--processes", type=int, default=None, help="Worker processes (defaults to all cores)")
+@pass_context
+def regenerate_xml(context, transactions=None, processes=None):
+    """Regenerate and validate XML of Draft and Validation Failed e-Factura transactions"""
+    from frappe_ro_efactura.xml_engine import regenerate_transactions_xml
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        summary = regenerate_transactions_xml(names=list(transactions) or None, processes=processes)
+        click.echo(f"{summary['valid']} valid, {len(summary['invalid'])} failed validation")
+        for name, errors in summary["invalid"].items():
+            click.echo(f"{name}: {errors[0]['message']}")
+    finally:
+        frappe.destroy()
+
+commands = [regenerate_xml]
@@ -0,0 +1,145 @@
+## digital_signer.py
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+import xmlsec
+import frappe
+from frappe import _
+from frappe.utils import cint
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+PROCESS_POOL_MIN_DOCUMENTS = 20  # below this, process fan-out costs more than it saves
+
+# Loaded signing contexts per worker: (site, key fingerprint) -> SigningContext
+_signing_contexts = {}
+_signing_contexts_lock = threading.Lock()
+
+# Signer of a process-pool worker, loaded once by _init_pool_worker
+_pool_signer = None
+
+class SigningError(Exception):
+    """Picklable signing failure returned by sign_many for a single document"""
+
+class DigitalSigner:
+    def __init__(self, certificate, private_key):
+        """Load the PEM private key and certificate into an xmlsec key"""
+        if not certificate or not private_key:
+            frappe.throw(_("Signing certificate and private key are required"))
+
+        self.key = xmlsec.Key.from_memory(_to_bytes(private_key), xmlsec.constants.KeyDataFormatPem, None)
+        self.key.load_cert_from_memory(_to_bytes(certificate), xmlsec.constants.KeyDataFormatCertPem)
+
+    @timed("sign")
+    def sign_xml(self, xml_data) -> bytes:
+        """Add an enveloped XMLDSig (RSA-SHA256, exclusive C14N) to the document"""
+        root = etree.fromstring(_to_bytes(xml_data))
+        signature_node = xmlsec.template.create(
+            root,
+            xmlsec.constants.TransformExclC14N,
+            xmlsec.constants.TransformRsaSha256
+        )
+        root.append(signature_node)
+
+        reference = xmlsec.template.add_reference(signature_node, xmlsec.constants.TransformSha256)
+        xmlsec.template.add_transform(reference, xmlsec.constants.TransformEnveloped)
+        key_info = xmlsec.template.ensure_key_info(signature_node)
+        xmlsec.template.add_x509_data(key_info)
+
+        context = xmlsec.SignatureContext()
+        context.key = self.key
+        context.sign(signature_node)
+        return etree.tostring(root, encoding='utf-8', xml_declaration=True)
+
+class SigningContext:
+    """Long-lived signer for one key/certificate pair, optionally fanning out to a process pool"""
+
+    def __init__(self, certificate, private_key, processes=0, fingerprint=None):
+        self.certificate = certificate
+        self.fingerprint = fingerprint or _key_fingerprint(certificate, private_key)
+        self.private_key = private_key
+        self.processes = processes
+        self.signer = DigitalSigner(certificate=certificate, private_key=private_key)
+        self._pool = None
+        self._pool_pid = None
+
+    def sign_xml(self, xml_data) -> bytes:
+        return self.signer.sign_xml(xml_data)
+
+    @timed("sign_batch")
+    def sign_many(self, xml_documents):
+        """Sign a list of documents, returning signed bytes or a SigningError per position"""
+        xml_documents = [_to_bytes(xml) for xml in xml_documents]
+        if self.processes > 1 and len(xml_documents) >= PROCESS_POOL_MIN_DOCUMENTS:
+            try:
+                chunksize = max(len(xml_documents) // (self.processes * 4), 1)
+                return list(self._get_pool().map(_sign_in_pool_worker, xml_documents, chunksize=chunksize))
+            except Exception as e:
+                logger.warning(f"Process pool signing failed, signing inline: {str(e)}")
+                self.close()
+
+        return [_sign_or_error(self.signer, xml) for xml in xml_documents]
+
+    def close(self):
+        """Shut down the process pool, if one was started by this process"""
+        if self._pool and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def _get_pool(self):
+        """Spawned workers load the key once; spawn avoids forking a threaded RQ worker"""
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pool_worker,
+                initargs=(self.certificate, self.private_key)
+            )
+            self._pool_pid = os.getpid()
+        return self._pool
+
+def get_signing_context(settings):
+    """Signing context for the current settings, loaded once per worker and key fingerprint"""
+    certificate = settings.decrypted_certificate
+    private_key = settings.get_decrypted_private_key()
+    processes = cint(settings.get("signing_processes"))
+    fingerprint = _key_fingerprint(certificate, private_key)
+    key = (getattr(frappe.local, 'site', None), fingerprint)
+
+    with _signing_contexts_lock:
+        context = _signing_contexts.get(key)
+        if context and context.processes == processes:
+            return context
+
+        if context:
+            context.close()
+        for stale_key in [k for k in _signing_contexts if k[0] == key[0]]:
+            # Certificate was rotated: drop the previous key for this site
+            _signing_contexts.pop(stale_key).close()
+
+        context = SigningContext(certificate, private_key, processes=processes, fingerprint=fingerprint)
+        _signing_contexts[key] = context
+        return context
+
+def _key_fingerprint(certificate, private_key):
+    return hashlib.sha256(_to_bytes(certificate or "") + b"\0" + _to_bytes(private_key or "")).hexdigest()
+
+def _init_pool_worker(certificate, private_key):
+    global _pool_signer
+    _pool_signer = DigitalSigner(certificate=certificate, private_key=private_key)
+
+def _sign_in_pool_worker(xml_data):
+    return _sign_or_error(_pool_signer, xml_data)
+
+def _sign_or_error(signer, xml_data):
+    try:
+        return signer.sign_xml(xml_data)
+    except Exception as e:
+        return SigningError(str(e))
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
@@ -1,85 +1,102 @@
 ## efactura.py
 import frappe
+import time
 from frappe import _
 from frappe.utils.background_jobs import enqueue
 from frappe.model.document import Document
 import logging
-from .efactura_transaction import EFacturaTransaction
+from .efactura_transaction import CANCELLABLE_STATUSES, SUBMIT_JOB_TIMEOUT, EFacturaTransaction, transition_status
+# Kept importable from here for existing API callers; implemented once in efactura_transaction
+from .efactura_transaction import submit_transaction, retry_transaction  # noqa: F401
+from .efactura_settings import get_efactura_settings
 
 logger = logging.getLogger(__name__)
+SUBMIT_LATENCY_KEY = "efactura:submit_latency"
+SUBMIT_LATENCY_SAMPLES = 1000
 
 def trigger_einvoice_submission(doc, method):
     """Automatically create and submit e-invoice transaction when Sales Invoice is submitted"""
+    start = time.perf_counter()
+    deferred = _deferred_generation_enabled()
     try:
         if _should_skip_einvoice(doc):
             return
 
-        transaction = _create_transaction_doc(doc)
+        transaction = _create_transaction_doc(doc, defer_xml=deferred)
         _update_invoice_fields(doc, transaction)
-        _enqueue_submission(transaction.name)
+        if not _batch_submission_enabled():
+            _enqueue_submission(transaction.name)
 
+    except frappe.ValidationError:
+        # Invoice rule violations are shown to the user as they are, all at once
+        raise
     except Exception as e:
         logger.error(_("E-Invoice submission failed for {0}: {1}").format(doc.name, str(e)), exc_info=True)
         frappe.throw(_("E-Invoice initialization failed. See logs for details."), exc=e)
 
-def retry_failed_submissions():
-    """Scheduled job to automatically retry failed submissions with exponential backoff"""
-    failed_transactions = frappe.get_all(
-        "EFactura Transaction",
-        filters={"status": "Failed", "retry_count": ["<", 3]},
-        pluck="name"
-    )
-    
-    for docname in failed_transactions:
-        enqueue(
-            "frappe_ro_efactura.efactura._retry_transaction_job",
-            queue="long",
-            docname=docname,
-            enqueue_after_commit=True
-        )
+    # Only submits that created a transaction are comparable between the two modes
+    _record_submit_latency(time.perf_counter() - start, deferred)
 
 def handle_invoice_cancellation(doc, method):
     """Prevent cancellation of invoices with active e-invoice transactions"""
     if not doc.efactura_transaction:
         return
 
-    transaction = frappe.get_doc("EFactura Transaction", doc.efactura_transaction)
-    if transaction.status == "Submitted":
+    # Only matches while not claimed by a worker, so a transaction being uploaded is never cancelled
+    if not transition_status(doc.efactura_transaction, "Cancelled", from_status=CANCELLABLE_STATUSES):
         frappe.throw(_("Cannot cancel invoice with active e-invoice submission. Revoke ANAF submission first."))
-    
-    transaction.db_set("status", "Cancelled")
+
     doc.db_set("efactura_status", "Cancelled")
 
 @frappe.whitelist()
-def submit_transaction(docname: str):
-    """Public endpoint for transaction submission with lock checking"""
-    doc = frappe.get_doc("EFactura Transaction", docname)
-    if doc.status in ["Processing", "Submitted"]:
-        return
+def get_submit_latency_stats():
+    """p50/p95 of the time on_submit spends in e-Factura, per generation mode, over recent submits"""
+    frappe.only_for("System Manager")
+    stats = {}
+    for mode in ("inline", "deferred"):
+        samples = sorted(float(v) for v in frappe.cache().lrange(f"{SUBMIT_LATENCY_KEY}:{mode}", 0, -1))
+        stats[mode] = {
+            "count": len(samples),
+            "p50_ms": _percentile(samples, 50),
+            "p95_ms": _percentile(samples, 95)
+        }
+    return stats
 
-    with frappe.document_lock(doc):
-        doc.reload()
-        doc.submit_to_anaf()
+def _record_submit_latency(seconds, deferred):
+    """Keep the most recent on_submit durations in Redis; measuring must never break a submit"""
+    key = f"{SUBMIT_LATENCY_KEY}:{'deferred' if deferred else 'inline'}"
+    try:
+        frappe.cache().lpush(key, round(seconds * 1000, 3))
+        frappe.cache().ltrim(key, 0, SUBMIT_LATENCY_SAMPLES - 1)
+    except Exception as e:
+        logger.warning(f"Could not record e-Factura submit latency: {str(e)}")
 
-@frappe.whitelist()
-def retry_transaction(docname: str):
-    """Public endpoint for transaction retries with concurrency control"""
-    doc = frappe.get_doc("EFactura Transaction", docname)
-    with frappe.document_lock(doc):
-        doc.reload()
-        doc.retry_failed()
+def _percentile(samples, percent):
+    """Nearest-rank percentile of sorted samples"""
+    if not samples:
+        return None
+    return samples[max(int(round(percent / 100 * len(samples))) - 1, 0)]
+
+def _deferred_generation_enabled() -> bool:
+    """Whether on_submit only records the transaction and XML is generated in the background"""
+    return bool(get_efactura_settings().get("deferred_xml_generation"))
+
+def _batch_submission_enabled() -> bool:
+    """Whether submissions are grouped by the batch scheduler instead of one job per invoice"""
+    return bool(get_efactura_settings().get("batch_submission"))
 
 def _should_skip_einvoice(doc) -> bool:
     """Determine if e-invoice should be skipped for this document"""
     return doc.is_return or doc.efactura_transaction or doc.docstatus != 1
 
-def _create_transaction_doc(doc) -> Document:
+def _create_transaction_doc(doc, defer_xml=False) -> Document:
     """Create new EFacturaTransaction document"""
     transaction = frappe.new_doc("EFactura Transaction")
     transaction.update({
         "invoice_link": doc.name,
         "status": "Draft"
     })
+    transaction.flags.defer_xml = defer_xml
     transaction.insert(ignore_permissions=True)
     return transaction
 
@@ -93,16 +110,9 @@ def _update_invoice_fields(doc, transaction) -> None:
 def _enqueue_submission(docname: str) -> None:
     """Queue submission job with priority handling"""
     enqueue(
-        "frappe_ro_efactura.efactura.submit_transaction",
+        "frappe_ro_efactura.efactura_transaction.submit_transaction",
         queue="short",
         docname=docname,
-        timeout=300,
+        timeout=SUBMIT_JOB_TIMEOUT,
         enqueue_after_commit=True
     )
-
-def _retry_transaction_job(docname: str) -> None:
-    """Wrapper for safe retry execution"""
-    try:
-        retry_transaction(docname)
-    except Exception as e:
-        logger.error(_("Retry failed for {0}: {1}").format(docname, str(e)), exc_info=True)
@@ -2,11 +2,38 @@
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from frappe.utils import cint, flt
+import threading
+
+DEFAULT_HTTP_POOL_SIZE = 10
+DEFAULT_UPLOAD_CONCURRENCY = 4
+DEFAULT_UPLOAD_RATE_LIMIT = 5
+DEFAULT_STATUS_RATE_LIMIT = 10
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_THROTTLE_BACKOFF = 0.5
+SETTINGS_VERSION_KEY = "efactura_settings_version"
+
+# Per-worker settings snapshots: site -> (version, EFacturaSettings)
+_settings_snapshots = {}
+_settings_snapshots_lock = threading.Lock()
 
 class EFacturaSettings(Document):
     def validate(self):
         """Validate authentication credentials based on selected method"""
         self.validate_authentication_credentials()
+        self.validate_rate_limits()
+
+    def on_update(self):
+        """Invalidate worker snapshots once the new settings are committed"""
+        frappe.db.after_commit.add(bump_settings_version)
+
+    def validate_rate_limits(self):
+        """Keep the throttling parameters within usable bounds"""
+        if flt(self.get("throttle_backoff_factor")) and not 0 < flt(self.get("throttle_backoff_factor")) < 1:
+            frappe.throw(_("Throttle Backoff Factor must be between 0 and 1"))
+        for fieldname in ("upload_rate_limit", "status_rate_limit", "rate_limit_burst"):
+            if flt(self.get(fieldname)) < 0:
+                frappe.throw(_("{0} cannot be negative").format(self.meta.get_label(fieldname)))
 
     def validate_authentication_credentials(self):
         """Ensure required fields for each authentication method"""
@@ -19,13 +46,30 @@ class EFacturaSettings(Document):
         else:
             frappe.throw(_("Invalid authentication method selected"))
 
+    def is_configured(self):
+        """Check that the selected authentication method has its credentials"""
+        if self.auth_method == "Certificate":
+            return bool(self.client_certificate)
+        if self.auth_method == "OAuth2":
+            return bool(self.oauth_client_id and self.oauth_client_secret)
+        return False
+
     def configure_connection(self):
         """Prepare connection parameters for ANAF API client"""
         return {
             "api_url": self.anaf_api_url,
             "auth_type": self.auth_method,
             "certificate": self.decrypted_certificate if self.auth_method == "Certificate" else None,
-            "oauth_creds": self.oauth_credentials if self.auth_method == "OAuth2" else None
+            "private_key": self.get_decrypted_private_key() if self.auth_method == "Certificate" else None,
+            "oauth_creds": self.oauth_credentials if self.auth_method == "OAuth2" else None,
+            "pool_size": cint(self.get("http_pool_size")) or DEFAULT_HTTP_POOL_SIZE,
+            "concurrency": cint(self.get("upload_concurrency")) or DEFAULT_UPLOAD_CONCURRENCY,
+            "rate_limits": {
+                "upload": flt(self.get("upload_rate_limit")) or DEFAULT_UPLOAD_RATE_LIMIT,
+                "status": flt(self.get("status_rate_limit")) or DEFAULT_STATUS_RATE_LIMIT,
+                "burst": cint(self.get("rate_limit_burst")) or DEFAULT_RATE_LIMIT_BURST,
+                "backoff": flt(self.get("throttle_backoff_factor")) or DEFAULT_THROTTLE_BACKOFF
+            }
         }
 
     @property
@@ -40,20 +84,51 @@ class EFacturaSettings(Document):
     @property
     def decrypted_certificate(self):
         """Get decrypted client certificate for authentication"""
-        return frappe.get_decrypted_password(
-            self.doctype, 
-            self.name, 
-            'client_certificate'
-        )
+        return self._get_secret('client_certificate')
 
     @property
     def oauth_credentials(self):
         """Get OAuth credentials as a secure dictionary"""
         return {
             "client_id": self.oauth_client_id,
-            "client_secret": frappe.get_decrypted_password(
+            "client_secret": self._get_secret('oauth_client_secret')
+        }
+
+    def get_decrypted_private_key(self):
+        """Get decrypted private key used for XML signatures"""
+        return self._get_secret('private_key')
+
+    def _get_secret(self, fieldname):
+        """Decrypt a password field once per settings instance"""
+        secrets = self.__dict__.setdefault('_decrypted_secrets', {})
+        if fieldname not in secrets:
+            secrets[fieldname] = frappe.get_decrypted_password(
                 self.doctype,
                 self.name,
-                'oauth_client_secret'
+                fieldname,
+                raise_exception=False
             )
-        }
+        return secrets[fieldname]
+
+def get_efactura_settings():
+    """Settings snapshot for this worker, with secrets decrypted once until the settings are saved again"""
+    site = getattr(frappe.local, 'site', None)
+    version = frappe.cache().get_value(SETTINGS_VERSION_KEY) or "0"
+
+    with _settings_snapshots_lock:
+        cached = _settings_snapshots.get(site)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    settings = frappe.get_single("EFactura Settings")
+    with _settings_snapshots_lock:
+        _settings_snapshots[site] = (version, settings)
+    return settings
+
+def schematron_on_drafts():
+    """Whether Schematron runs when draft XML is generated, or only as the final gate before submission"""
+    return get_efactura_settings().get("schematron_validation") != "Before Submission"
+
+def bump_settings_version():
+    """Publish a new settings version so every worker reloads its snapshot"""
+    frappe.cache().set_value(SETTINGS_VERSION_KEY, frappe.generate_hash(length=12))
@@ -3,14 +3,42 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 import logging
-from .xml_generator import XMLGenerator
-from .anaf_client import ANAFClient
-from .digital_signer import DigitalSigner
-from frappe.utils import get_url_to_form, get_datetime, now_datetime
-from frappe.utils.pdf import get_pdf
-from frappe.utils.jinja import get_jenv
+import random
+from itertools import chain, islice
+import xmlsec
+from .xml_generator import STREAMING_LINE_THRESHOLD, XMLGenerator
+from .invoice_loader import iter_invoice_items, load_invoice_snapshot
+from .anaf_client import get_pooled_client
+from .efactura_settings import get_efactura_settings, schematron_on_drafts
+from .digital_signer import get_signing_context
+from .payload_cache import get_generated_xml, sign_with_cache, store_generated_xml
+from .invoice_rules import check_invoice, format_violations
+from .invoice_status_sync import sync_invoice_statuses
+from .metrics import record_queue_wait, timed
+from .payload_store import INLINE_FIELDS, PayloadWriter, delete_payloads, load_payload, offload_response_updates, save_payload
+from frappe.utils import add_to_date, get_url_to_form, now_datetime
 
 logger = logging.getLogger(__name__)
+MAX_RETRIES = 3
+FIRST_STATUS_CHECK_MINUTES = 2
+RETRY_BASE_MINUTES = 5
+MAX_RETRY_INTERVAL_MINUTES = 6 * 60
+SUBMIT_JOB_TIMEOUT = 300
+# A claim outliving the job that holds it belongs to a dead worker and is released by the work queue
+CLAIM_LEASE_SECONDS = SUBMIT_JOB_TIMEOUT + 60
+
+# Allowed status changes, enforced on document saves and by transition_status
+STATUS_TRANSITIONS = {
+    "Draft": ["Submitted", "Processing", "Validation Failed", "Cancelled"],
+    "Processing": ["Submitted", "Failed", "Validation Failed", "Cancelled"],
+    "Validation Failed": ["Draft", "Cancelled"],
+    "Failed": ["Processing", "Cancelled"],
+    "Submitted": ["Accepted", "Rejected"],
+    "Rejected": ["Cancelled"]
+}
+# Processing -> Cancelled is only for the lease-guarded batch write-back; a user
+# cancelling the invoice must not take a transaction a worker is uploading
+CANCELLABLE_STATUSES = ("Draft", "Validation Failed", "Failed", "Rejected")
 
 class EFacturaTransaction(Document):
     def validate(self):
@@ -18,22 +46,15 @@ class EFacturaTransaction(Document):
         if not self.invoice_link:
             frappe.throw(_("Sales Invoice link is mandatory"), title=_("Missing Reference"))
             
-        if self.status == "Draft" and not self.xml_data:
+        if self.status == "Draft" and not self.has_xml() and not self.flags.defer_xml:
             self.generate_initial_xml()
             self.validate_xml_structure()
 
     def before_save(self):
         """Enforce valid status transitions and set timestamps"""
-        status_transitions = {
-            "Draft": ["Submitted", "Processing", "Validation Failed"],
-            "Processing": ["Submitted", "Failed"],
-            "Validation Failed": ["Draft"],
-            "Failed": ["Processing"]
-        }
-        
         if self._doc_before_save:
             previous_status = self._doc_before_save.status
-            if self.status not in status_transitions.get(previous_status, []):
+            if self.status != previous_status and self.status not in STATUS_TRANSITIONS.get(previous_status, []):
                 frappe.throw(_("Invalid status transition from {0} to {1}").format(
                     previous_status, self.status
                 ))
@@ -41,51 +62,168 @@ class EFacturaTransaction(Document):
         if self.status == "Processing":
             self.submission_time = now_datetime()
 
+        self._offload_payloads()
+
+    def on_trash(self):
+        delete_payloads(self.name)
+
+    def has_xml(self) -> bool:
+        """Whether XML exists, inline or in the payload store"""
+        return bool(self.xml_data or self.xml_hash)
+
+    def get_payload(self, kind):
+        """Payload of this transaction, loaded from the payload store only when first needed"""
+        fieldname = INLINE_FIELDS.get(kind)
+        if fieldname and self.get(fieldname):
+            return self.get(fieldname)
+
+        payloads = self.__dict__.setdefault('_payloads', {})
+        if kind not in payloads:
+            payloads[kind] = load_payload(self.name, kind)
+        return payloads[kind]
+
+    def _offload_payloads(self):
+        """Move large payloads out of the document row into the compressed payload store"""
+        payloads = self.__dict__.setdefault('_payloads', {})
+        for kind, fieldname in INLINE_FIELDS.items():
+            value = self.get(fieldname)
+            if not value:
+                continue
+
+            payload_hash = save_payload(self.name, kind, value)
+            payloads[kind] = value.decode('utf-8') if isinstance(value, bytes) else value
+            self.set(fieldname, None)
+            if kind == "xml":
+                self.xml_hash = payload_hash
+
     def generate_initial_xml(self):
         """Generate and validate initial XML with proper error containment"""
         try:
-            invoice = frappe.get_doc("Sales Invoice", self.invoice_link)
-            invoice.add_einvoice_metadata()  # Ensure custom fields exist
-            
             generator = XMLGenerator()
-            self.xml_data = generator.generate_ubl_21(invoice)
+            # Only the columns the UBL mapping needs, not the full document with all child tables
+            invoice = load_invoice_snapshot(self.invoice_link, with_items=False, with_taxes=True)
+            lines = iter_invoice_items(self.invoice_link, chunk_size=STREAMING_LINE_THRESHOLD)
+            first_lines = list(islice(lines, STREAMING_LINE_THRESHOLD))
+            if len(first_lines) >= STREAMING_LINE_THRESHOLD:
+                # Stream the remaining lines from the database and the XML into the payload store
+                self.validate_invoice_rules(invoice)
+                with PayloadWriter(self.name, "xml") as output:
+                    generator.stream_ubl_21(invoice, chain(first_lines, lines), output)
+                self.xml_data = None
+                self.xml_hash = output.payload_hash
+                self.__dict__.get('_payloads', {}).pop("xml", None)
+                return
+
+            invoice["items"] = first_lines
+            self.validate_invoice_rules(invoice)
+
+            # Identical invoice content always maps to the identical XML payload
+            self.content_hash = generator.content_hash(invoice)
+            self.xml_data = get_generated_xml(self.content_hash)
+            if self.xml_data is None:
+                self.xml_data = generator.generate_ubl_21(invoice)
+                store_generated_xml(self.content_hash, self.xml_data)
+        except frappe.ValidationError:
+            raise
         except Exception as e:
             self.status = "Validation Failed"
             self.log_error(_("XML generation error: {0}").format(str(e)))
             frappe.throw(_("Failed to generate initial XML"), exc=e)
 
+    def prepare_deferred_xml(self) -> bool:
+        """Generate XML skipped at on_submit; a failure is recorded as Validation Failed instead of raised"""
+        remarks = None
+        try:
+            self.generate_initial_xml()
+            self.validate_xml_structure()
+        except Exception as e:
+            self.status = "Validation Failed"
+            remarks = str(e).replace("<br>", "\n")
+        self.save(ignore_permissions=True)
+        sync_invoice_statuses({self.invoice_link: {"efactura_status": self.status, "efactura_remarks": remarks}})
+        frappe.db.commit()
+        return self.status == "Draft"
+
+    def validate_invoice_rules(self, invoice):
+        """Native checks of the invoice data, reporting every violation at once before any XML is built"""
+        violations = check_invoice(invoice)
+        if violations:
+            self.status = "Validation Failed"
+            self.log_error(_("Invoice rules failed: {0}").format(format_violations(violations)))
+            frappe.throw(format_violations(violations, "<br>"), title=_("e-Factura Validation Failed"))
+
     def validate_xml_structure(self):
-        """Validate XML with detailed error reporting"""
+        """Validate XML with detailed error reporting; deferred to the final gate when drafts skip Schematron"""
+        if not schematron_on_drafts():
+            return
         try:
-            XMLGenerator().validate_with_schematron(self.xml_data)
+            XMLGenerator().validate_with_schematron(self.get_payload("xml"))
         except frappe.ValidationError as e:
             self.status = "Validation Failed"
             self.log_error(_("Schematron validation failed: {0}").format(e.message))
             raise
 
     def submit_to_anaf(self):
-        """Main submission flow with enhanced error handling and state management"""
-        try:
-            if self.status in ["Submitted", "Processing"]:
-                return
+        """Claim the transaction with one conditional UPDATE, then sign, send and record the outcome"""
+        if self.status not in ("Draft", "Failed"):
+            return
 
-            self._pre_submission_checks()
-            self._update_status("Processing")
-            
+        self._pre_submission_checks()
+        if self.status == "Draft" and not self._passes_final_gate():
+            return
+        if not self.claim_for_submission():
+            # Another worker claimed it first
+            return
+
+        try:
             signed_xml = self._sign_xml()
+            renew_leases([self.name], self.lease_token, CLAIM_LEASE_SECONDS)
             response = self._send_to_anaf(signed_xml)
-            self._handle_anaf_response(response)
-            
+            self._handle_anaf_response(response, signed_xml)
         except frappe.ValidationError as e:
             self._handle_failure("Validation Error", str(e))
         except Exception as e:
             self._handle_failure("System Error", str(e))
-        finally:
+
+    def _passes_final_gate(self) -> bool:
+        """Schematron before the first submission of a draft that skipped it; a failure ends as Validation Failed"""
+        errors = final_gate_errors(self.get_payload("xml"))
+        if not errors:
+            return True
+
+        self.log_error(_("Schematron validation failed: {0}").format(format_violations(errors)))
+        if transition_status(self.name, "Validation Failed", from_status="Draft"):
+            sync_invoice_statuses({self.invoice_link: {
+                "efactura_status": "Validation Failed",
+                "efactura_remarks": format_violations(errors)
+            }})
             frappe.db.commit()
+            self.status = "Validation Failed"
+        return False
+
+    def claim_for_submission(self) -> bool:
+        """Move Draft/Failed to Processing atomically; False if the row was no longer in the expected status.
+
+        The claim keeps concurrent workers apart, not ANAF from seeing an invoice
+        twice: a job killed after uploading leaves an expired lease that is retried.
+        """
+        now = now_datetime()
+        values = {
+            "submission_time": now,
+            "lease_token": frappe.generate_hash(length=16),
+            "lease_expires_at": add_to_date(now, seconds=CLAIM_LEASE_SECONDS)
+        }
+        if not transition_status(self.name, "Processing", from_status=self.status, values=values):
+            return False
+
+        frappe.db.commit()
+        self.update(values)
+        self.status = "Processing"
+        return True
 
     def _pre_submission_checks(self):
         """Validate system state before submission"""
-        if not self.xml_data:
+        if not self.has_xml():
             frappe.throw(_("XML content missing"), title=_("Submission Error"))
             
         settings = self._get_efactura_settings()
@@ -96,11 +234,8 @@ class EFacturaTransaction(Document):
         """Sign XML with error handling for crypto operations"""
         try:
             settings = self._get_efactura_settings()
-            signer = DigitalSigner(
-                certificate=settings.decrypted_certificate,
-                private_key=settings.get_decrypted_private_key()
-            )
-            return signer.sign_xml(self.xml_data)
+            # Retries reuse the exact signed bytes of the previous attempt
+            return sign_with_cache(get_signing_context(settings), self.get_payload("xml"))
         except xmlsec.Error as e:
             self.log_error(_("XML signing failed: {0}").format(str(e)))
             frappe.throw(_("Digital signature error"), exc=e)
@@ -112,101 +247,69 @@ class EFacturaTransaction(Document):
         """Handle ANAF communication with timeout safeguards"""
         try:
             settings = self._get_efactura_settings()
-            client = ANAFClient(settings)
+            client = get_pooled_client(settings)
             return client.send_xml(signed_xml)
         except Exception as e:
             self.log_error(_("ANAF communication error: {0}").format(str(e)))
             raise
 
-    def _handle_anaf_response(self, response: dict):
-        """Process API response with atomic updates"""
+    def _handle_anaf_response(self, response: dict, signed_xml=None):
+        """Record the ANAF verdict; the exact payload ANAF accepted is kept for downloads and audits"""
         if response.get("status") == "success":
-            self._update_success_state(response)
+            self._record_outcome(success_values(response), signed_xml)
         else:
-            self._update_failure_state(response)
-            
-        self.save()
-
-    def _update_success_state(self, response):
-        """Handle successful submission state"""
-        self.update({
-            "anaf_uuid": response.get("uuid"),
-            "anaf_response": frappe.as_json(response.get("details")),
-            "status": "Submitted",
-            "retry_count": 0,
-            "last_success_date": now_datetime()
-        })
-
-    def _update_failure_state(self, response):
-        """Handle failed submission state"""
-        self.update({
-            "status": "Failed",
-            "anaf_response": frappe.as_json(response),
-            "retry_count": (self.retry_count or 0) + 1,
-            "last_failure_date": now_datetime()
-        })
-        
-        if self.retry_count >= 3:
-            self.add_comment("Info", _("Maximum retry attempts reached"))
+            self._record_outcome(failure_values(response, self.retry_count))
+            if self.retry_count >= MAX_RETRIES:
+                self.add_comment("Info", _("Maximum retry attempts reached"))
+                frappe.db.commit()
+
+    @timed("db_write")
+    def _record_outcome(self, values, signed_xml=None):
+        """Leave Processing with one conditional UPDATE and mirror the status on the Sales Invoice"""
+        updates = {self.name: dict(values, lease_token=None, lease_expires_at=None)}
+        offload_response_updates(updates, {self.name: signed_xml} if signed_xml else None)
+        if not transition_status(self.name, values["status"], from_status="Processing", values=updates[self.name],
+                                 lease_token=self.lease_token or None):
+            logger.warning(f"{self.name} left Processing or lost its lease before its outcome was recorded; "
+                           f"keeping the newer state (ANAF upload {values.get('anaf_uuid') or 'none'})")
+            frappe.db.rollback()
+            return
+
+        sync_invoice_statuses({self.invoice_link: invoice_sync_values(values)})
+        frappe.db.commit()
+        self.update(updates[self.name])
 
     def retry_failed(self):
         """Retry logic with safety checks"""
         if self.status != "Failed":
             frappe.throw(_("Only failed transactions can be retried"))
 
-        if self.retry_count >= 3:
-            frappe.throw(_("Maximum retry attempts (3) reached"))
+        if self.retry_count >= MAX_RETRIES:
+            frappe.throw(_("Maximum retry attempts ({0}) reached").format(MAX_RETRIES))
 
         self.submit_to_anaf()
 
     def generate_pdf(self):
-        """Generate PDF using Jinja template with proper formatting"""
-        try:
-            invoice = frappe.get_doc("Sales Invoice", self.invoice_link)
-            template = get_jenv().get_template("efactura_template.html")
-            html = template.render({
-                "invoice": invoice,
-                "transaction": self,
-                "nowdate": get_datetime().strftime("%d-%m-%Y")
-            })
-            
-            pdf_content = get_pdf(html)
-            file_doc = self._save_pdf_file(pdf_content)
-            return get_url_to_form("File", file_doc.name)
-        except Exception as e:
-            self.log_error(_("PDF generation failed: {0}").format(str(e)))
-            frappe.throw(_("PDF creation error"), exc=e)
-
-    def _save_pdf_file(self, content):
-        """Save PDF to private files with access control"""
-        return frappe.get_doc({
-            "doctype": "File",
-            "file_name": f"{self.name}.pdf",
-            "content": content,
-            "attached_to_doctype": self.doctype,
-            "attached_to_name": self.name,
-            "is_private": 1
-        }).insert(ignore_permissions=True)
+        """Render the invoice PDF through the batch renderer and attach it to this transaction"""
+        from .pdf_renderer import render_transaction_pdfs
+
+        files = render_transaction_pdfs([self.name])
+        if self.name not in files:
+            frappe.throw(_("PDF creation error"))
+        return get_url_to_form("File", files[self.name])
 
     def _get_efactura_settings(self):
         """Get settings with proper error handling"""
-        settings = frappe.get_single("EFacturaSettings")
+        settings = get_efactura_settings()
         if not settings.is_configured():
             frappe.throw(_("Complete e-Factura settings first"))
         return settings
 
-    def _update_status(self, new_status):
-        """Atomic status update with timestamp"""
-        self.status = new_status
-        self.save()
-        frappe.db.commit()  # Ensure immediate save for background jobs
-
     def _handle_failure(self, error_type, message):
-        """Centralized failure handling"""
-        self.status = "Failed"
-        self.log_error(f"{error_type}: {message}")
+        """Record a failed attempt of the claimed transaction, then surface the error to the job"""
         frappe.db.rollback()
-        self.save()
+        self.log_error(f"{error_type}: {message}")
+        self._record_outcome(failure_values({"status": "error", "error": message}, self.retry_count))
         frappe.throw(_("Submission failed: {0}").format(message))
 
     def log_error(self, message: str):
@@ -219,21 +322,122 @@ class EFacturaTransaction(Document):
             reference_name=self.name
         )
 
+def success_values(response: dict) -> dict:
+    """Field values for a transaction accepted by ANAF"""
+    return {
+        "anaf_uuid": response.get("uuid"),
+        "anaf_response": frappe.as_json(response.get("details")),
+        "status": "Submitted",
+        "retry_count": 0,
+        "last_success_date": now_datetime(),
+        "next_attempt_at": None,
+        "status_checks": 0,
+        "next_status_check": add_to_date(now_datetime(), minutes=FIRST_STATUS_CHECK_MINUTES)
+    }
+
+def failure_values(response: dict, retry_count: int) -> dict:
+    """Field values for a transaction rejected by ANAF or failed in transit"""
+    return {
+        "status": "Failed",
+        "anaf_response": frappe.as_json(response),
+        "retry_count": (retry_count or 0) + 1,
+        "last_failure_date": now_datetime(),
+        "next_attempt_at": next_attempt_time((retry_count or 0) + 1)
+    }
+
+def invoice_sync_values(values: dict) -> dict:
+    """Sales Invoice fields mirroring a transaction outcome; a failed attempt leaves anaf_uuid as it is"""
+    invoice_values = {"efactura_status": values["status"]}
+    if values.get("anaf_uuid"):
+        invoice_values["anaf_uuid"] = values["anaf_uuid"]
+    return invoice_values
+
+def final_gate_errors(xml) -> list:
+    """Schematron violations of a draft about to be submitted; empty when drafts were already validated"""
+    if schematron_on_drafts():
+        return []
+    try:
+        return XMLGenerator().schematron_errors(xml)
+    except Exception as e:
+        return [{"message": str(e), "line": None, "column": None, "path": None, "level": "FATAL"}]
+
+def next_attempt_time(attempt: int):
+    """Exponential backoff with jitter before retry number `attempt`, so failed batches do not retry in lockstep"""
+    minutes = min(RETRY_BASE_MINUTES * 2 ** max(attempt - 1, 0), MAX_RETRY_INTERVAL_MINUTES)
+    return add_to_date(now_datetime(), seconds=int(minutes * 60 * random.uniform(0.8, 1.2)))
+
+@frappe.whitelist()
+def get_transaction_payload(docname: str, kind: str = "signed_xml"):
+    """Download a stored payload (xml, signed_xml, anaf_response or status_response) of a transaction"""
+    doc = frappe.get_doc("EFactura Transaction", docname)
+    doc.check_permission("read")
+    return doc.get_payload(kind)
+
+def transition_status(name: str, to_status: str, from_status=None, values: dict = None,
+                      lease_token: str = None) -> bool:
+    """Compare-and-set status change in one conditional UPDATE.
+
+    The row only changes while its status is from_status (one status or a list
+    of them; when not given, any status allowed to move to to_status) and, when
+    lease_token is given, while it still holds that lease, so concurrent callers
+    cannot both win. Returns whether this call made the change.
+    """
+    sources = [status for status, targets in STATUS_TRANSITIONS.items() if to_status in targets]
+    if from_status is not None:
+        requested = [from_status] if isinstance(from_status, str) else list(from_status)
+        for status in requested:
+            if status not in sources:
+                frappe.throw(_("Invalid status transition from {0} to {1}").format(status, to_status))
+        sources = requested
+
+    values = dict(values or {}, status=to_status, modified=now_datetime())
+    assignments = ", ".join(f"`{fieldname}`=%({fieldname})s" for fieldname in values)
+    condition = "name=%(__name)s and status in %(__sources)s"
+    if lease_token is not None:
+        condition += " and lease_token=%(__lease_token)s"
+    frappe.db.sql(
+        f"""update `tabEFactura Transaction` set {assignments} where {condition}""",
+        dict(values, __name=name, __sources=tuple(sources), __lease_token=lease_token)
+    )
+    return frappe.db.sql("select row_count()")[0][0] == 1
+
+def renew_leases(names, lease_token, seconds):
+    """Push back the expiry of leases still held under lease_token, before a slow step such as an upload"""
+    if not names or not lease_token:
+        return
+    frappe.db.sql(
+        """update `tabEFactura Transaction` set lease_expires_at=%(expires)s
+        where name in %(names)s and status='Processing' and lease_token=%(token)s""",
+        {"expires": add_to_date(now_datetime(), seconds=seconds), "names": tuple(names), "token": lease_token}
+    )
+    frappe.db.commit()
+
+def lock_transactions(names, fields=("name", "status", "lease_token")) -> dict:
+    """Current values of the given transactions, row-locked until the next commit or rollback.
+
+    Bulk writers check their guard (status, lease) on these rows and only
+    write the ones that pass, so no other worker can move them in between.
+    """
+    if not names:
+        return {}
+    rows = frappe.db.sql(
+        f"""select {", ".join(f"`{fieldname}`" for fieldname in fields)} from `tabEFactura Transaction`
+        where name in %(names)s for update""",
+        {"names": tuple(names)},
+        as_dict=True
+    )
+    return {row.name: row for row in rows}
+
 @frappe.whitelist()
 def submit_transaction(docname: str):
-    """Background submission endpoint with lock mechanism"""
+    """Submit one transaction; the conditional claim makes concurrent calls safe without a document lock"""
+    record_queue_wait("submit_transaction")
     doc = frappe.get_doc("EFactura Transaction", docname)
-    if doc.status in ["Processing", "Submitted"]:
+    if doc.status == "Draft" and not doc.has_xml() and not doc.prepare_deferred_xml():
         return
-        
-    with frappe.document_lock(doc):
-        doc.reload()
-        doc.submit_to_anaf()
+    doc.submit_to_anaf()
 
 @frappe.whitelist()
 def retry_transaction(docname: str):
-    """Retry endpoint with concurrency control"""
-    doc = frappe.get_doc("EFactura Transaction", docname)
-    with frappe.document_lock(doc):
-        doc.reload()
-        doc.retry_failed()
+    """Retry a failed transaction that has attempts left"""
+    frappe.get_doc("EFactura Transaction", docname).retry_failed()
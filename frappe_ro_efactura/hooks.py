@@ -25,7 +25,7 @@ custom_fields = {
             "fieldname": "efactura_status",
             "label": _("Status"),
             "fieldtype": "Select",
-            "options": "\nDraft\nSubmitted\nProcessing\nValidation Failed\nFailed",
+            "options": "\nDraft\nSubmitted\nProcessing\nValidation Failed\nFailed\nAccepted\nRejected",
             "read_only": 1,
             "insert_after": "anaf_uuid"
         },
@@ -44,6 +44,223 @@ custom_fields = {
             "read_only": 1,
             "insert_after": "efactura_transaction"
         }
+    ],
+    "Company": [
+        {
+            "fieldname": "trade_register_number",
+            "label": _("Trade Register Number"),
+            "fieldtype": "Data",
+            "description": _("Nr. Reg. Com., e.g. J40/1234/2020; sent as the seller's legal registration identifier"),
+            "insert_after": "tax_id"
+        }
+    ],
+    "EFactura Transaction": [
+        {
+            "fieldname": "xml_hash",
+            "label": _("XML Hash"),
+            "fieldtype": "Data",
+            "read_only": 1,
+            "description": _("SHA-256 of the XML kept in the compressed payload store"),
+            "insert_after": "invoice_link"
+        },
+        {
+            "fieldname": "content_hash",
+            "label": _("Content Hash"),
+            "fieldtype": "Data",
+            "read_only": 1,
+            "insert_after": "xml_hash"
+        },
+        {
+            "fieldname": "status_checks",
+            "label": _("Status Checks"),
+            "fieldtype": "Int",
+            "read_only": 1,
+            "insert_after": "anaf_uuid"
+        },
+        {
+            "fieldname": "next_status_check",
+            "label": _("Next Status Check"),
+            "fieldtype": "Datetime",
+            "read_only": 1,
+            "search_index": 1,
+            "insert_after": "status_checks"
+        },
+        {
+            "fieldname": "next_attempt_at",
+            "label": _("Next Attempt At"),
+            "fieldtype": "Datetime",
+            "read_only": 1,
+            "search_index": 1,
+            "insert_after": "retry_count"
+        },
+        {
+            "fieldname": "lease_token",
+            "label": _("Lease Token"),
+            "fieldtype": "Data",
+            "read_only": 1,
+            "hidden": 1,
+            "insert_after": "next_attempt_at"
+        },
+        {
+            "fieldname": "lease_expires_at",
+            "label": _("Lease Expires At"),
+            "fieldtype": "Datetime",
+            "read_only": 1,
+            "hidden": 1,
+            "insert_after": "lease_token"
+        }
+    ],
+    "EFactura Settings": [
+        {
+            "fieldname": "performance_section",
+            "label": _("Performance"),
+            "fieldtype": "Section Break",
+            "collapsible": 1
+        },
+        {
+            "fieldname": "http_pool_size",
+            "label": _("HTTP Connection Pool Size"),
+            "fieldtype": "Int",
+            "default": "10",
+            "description": _("Keep-alive connections to ANAF kept open per worker"),
+            "insert_after": "performance_section"
+        },
+        {
+            "fieldname": "batch_submission",
+            "label": _("Batch Submission"),
+            "fieldtype": "Check",
+            "default": "0",
+            "description": _("Submit pending transactions in scheduled batches instead of one job per invoice"),
+            "insert_after": "http_pool_size"
+        },
+        {
+            "fieldname": "submission_batch_size",
+            "label": _("Submission Batch Size"),
+            "fieldtype": "Int",
+            "default": "200",
+            "depends_on": "batch_submission",
+            "insert_after": "batch_submission"
+        },
+        {
+            "fieldname": "upload_concurrency",
+            "label": _("Upload Concurrency"),
+            "fieldtype": "Int",
+            "default": "4",
+            "description": _("Maximum ANAF requests kept in flight by one batch job"),
+            "insert_after": "submission_batch_size"
+        },
+        {
+            "fieldname": "upload_rate_limit",
+            "label": _("Upload Rate Limit (req/s)"),
+            "fieldtype": "Float",
+            "default": "5",
+            "description": _("Shared by all workers of the bench; lowered automatically when ANAF throttles"),
+            "insert_after": "upload_concurrency"
+        },
+        {
+            "fieldname": "status_rate_limit",
+            "label": _("Status Check Rate Limit (req/s)"),
+            "fieldtype": "Float",
+            "default": "10",
+            "insert_after": "upload_rate_limit"
+        },
+        {
+            "fieldname": "rate_limit_burst",
+            "label": _("Rate Limit Burst"),
+            "fieldtype": "Int",
+            "default": "10",
+            "insert_after": "status_rate_limit"
+        },
+        {
+            "fieldname": "throttle_backoff_factor",
+            "label": _("Throttle Backoff Factor"),
+            "fieldtype": "Float",
+            "default": "0.5",
+            "description": _("Rate multiplier applied on each 429/503 response from ANAF"),
+            "insert_after": "rate_limit_burst"
+        },
+        {
+            "fieldname": "status_poll_page_size",
+            "label": _("Status Poll Page Size"),
+            "fieldtype": "Int",
+            "default": "500",
+            "description": _("Submitted transactions checked per page by the status poller"),
+            "insert_after": "throttle_backoff_factor"
+        },
+        {
+            "fieldname": "signing_processes",
+            "label": _("Signing Processes"),
+            "fieldtype": "Int",
+            "default": "0",
+            "description": _("Worker processes used to sign large batches; 0 signs inline"),
+            "insert_after": "status_poll_page_size"
+        },
+        {
+            "fieldname": "payload_cache_ttl",
+            "label": _("Payload Cache TTL (hours)"),
+            "fieldtype": "Int",
+            "default": "24",
+            "description": _("How long generated and signed XML is kept for reuse on retries"),
+            "insert_after": "signing_processes"
+        },
+        {
+            "fieldname": "deferred_xml_generation",
+            "label": _("Deferred XML Generation"),
+            "fieldtype": "Check",
+            "default": "0",
+            "description": _("Generate and validate XML in the background instead of while the Sales Invoice is submitted"),
+            "insert_after": "payload_cache_ttl"
+        },
+        {
+            "fieldname": "queue_workers",
+            "label": _("Submission Queue Workers"),
+            "fieldtype": "Int",
+            "default": "2",
+            "description": _("Background loops draining due submissions and retries in parallel"),
+            "insert_after": "deferred_xml_generation"
+        },
+        {
+            "fieldname": "enable_metrics",
+            "label": _("Enable Metrics"),
+            "fieldtype": "Check",
+            "default": "0",
+            "description": _("Time each pipeline stage and count ANAF responses; scrape frappe_ro_efactura.metrics.get_metrics"),
+            "insert_after": "queue_workers"
+        },
+        {
+            "fieldname": "metrics_sink",
+            "label": _("Metrics Sink"),
+            "fieldtype": "Select",
+            "options": "Prometheus\nLog\nPrometheus and Log",
+            "default": "Prometheus",
+            "depends_on": "enable_metrics",
+            "insert_after": "enable_metrics"
+        },
+        {
+            "fieldname": "pdf_batch_size",
+            "label": _("PDF Batch Size"),
+            "fieldtype": "Int",
+            "default": "50",
+            "description": _("Invoices rendered by one wkhtmltopdf run when printing transactions in bulk"),
+            "insert_after": "metrics_sink"
+        },
+        {
+            "fieldname": "pdf_render_concurrency",
+            "label": _("PDF Render Concurrency"),
+            "fieldtype": "Int",
+            "default": "2",
+            "description": _("wkhtmltopdf processes a bulk PDF job may run at once"),
+            "insert_after": "pdf_batch_size"
+        },
+        {
+            "fieldname": "schematron_validation",
+            "label": _("Schematron Validation"),
+            "fieldtype": "Select",
+            "options": "On Draft Creation\nBefore Submission",
+            "default": "On Draft Creation",
+            "description": _("Invoice rules always run on drafts; Before Submission runs the full Schematron only as the final gate"),
+            "insert_after": "pdf_render_concurrency"
+        }
     ]
 }
 
@@ -51,12 +268,24 @@ scheduled_events = {
     "cron": [
         {
             "event": "all",
-            "cron": "*/10 * * * *",
-            "method": "frappe_ro_efactura.efactura.retry_failed_submissions"
+            "cron": "* * * * *",
+            "method": "frappe_ro_efactura.work_queue.drain_submission_queue"
+        },
+        {
+            "event": "all",
+            "cron": "*/5 * * * *",
+            "method": "frappe_ro_efactura.status_poller.poll_submitted_transactions"
         }
     ]
 }
 
+# Custom fields first: the Sales Invoice indexes are on them
+after_migrate = ["frappe_ro_efactura.hooks.create_efactura_custom_fields", "frappe_ro_efactura.indexes.ensure_indexes"]
+
+# Buffered metric samples are written to Redis once per request or job
+after_request = ["frappe_ro_efactura.metrics.flush_metrics"]
+after_job = ["frappe_ro_efactura.metrics.flush_metrics"]
+
 doctype_js = {
     "Sales Invoice": "public/js/sales_invoice.js"
 }
@@ -69,6 +298,18 @@ doc_events = {
     "Sales Invoice": {
         "on_submit": "frappe_ro_efactura.efactura.trigger_einvoice_submission",
         "on_cancel": "frappe_ro_efactura.efactura.handle_invoice_cancellation"
+    },
+    "Company": {
+        "on_update": "frappe_ro_efactura.party_cache.invalidate_party_cache",
+        "on_trash": "frappe_ro_efactura.party_cache.invalidate_party_cache"
+    },
+    "Customer": {
+        "on_update": "frappe_ro_efactura.party_cache.invalidate_party_cache",
+        "on_trash": "frappe_ro_efactura.party_cache.invalidate_party_cache"
+    },
+    "Address": {
+        "on_update": "frappe_ro_efactura.party_cache.invalidate_party_cache",
+        "on_trash": "frappe_ro_efactura.party_cache.invalidate_party_cache"
     }
 }
 
@@ -76,6 +317,17 @@ def after_install():
     """Initialize required documents and settings after app installation"""
     create_efactura_settings()
     add_default_schematron_files()
+    create_efactura_custom_fields()
+
+    from frappe_ro_efactura.payload_store import ensure_payload_table
+    from frappe_ro_efactura.indexes import ensure_indexes
+    ensure_payload_table()
+    ensure_indexes()
+
+def create_efactura_custom_fields():
+    """Create or update the custom fields declared above; safe to run on every migrate"""
+    from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+    create_custom_fields(custom_fields, update=True)
 
 def create_efactura_settings():
     """Create EFacturaSettings singleton if not exists"""
@@ -0,0 +1,27 @@
+## indexes.py
+import frappe
+import logging
+
+logger = logging.getLogger(__name__)
+
+# index name -> columns, per doctype; each matches a scheduler query or a hot lookup
+INDEXES = {
+    "EFactura Transaction": {
+        "status_retry_next_attempt": ["status", "retry_count", "next_attempt_at"],
+        "status_next_status_check": ["status", "next_status_check"],
+        "status_lease_expires": ["status", "lease_expires_at"],
+        "invoice_link_index": ["invoice_link"],
+        "anaf_uuid_index": ["anaf_uuid"]
+    },
+    "Sales Invoice": {
+        "efactura_transaction_index": ["efactura_transaction"],
+        "efactura_status_index": ["efactura_status"]
+    }
+}
+
+def ensure_indexes():
+    """Create missing e-Factura indexes; existing ones are left untouched, so this is safe on every migrate"""
+    for doctype, indexes in INDEXES.items():
+        for index_name, columns in indexes.items():
+            frappe.db.add_index(doctype, columns, index_name=index_name)
+    logger.info("e-Factura indexes verified")
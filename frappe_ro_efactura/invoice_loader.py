@@ -0,0 +1,110 @@
+## invoice_loader.py
+import frappe
+from collections import defaultdict
+
+ITEM_CHUNK_SIZE = 1000
+
+# Only the columns the UBL mapping and the invoice rules read
+INVOICE_FIELDS = [
+    "name", "posting_date", "currency", "company", "company_address",
+    "customer", "customer_address", "net_total", "total_taxes_and_charges",
+    "discount_amount", "apply_discount_on", "grand_total", "rounding_adjustment", "docstatus"
+]
+INVOICE_ITEM_FIELDS = ["parent", "idx", "item_name", "qty", "uom", "rate", "amount", "net_amount"]
+INVOICE_TAX_FIELDS = [
+    "parent", "idx", "charge_type", "account_head", "rate", "tax_amount", "tax_amount_after_discount_amount"
+]
+
+def load_invoice_snapshot(invoice_name, with_items=True, with_taxes=None):
+    """Projection of one Sales Invoice for XML generation, without loading the full document"""
+    return load_invoice_snapshots([invoice_name], with_items=with_items, with_taxes=with_taxes).get(invoice_name)
+
+def load_invoice_snapshots(invoice_names, with_items=True, with_taxes=None):
+    """Projections of many Sales Invoices: one query for headers, one for all their lines and one for their taxes.
+
+    Taxes are loaded along with the items unless with_taxes says otherwise,
+    plus one query for the account types of their accounts.
+    """
+    with_taxes = with_items if with_taxes is None else with_taxes
+    invoice_names = list(set(invoice_names))
+    if not invoice_names:
+        return {}
+
+    invoices = {
+        invoice.name: invoice
+        for invoice in frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", invoice_names]},
+            fields=INVOICE_FIELDS
+        )
+    }
+    if with_items:
+        items_by_parent = _load_children("Sales Invoice Item", INVOICE_ITEM_FIELDS, invoices)
+        for name, invoice in invoices.items():
+            invoice["items"] = items_by_parent.get(name, [])
+    if with_taxes:
+        taxes_by_parent = _load_children("Sales Taxes and Charges", INVOICE_TAX_FIELDS, invoices)
+        _attach_account_types(taxes_by_parent)
+        for name, invoice in invoices.items():
+            invoice["taxes"] = taxes_by_parent.get(name, [])
+    return invoices
+
+def load_invoice_documents(invoice_names):
+    """Whole Sales Invoice rows with their items and taxes for print templates: three queries instead of one get_doc each"""
+    invoices = {
+        invoice.name: invoice
+        for invoice in frappe.get_all("Sales Invoice", filters={"name": ["in", list(set(invoice_names))]}, fields=["*"])
+    }
+    if not invoices:
+        return {}
+
+    items_by_parent = _load_children("Sales Invoice Item", ["*"], invoices)
+    taxes_by_parent = _load_children("Sales Taxes and Charges", ["*"], invoices)
+    for name, invoice in invoices.items():
+        invoice["items"] = items_by_parent.get(name, [])
+        invoice["taxes"] = taxes_by_parent.get(name, [])
+    return invoices
+
+def iter_invoice_items(invoice_name, chunk_size=ITEM_CHUNK_SIZE):
+    """Yield Sales Invoice lines in idx order, fetching chunk_size rows per query"""
+    last_idx = 0
+    while True:
+        chunk = frappe.get_all(
+            "Sales Invoice Item",
+            filters={"parent": invoice_name, "parenttype": "Sales Invoice", "idx": [">", last_idx]},
+            fields=INVOICE_ITEM_FIELDS,
+            order_by="idx asc",
+            limit_page_length=chunk_size
+        )
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_idx = chunk[-1].idx
+
+def _load_children(doctype, fields, invoice_names):
+    """Child rows of many invoices in one query, grouped by parent in idx order"""
+    rows_by_parent = defaultdict(list)
+    for row in frappe.get_all(
+        doctype,
+        filters={"parent": ["in", list(invoice_names)], "parenttype": "Sales Invoice"},
+        fields=fields,
+        order_by="parent asc, idx asc",
+        limit_page_length=0
+    ):
+        rows_by_parent[row.parent].append(row)
+    return rows_by_parent
+
+def _attach_account_types(taxes_by_parent):
+    """Account type of each tax row's account_head, which tells VAT rows from other charges"""
+    heads = {tax.account_head for taxes in taxes_by_parent.values() for tax in taxes if tax.account_head}
+    if not heads:
+        return
+    account_types = dict(frappe.get_all(
+        "Account",
+        filters={"name": ["in", list(heads)]},
+        fields=["name", "account_type"],
+        as_list=True
+    ))
+    for taxes in taxes_by_parent.values():
+        for tax in taxes:
+            tax["account_type"] = account_types.get(tax.account_head)
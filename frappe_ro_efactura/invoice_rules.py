@@ -0,0 +1,191 @@
+## invoice_rules.py
+import re
+from frappe.utils import flt
+from .party_cache import get_party_snapshot
+from .unit_codes import UNIT_CODES, unit_code
+
+TOTALS_TOLERANCE = 0.01
+CUI_CONTROL_KEY = (7, 5, 3, 2, 1, 7, 5, 3, 2)
+RO_VAT_RATES = (0, 5, 9, 11, 19, 21)
+RULE_ID_PATTERN = re.compile(r"(?:^|[\s\[])((?:BR|RO)(?:-[A-Z0-9]+)+)(?:\]-|:)")
+CURRENCY_CODES = frozenset("""
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BOV BRL BSD BTN BWP BYN BZD
+    CAD CDF CHE CHF CHW CLF CLP CNY COP COU CRC CUC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP
+    GEL GHS GIP GMD GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW
+    KWD KYD KZT LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MXV MYR MZN NAD NGN
+    NIO NOK NPR NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD SHP SLE SLL
+    SOS SRD SSP STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD USN UYI UYU UYW UZS VED VES
+    VND VUV WST XAF XAG XAU XBA XBB XBC XBD XCD XDR XOF XPD XPF XPT XSU XTS XUA XXX YER ZAR ZMW ZWL
+""".split())
+
+# EN 16931 rules the generated XML is checked against, mirrored here with the same ids and the
+# same tests as their official asserts; the other rules need invoice data (line amounts, taxes)
+# that is not part of the generated XML
+SCHEMATRON_RULES = frozenset((
+    "BR-02", "BR-03", "BR-05", "BR-CL-04", "BR-16", "BR-06", "BR-CO-26", "BR-07",
+    "BR-21", "BR-22", "BR-23", "BR-CL-23", "BR-25"
+))
+
+def check_invoice(invoice):
+    """Every rule violation of an invoice snapshot, as dicts shaped like XMLGenerator.schematron_errors.
+
+    Plain Python over the data XML generation uses, so drafts can be checked
+    without generating or validating XML. Line and tax rules only run when the
+    snapshot carries items and taxes.
+    """
+    violations = []
+
+    def fail(rule, message, path="/Invoice"):
+        violations.append({"rule": rule, "message": f"{rule}: {message}", "line": None, "column": None,
+                           "path": path, "level": "ERROR"})
+
+    if _missing(invoice.get("name")):
+        fail("BR-02", "An Invoice shall have an Invoice number.")
+    if _missing(invoice.get("posting_date")):
+        fail("BR-03", "An Invoice shall have an Invoice issue date.")
+    # Like the official asserts: BR-05 wants any text, BR-CL-04 checks it normalised, so a blank code fails both
+    if _missing(invoice.get("currency")):
+        fail("BR-05", "An Invoice shall have an Invoice currency code.")
+    currency = " ".join(_text(invoice.get("currency")).split())
+    if currency not in CURRENCY_CODES:
+        fail("BR-CL-04", f"Invoice currency code {currency} is not an ISO 4217 code.")
+
+    if invoice.get("total_taxes_and_charges") is not None:
+        _check_grand_total(invoice, fail)
+
+    _check_parties(invoice, fail)
+    if "items" in invoice:
+        _check_lines(invoice, fail)
+    if "taxes" in invoice:
+        _check_taxes(invoice, fail)
+    return violations
+
+def check_invoices(invoices):
+    """{invoice name: violations} for the invoices that break at least one rule"""
+    results = {}
+    for invoice in invoices:
+        violations = check_invoice(invoice)
+        if violations:
+            results[invoice.get("name")] = violations
+    return results
+
+def format_violations(violations, separator="\n"):
+    """All messages in one string, for remarks and error dialogs"""
+    return separator.join(violation["message"] for violation in violations)
+
+def rule_id(message):
+    """Rule id a violation or Schematron message starts with, e.g. BR-02 for "[BR-02]-An Invoice shall..." """
+    match = RULE_ID_PATTERN.search(message)
+    return match.group(1) if match else message
+
+def is_valid_cui(cui):
+    """Romanian fiscal code (CUI/CIF) checksum, with or without the RO prefix"""
+    digits = _text(cui).upper().replace(" ", "")
+    digits = digits[2:] if digits.startswith("RO") else digits
+    if not digits.isdigit() or not 2 <= len(digits) <= 10:
+        return False
+
+    body = [int(d) for d in digits[:-1].rjust(9, "0")]
+    control = sum(d * k for d, k in zip(body, CUI_CONTROL_KEY)) * 10 % 11
+    return (0 if control == 10 else control) == int(digits[-1])
+
+def _check_parties(invoice, fail):
+    supplier = _party(invoice, "supplier_party", "Company", "company", "company_address")
+    customer = _party(invoice, "customer_party", "Customer", "customer", "customer_address")
+    supplier_path = "/Invoice/AccountingSupplierParty/Party"
+
+    if _missing(supplier.get("party_name") or supplier.get("name")):
+        fail("BR-06", "An Invoice shall contain the Seller name.", supplier_path)
+
+    # Same CompanyID values XMLGenerator._build_party writes to the XML
+    tax_id = _text(supplier.get("tax_id")).replace(" ", "").upper()
+    cui = tax_id[2:] if tax_id.startswith("RO") else tax_id
+    if not tax_id[:2].isalpha() and _missing(supplier.get("registration_id") or cui):
+        fail("BR-CO-26", "The Seller shall have a legal registration identifier or a VAT identifier.", supplier_path)
+    elif not tax_id:
+        fail("RO-CUI", "The Seller shall have a CUI; a registration number alone is not enough.", supplier_path)
+    elif (tax_id.startswith("RO") or tax_id.isdigit()) and not is_valid_cui(tax_id):
+        fail("RO-CUI", f"Seller CUI {tax_id} fails the check digit.", supplier_path)
+
+    if _missing(customer.get("party_name") or customer.get("name")):
+        fail("BR-07", "An Invoice shall contain the Buyer name.", "/Invoice/AccountingCustomerParty/Party")
+
+def _check_lines(invoice, fail):
+    items = invoice.get("items") or []
+    if not items:
+        fail("BR-16", "An Invoice shall have at least one Invoice line.")
+
+    line_total = 0
+    for position, item in enumerate(items, start=1):
+        path = f"/Invoice/InvoiceLine[{position}]"
+        if _missing(item.get("idx")):
+            fail("BR-21", "Each Invoice line shall have an Invoice line identifier.", path)
+        # XMLGenerator leaves out a quantity without a value, and its unit code with it;
+        # a UOM without a mapping goes out under its own name
+        code = unit_code(item.get("uom"))
+        if _missing(item.get("qty")):
+            fail("BR-22", "Each Invoice line shall have an Invoiced quantity.", path)
+        if _missing(item.get("qty")) or not code:
+            fail("BR-23", "An Invoice line shall have an Invoiced quantity unit of measure code.", path)
+        elif code not in UNIT_CODES:
+            fail("BR-CL-23", f"UOM {item.get('uom')} has no UN/ECE Recommendation 20 or 21 code; map it to one.", path)
+        if _missing(item.get("item_name")):
+            fail("BR-25", "Each Invoice line shall contain the Item name.", path)
+
+        if item.get("amount") is not None:
+            if item.get("rate") is not None and _differs(flt(item.get("qty")) * flt(item.get("rate")), item.get("amount")):
+                fail("RO-LINE-AMOUNT", f"Line amount {item.get('amount')} is not quantity x price.", path)
+            line_total += flt(item.get("net_amount") if item.get("net_amount") is not None else item.get("amount"))
+
+    if items and all(item.get("amount") is not None for item in items) and _differs(line_total, invoice.get("net_total")):
+        fail("BR-CO-10", f"Net total {invoice.get('net_total')} is not the sum of line amounts {round(line_total, 2)}.")
+
+def _check_grand_total(invoice, fail):
+    """ERPNext's grand total is net total plus taxes, both already after any discount.
+
+    Some totals keep the rounding adjustment in the grand total as well, and
+    inclusive taxes leave a grand_total_diff of a few cents on the document.
+    """
+    expected = flt(invoice.get("net_total")) + flt(invoice.get("total_taxes_and_charges"))
+    tolerance = abs(flt(invoice.get("grand_total_diff")))
+    if _differs(expected, invoice.get("grand_total"), tolerance) and \
+            _differs(expected + flt(invoice.get("rounding_adjustment")), invoice.get("grand_total"), tolerance):
+        fail("BR-CO-15", f"Grand total {invoice.get('grand_total')} is not net total plus VAT {round(expected, 2)}.")
+
+def _check_taxes(invoice, fail):
+    taxes = invoice.get("taxes") or []
+    for position, tax in enumerate(taxes, start=1):
+        if _is_vat_row(tax) and flt(tax.get("rate")) not in RO_VAT_RATES:
+            fail("RO-VAT-RATE", f"VAT rate {tax.get('rate')}% is not a Romanian VAT rate.", f"/Invoice/TaxTotal/TaxSubtotal[{position}]")
+
+    # total_taxes_and_charges covers every row, each after its share of a Grand Total discount
+    if taxes and _differs(sum(_tax_amount(tax) for tax in taxes), invoice.get("total_taxes_and_charges")):
+        fail("BR-CO-14", "Total VAT is not the sum of the VAT breakdown amounts.", "/Invoice/TaxTotal")
+
+def _is_vat_row(tax):
+    """VAT is charged on the net total and booked to a Tax account.
+
+    Shipping and other fixed charges ("Actual"), charges cascaded on previous
+    rows and rows posted to non-tax accounts carry no VAT rate. Snapshots that
+    do not say which account type a row uses are judged by charge type alone.
+    """
+    return tax.get("charge_type") == "On Net Total" and tax.get("account_type") in (None, "Tax")
+
+def _tax_amount(tax):
+    amount = tax.get("tax_amount_after_discount_amount")
+    return flt(amount if amount is not None else tax.get("tax_amount"))
+
+def _party(invoice, snapshot_field, party_type, party_field, address_field):
+    """Party data as XMLGenerator._party_snapshot resolves it"""
+    return invoice.get(snapshot_field) or get_party_snapshot(
+        party_type, invoice.get(party_field), invoice.get(address_field)) or {"name": invoice.get(party_field)}
+
+def _differs(value, expected, tolerance=0):
+    return abs(flt(value) - flt(expected)) > TOTALS_TOLERANCE + tolerance + 1e-9
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+def _missing(value):
+    """No value at all, as the official asserts test it: whitespace still counts as present"""
+    return value is None or str(value) == ""
@@ -0,0 +1,67 @@
+## invoice_status_sync.py
+import frappe
+import logging
+from collections import defaultdict
+from frappe import _
+
+logger = logging.getLogger(__name__)
+SYNC_FIELDS = ("efactura_status", "efactura_transaction", "anaf_uuid", "efactura_remarks")
+UPDATE_CHUNK_SIZE = 1000
+GROUPED_VALUE_LIMIT = 20  # fields with more distinct values than this are written with CASE instead
+
+def sync_invoice_statuses(invoice_updates):
+    """Mirror transaction outcomes onto Sales Invoices in grouped UPDATEs, then drop their cached documents once.
+
+    invoice_updates maps invoice name -> {fieldname: value}. Low-cardinality
+    fields such as efactura_status cost one UPDATE per distinct value; per-row
+    values such as anaf_uuid one CASE UPDATE per chunk. modified is left alone.
+    """
+    if not invoice_updates:
+        return
+
+    names_by_value = defaultdict(lambda: defaultdict(list))
+    for invoice, values in invoice_updates.items():
+        for fieldname, value in values.items():
+            if fieldname not in SYNC_FIELDS:
+                frappe.throw(_("{0} is not an e-Factura field of Sales Invoice").format(fieldname))
+            names_by_value[fieldname][value].append(invoice)
+
+    for fieldname, groups in names_by_value.items():
+        if len(groups) <= GROUPED_VALUE_LIMIT:
+            for value, names in groups.items():
+                for chunk in _chunks(names):
+                    frappe.db.sql(
+                        f"""update `tabSales Invoice` set `{fieldname}`=%s where name in %s""",
+                        (value, tuple(chunk))
+                    )
+        else:
+            values = [(name, value) for value, names in groups.items() for name in names]
+            for chunk in _chunks(values):
+                frappe.db.sql(
+                    f"""update `tabSales Invoice`
+                    set `{fieldname}` = case name {" ".join(["when %s then %s"] * len(chunk))} else `{fieldname}` end
+                    where name in %s""",
+                    [item for pair in chunk for item in pair] + [tuple(name for name, _value in chunk)]
+                )
+
+    clear_invoice_cache(list(invoice_updates))
+
+def clear_invoice_cache(invoice_names):
+    """Invalidate the cached Sales Invoice documents once the UPDATEs are committed.
+
+    Clearing earlier would let another request cache the old values again
+    before the commit; on a rollback the cache was never stale.
+    """
+    def clear():
+        for name in invoice_names:
+            frappe.clear_document_cache("Sales Invoice", name)
+
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is None:  # Frappe versions without commit callbacks
+        clear()
+        return
+    after_commit.add(clear)
+
+def _chunks(items):
+    for i in range(0, len(items), UPDATE_CHUNK_SIZE):
+        yield items[i:i + UPDATE_CHUNK_SIZE]
@@ -0,0 +1,293 @@
+## metrics.py
+import frappe
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from frappe.utils import cint
+from .efactura_settings import get_efactura_settings
+
+logger = logging.getLogger(__name__)
+METRICS_KEY = "efactura:metrics"
+CONFIG_TTL = 60  # seconds a worker keeps its enabled/sink decision before re-reading the settings
+FLUSH_INTERVAL = 10  # seconds between writes of buffered Prometheus samples to Redis
+DEFAULT_SINK = "Prometheus"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+METRICS = {
+    "efactura_stage_seconds": ("histogram", "Time spent in each e-Factura pipeline stage"),
+    "efactura_http_request_seconds": ("histogram", "Duration of single ANAF HTTP exchanges, urllib3 retries included"),
+    "efactura_http_responses_total": ("counter", "ANAF HTTP responses by endpoint and status code"),
+    "efactura_http_retries_total": ("counter", "ANAF requests sent again, by endpoint and reason"),
+    "efactura_queue_wait_seconds": ("histogram", "Time e-Factura background jobs waited between enqueue and start"),
+    "efactura_pdf_fallbacks_total": ("counter", "PDF batches rendered again invoice by invoice, by reason")
+}
+
+# Recorder decision per site of this worker: site -> (checked_at, pid, Recorder or None when disabled)
+_recorders = {}
+_recorders_lock = threading.Lock()
+_last_waited_job = None
+
+class Recorder:
+    """Fans observations out to the configured sinks of one site"""
+
+    def __init__(self, site, sinks):
+        self.site = site
+        self.sinks = sinks
+
+    def observe(self, name, value, labels=None):
+        for sink in self.sinks:
+            sink.observe(name, value, labels or {})
+
+    def increment(self, name, amount=1, labels=None):
+        for sink in self.sinks:
+            sink.increment(name, amount, labels or {})
+
+    def flush(self, force=False):
+        # Flushing needs the site's Redis connection, which other threads do not have
+        if getattr(frappe.local, "site", None) != self.site:
+            return
+        for sink in self.sinks:
+            sink.flush(force)
+
+class PrometheusSink:
+    """Aggregates samples in memory and adds them to a per-site Redis hash shared by all workers"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def observe(self, name, value, labels):
+        with self._lock:
+            for bound in BUCKETS:
+                if value <= bound:
+                    self._add(_series(f"{name}_bucket", dict(labels, le=str(bound))), 1)
+            self._add(_series(f"{name}_bucket", dict(labels, le="+Inf")), 1)
+            self._add(_series(f"{name}_sum", labels), value)
+            self._add(_series(f"{name}_count", labels), 1)
+
+    def increment(self, name, amount, labels):
+        with self._lock:
+            self._add(_series(name, labels), amount)
+
+    def flush(self, force=False):
+        if not force and time.monotonic() - self._flushed_at < FLUSH_INTERVAL:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            cache = frappe.cache()
+            pipeline = cache.pipeline()
+            key = cache.make_key(METRICS_KEY)
+            for series, amount in pending.items():
+                pipeline.hincrbyfloat(key, series, amount)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Could not write e-Factura metrics to Redis: {str(e)}")
+
+    def _add(self, series, amount):
+        self._pending[series] = self._pending.get(series, 0) + amount
+
+class LogSink:
+    """Writes every observation as one JSON log line, for log-based pipelines"""
+
+    def __init__(self, site):
+        self.site = site
+
+    def observe(self, name, value, labels):
+        logger.info(json.dumps({"metric": name, "value": round(value, 6), "site": self.site, **labels}))
+
+    def increment(self, name, amount, labels):
+        logger.info(json.dumps({"metric": name, "increment": amount, "site": self.site, **labels}))
+
+    def flush(self, force=False):
+        pass
+
+def get_recorder():
+    """Recorder of the current site, or None when metrics are disabled or there is no site context"""
+    site = getattr(frappe.local, "site", None)
+    if not site:
+        return None
+
+    entry = _recorders.get(site)
+    if entry and entry[1] == os.getpid() and time.monotonic() - entry[0] < CONFIG_TTL:
+        return entry[2]
+
+    with _recorders_lock:
+        recorder = _build_recorder(site)
+        _recorders[site] = (time.monotonic(), os.getpid(), recorder)
+        return recorder
+
+def _build_recorder(site):
+    """Read the sink choice from the settings; any failure leaves metrics off rather than breaking the caller"""
+    try:
+        settings = get_efactura_settings()
+        if not cint(settings.get("enable_metrics")):
+            return None
+        sink = settings.get("metrics_sink") or DEFAULT_SINK
+    except Exception as e:
+        logger.warning(f"e-Factura metrics disabled, settings unavailable: {str(e)}")
+        return None
+
+    sinks = []
+    if "Prometheus" in sink:
+        sinks.append(PrometheusSink())
+    if "Log" in sink:
+        sinks.append(LogSink(site))
+    # Other apps can plug in sinks with the same observe/increment/flush methods
+    for path in frappe.get_hooks("efactura_metrics_sinks"):
+        sinks.append(frappe.get_attr(path)())
+    return Recorder(site, sinks)
+
+def timer(stage, **labels):
+    """Context manager timing one pipeline stage; a shared no-op when metrics are disabled"""
+    recorder = get_recorder()
+    if recorder is None:
+        return nullcontext()
+    return _StageTimer(recorder, stage, labels)
+
+def timed(stage):
+    """Decorator form of timer()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class _StageTimer:
+    def __init__(self, recorder, stage, labels):
+        self.recorder = recorder
+        self.labels = dict(labels, stage=stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = dict(self.labels, outcome="error" if exc_type else "ok")
+        self.recorder.observe("efactura_stage_seconds", time.perf_counter() - self.start, labels)
+        self.recorder.flush()
+
+def record_http_response(recorder, endpoint, seconds, response=None, error=None):
+    """Count one ANAF exchange by status code, and the retries urllib3 made inside it"""
+    if recorder is None:
+        return
+    code = str(response.status_code) if response is not None else type(error).__name__
+    recorder.observe("efactura_http_request_seconds", seconds, {"endpoint": endpoint})
+    recorder.increment("efactura_http_responses_total", 1, {"endpoint": endpoint, "code": code})
+
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    if retries is not None and retries.history:
+        recorder.increment("efactura_http_retries_total", len(retries.history),
+                           {"endpoint": endpoint, "reason": "server_error"})
+
+def record_retry(recorder, endpoint, reason, count=1):
+    if recorder is not None:
+        recorder.increment("efactura_http_retries_total", count, {"endpoint": endpoint, "reason": reason})
+
+def record_queue_wait(job):
+    """Observe how long the running RQ job waited in its queue, once per job even if called again inside it"""
+    global _last_waited_job
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    try:
+        from rq import get_current_job
+        current = get_current_job()
+    except Exception:
+        return
+    if not current or not current.enqueued_at or current.id == _last_waited_job:
+        return
+
+    _last_waited_job = current.id
+
+    started = _as_utc(current.started_at or datetime.now(timezone.utc))
+    recorder.observe("efactura_queue_wait_seconds",
+                     max((started - _as_utc(current.enqueued_at)).total_seconds(), 0), {"job": job})
+
+def flush_metrics():
+    """after_request / after_job hook: write this worker's buffered samples to Redis"""
+    entry = _recorders.get(getattr(frappe.local, "site", None))
+    if entry and entry[1] == os.getpid() and entry[2] is not None:
+        entry[2].flush(force=True)
+
+@frappe.whitelist()
+def get_metrics():
+    """Prometheus text exposition of the site's e-Factura metrics, summed over all workers"""
+    from werkzeug.wrappers import Response
+
+    frappe.only_for("System Manager")
+    flush_metrics()
+    return Response(render_prometheus(_read_series()), mimetype="text/plain; version=0.0.4")
+
+@frappe.whitelist(methods=["POST"])
+def reset_metrics():
+    frappe.only_for("System Manager")
+    frappe.cache().delete_value(METRICS_KEY)
+
+def render_prometheus(series):
+    """Text format 0.0.4 from {series: value}, grouped per metric with buckets in ascending order"""
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        family = sorted(
+            (key for key in series if key.split("{", 1)[0] in (name, f"{name}_bucket", f"{name}_sum", f"{name}_count")),
+            key=_series_sort_key
+        )
+        if not family:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{key} {_format_value(series[key])}" for key in family)
+    return "\n".join(lines) + "\n"
+
+def _read_series():
+    # RedisWrapper's hash helpers pickle values, so the float counters are read with the plain client method
+    from redis import Redis
+
+    cache = frappe.cache()
+    return {
+        _decode(key): float(value)
+        for key, value in Redis.hgetall(cache, cache.make_key(METRICS_KEY)).items()
+    }
+
+def _series(name, labels):
+    if not labels:
+        return name
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{pairs}}}"
+
+def _series_sort_key(series):
+    """Sort by metric and labels, with le compared numerically so buckets come out in order"""
+    name, _sep, labels = series.partition("{")
+    pairs = [pair for pair in labels.rstrip("}").split(",") if pair]
+    le = [pair for pair in pairs if pair.startswith("le=")]
+    bound = float(le[0][4:-1]) if le else 0
+    suffix_order = 1 if name.endswith("_sum") else 2 if name.endswith("_count") else 0
+    base = name.rsplit("_", 1)[0] if suffix_order or name.endswith("_bucket") else name
+    return base, [pair for pair in pairs if not pair.startswith("le=")], suffix_order, bound
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def _as_utc(moment):
+    """RQ stores naive UTC datetimes in older releases and aware ones in newer"""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
@@ -0,0 +1,30 @@
+## pagination.py
+import frappe
+
+DEFAULT_PAGE_SIZE = 500
+
+def iter_pages(doctype, filters=None, fields=None, page_size=DEFAULT_PAGE_SIZE):
+    """Yield pages of matching rows in name order, seeking past the last name instead of using an offset.
+
+    Each query costs O(page) however many rows precede it, and rows updated
+    while iterating are neither skipped nor repeated.
+    """
+    filters = list(filters or [])
+    fields = list(fields or ["name"])
+    if "name" not in fields:
+        fields.append("name")
+
+    last_name = None
+    while True:
+        page = frappe.get_all(
+            doctype,
+            filters=filters + ([["name", ">", last_name]] if last_name is not None else []),
+            fields=fields,
+            order_by="name asc",
+            limit_page_length=page_size
+        )
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_name = page[-1].name
@@ -0,0 +1,83 @@
+## party_cache.py
+import frappe
+import logging
+
+logger = logging.getLogger(__name__)
+PARTY_CACHE_KEY = "efactura_party_snapshot"
+ADDRESS_CACHE_KEY = "efactura_address_snapshot"
+
+# Master data needed for the UBL party block, per party doctype
+PARTY_FIELDS = {
+    "Company": ["name", "company_name as party_name", "tax_id", "trade_register_number as registration_id", "email", "phone_no as phone"],
+    "Customer": ["name", "customer_name as party_name", "tax_id", "email_id as email", "mobile_no as phone"]
+}
+ADDRESS_FIELDS = ["name", "address_line1", "address_line2", "city", "state", "pincode", "country"]
+
+def get_party_snapshot(party_type, party_name, address_name=None):
+    """Plain-dict snapshot of a Company or Customer for XML generation, cached per site in Redis"""
+    snapshot = frappe.cache().hget(
+        PARTY_CACHE_KEY,
+        _party_key(party_type, party_name),
+        generator=lambda: _build_party_snapshot(party_type, party_name)
+    )
+    if not snapshot:
+        return None
+
+    snapshot = dict(snapshot)
+    address_name = address_name or snapshot.get("default_address")
+    snapshot["address"] = get_address_snapshot(address_name) if address_name else None
+    return snapshot
+
+def get_address_snapshot(address_name):
+    """Plain-dict snapshot of an Address with its ISO country code"""
+    return frappe.cache().hget(
+        ADDRESS_CACHE_KEY,
+        address_name,
+        generator=lambda: _build_address_snapshot(address_name)
+    )
+
+def invalidate_party_cache(doc, method=None):
+    """doc_events handler dropping snapshots that embed the changed master data"""
+    if doc.doctype == "Address":
+        frappe.cache().hdel(ADDRESS_CACHE_KEY, doc.name)
+        # Parties linked now or before this save may have gained or lost this address as their default
+        previous = doc.get_doc_before_save()
+        links = list(doc.get("links") or []) + list((previous.get("links") if previous else None) or [])
+        for link in links:
+            if link.link_doctype in PARTY_FIELDS:
+                frappe.cache().hdel(PARTY_CACHE_KEY, _party_key(link.link_doctype, link.link_name))
+    elif doc.doctype in PARTY_FIELDS:
+        frappe.cache().hdel(PARTY_CACHE_KEY, _party_key(doc.doctype, doc.name))
+
+def _build_party_snapshot(party_type, party_name):
+    """Load a party and its default address name with two queries"""
+    party = frappe.db.get_value(party_type, party_name, PARTY_FIELDS[party_type], as_dict=True)
+    if not party:
+        logger.warning(f"{party_type} {party_name} not found for e-Factura party block")
+        return None
+
+    party["party_type"] = party_type
+    party["default_address"] = _get_default_address(party_type, party_name)
+    return party
+
+def _build_address_snapshot(address_name):
+    address = frappe.db.get_value("Address", address_name, ADDRESS_FIELDS, as_dict=True)
+    if address and address.country:
+        address["country_code"] = (frappe.db.get_value("Country", address.country, "code") or "").upper()
+    return address
+
+def _get_default_address(party_type, party_name):
+    """Primary (or company) address linked to the party, falling back to any linked address"""
+    addresses = frappe.db.sql(
+        """select addr.name
+        from `tabAddress` addr
+        inner join `tabDynamic Link` dl on dl.parent = addr.name and dl.parenttype = 'Address'
+        where dl.link_doctype = %s and dl.link_name = %s and ifnull(addr.disabled, 0) = 0
+        order by addr.is_primary_address desc, addr.is_your_company_address desc, addr.creation asc
+        limit 1""",
+        (party_type, party_name)
+    )
+    return addresses[0][0] if addresses else None
+
+def _party_key(party_type, party_name):
+    return f"{party_type}::{party_name}"
@@ -0,0 +1,9 @@
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe_ro_efactura.hooks import custom_fields
+from frappe_ro_efactura.party_cache import PARTY_CACHE_KEY
+import frappe
+
+def execute():
+    """Company trade register number, read by the party cache instead of the free-text registration details"""
+    create_custom_fields(custom_fields, update=True)
+    frappe.cache().delete_value(PARTY_CACHE_KEY)
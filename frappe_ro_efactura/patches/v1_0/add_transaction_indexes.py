@@ -0,0 +1,8 @@
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe_ro_efactura.hooks import custom_fields
+from frappe_ro_efactura.indexes import ensure_indexes
+
+def execute():
+    """Composite indexes for the work queue, status poller and invoice lookups"""
+    create_custom_fields(custom_fields, update=True)
+    ensure_indexes()
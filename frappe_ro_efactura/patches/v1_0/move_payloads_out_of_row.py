@@ -0,0 +1,51 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe_ro_efactura.hooks import custom_fields
+from frappe_ro_efactura.payload_store import INLINE_FIELDS, ensure_payload_table, save_payloads
+
+PAGE_SIZE = 200
+
+def execute():
+    """Move inline XML and ANAF responses of existing transactions into the compressed payload store"""
+    ensure_payload_table()
+    create_custom_fields(custom_fields, update=True)
+
+    last_name = ""
+    while True:
+        rows = frappe.db.sql(
+            """select name, xml_data, anaf_response
+            from `tabEFactura Transaction`
+            where name > %s and (ifnull(xml_data, '') != '' or ifnull(anaf_response, '') != '')
+            order by name
+            limit %s""",
+            (last_name, PAGE_SIZE),
+            as_dict=True
+        )
+        if not rows:
+            break
+
+        entries = [
+            (row.name, kind, row[fieldname])
+            for row in rows
+            for kind, fieldname in INLINE_FIELDS.items()
+            if row[fieldname]
+        ]
+        hashes = {
+            (name, kind): payload_hash
+            for (name, kind, data), payload_hash in zip(entries, save_payloads(entries))
+        }
+
+        frappe.db.bulk_update(
+            "EFactura Transaction",
+            {
+                row.name: {
+                    "xml_data": None,
+                    "anaf_response": None,
+                    **({"xml_hash": hashes[(row.name, "xml")]} if (row.name, "xml") in hashes else {})
+                }
+                for row in rows
+            },
+            update_modified=False
+        )
+        frappe.db.commit()
+        last_name = rows[-1].name
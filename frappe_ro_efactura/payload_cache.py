@@ -0,0 +1,70 @@
+## payload_cache.py
+import frappe
+import hashlib
+import logging
+import zlib
+from frappe.utils import cint
+from .efactura_settings import get_efactura_settings
+
+logger = logging.getLogger(__name__)
+DEFAULT_CACHE_TTL_HOURS = 24
+
+def payload_hash(xml_data) -> str:
+    """Content address of an XML payload"""
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
+    return hashlib.sha256(xml_data).hexdigest()
+
+def get_generated_xml(content_hash):
+    """Unsigned XML previously generated for identical invoice content"""
+    return _get(f"efactura:xml:{content_hash}")
+
+def store_generated_xml(content_hash, xml_data):
+    _set(f"efactura:xml:{content_hash}", xml_data)
+
+def sign_with_cache(signing_context, xml_data):
+    """Sign a payload, reusing the exact signed bytes if this key already signed it"""
+    key = _signed_key(signing_context, xml_data)
+    signed_xml = _get(key)
+    if signed_xml is None:
+        signed_xml = signing_context.sign_xml(xml_data)
+        _set(key, signed_xml)
+    return signed_xml
+
+def sign_many_with_cache(signing_context, xml_documents):
+    """sign_many that only signs cache misses; failures are returned in place and never cached"""
+    keys = [_signed_key(signing_context, xml_data) for xml_data in xml_documents]
+    results = [_get(key) for key in keys]
+    misses = [i for i, signed_xml in enumerate(results) if signed_xml is None]
+
+    if misses:
+        signed = signing_context.sign_many([xml_documents[i] for i in misses])
+        for i, signed_xml in zip(misses, signed):
+            results[i] = signed_xml
+            if isinstance(signed_xml, bytes):
+                _set(keys[i], signed_xml)
+    return results
+
+def _signed_key(signing_context, xml_data):
+    return f"efactura:signed:{signing_context.fingerprint[:16]}:{payload_hash(xml_data)}"
+
+def _get(key):
+    """Read and decompress a cached payload; a broken cache only costs a regeneration"""
+    try:
+        value = frappe.cache().get_value(key, expires=True)
+        return zlib.decompress(value) if value is not None else None
+    except Exception as e:
+        logger.warning(f"Payload cache read failed for {key}: {str(e)}")
+        return None
+
+def _set(key, xml_data):
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
+    try:
+        frappe.cache().set_value(key, zlib.compress(xml_data), expires_in_sec=_ttl())
+    except Exception as e:
+        logger.warning(f"Payload cache write failed for {key}: {str(e)}")
+
+def _ttl():
+    hours = cint(get_efactura_settings().get("payload_cache_ttl")) or DEFAULT_CACHE_TTL_HOURS
+    return hours * 3600
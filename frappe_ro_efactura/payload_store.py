@@ -0,0 +1,166 @@
+## payload_store.py
+import frappe
+import gzip
+import hashlib
+import io
+import logging
+from frappe import _
+from frappe.utils import now_datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+PAYLOAD_TABLE = "__efactura_payload"
+PAYLOAD_KINDS = ("xml", "signed_xml", "anaf_response", "status_response")
+INSERT_CHUNK_SIZE = 50  # keeps multi-row inserts well below max_allowed_packet
+
+# Transaction columns whose content now lives in the payload store
+INLINE_FIELDS = {
+    "xml": "xml_data",
+    "anaf_response": "anaf_response"
+}
+
+def ensure_payload_table():
+    """Create the out-of-row payload table if it does not exist yet"""
+    frappe.db.sql_ddl(f"""create table if not exists `{PAYLOAD_TABLE}` (
+        `transaction` varchar(140) not null,
+        `kind` varchar(32) not null,
+        `payload_hash` char(64) not null,
+        `codec` varchar(8) not null,
+        `size` int not null,
+        `payload` longblob not null,
+        `modified` datetime(6) not null,
+        primary key (`transaction`, `kind`)
+    ) engine=InnoDB row_format=dynamic""")
+
+def save_payload(transaction, kind, data):
+    """Compress and store one payload, returning its content hash"""
+    return save_payloads([(transaction, kind, data)])[0]
+
+def save_payloads(entries):
+    """Store many (transaction, kind, data) payloads in one statement, returning their hashes"""
+    rows, hashes = [], []
+    now = now_datetime()
+    for transaction, kind, data in entries:
+        _check_kind(kind)
+        data = _to_bytes(data)
+        codec, compressed = _compress(data)
+        payload_hash = hashlib.sha256(data).hexdigest()
+        rows.append((transaction, kind, payload_hash, codec, len(data), compressed, now))
+        hashes.append(payload_hash)
+
+    _insert_rows(rows)
+    return hashes
+
+class PayloadWriter:
+    """Write-only file object compressing a payload as it is written, stored when closed.
+
+    For documents too large to hold as text: only the compressed bytes stay in
+    memory. Leaving the with block on an exception stores nothing.
+    """
+
+    def __init__(self, transaction, kind):
+        _check_kind(kind)
+        self.transaction = transaction
+        self.kind = kind
+        self.payload_hash = None
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._buffer = io.BytesIO()
+        if zstandard:
+            self._codec = "zstd"
+            self._compressor = zstandard.ZstdCompressor(level=3).stream_writer(self._buffer)
+        else:
+            self._codec = "gzip"
+            self._compressor = gzip.GzipFile(fileobj=self._buffer, mode="wb", compresslevel=6)
+
+    def write(self, data):
+        data = _to_bytes(data)
+        self._digest.update(data)
+        self._size += len(data)
+        self._compressor.write(data)
+        return len(data)
+
+    def close(self):
+        """Finish compression and store the payload, returning its content hash"""
+        if self.payload_hash is None:
+            if self._codec == "zstd":
+                self._compressor.flush(zstandard.FLUSH_FRAME)
+            else:
+                self._compressor.close()
+            self.payload_hash = self._digest.hexdigest()
+            _insert_rows([(self.transaction, self.kind, self.payload_hash, self._codec, self._size,
+                           self._buffer.getvalue(), now_datetime())])
+        return self.payload_hash
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+def _insert_rows(rows):
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        frappe.db.sql(
+            f"""insert into `{PAYLOAD_TABLE}`
+            (`transaction`, `kind`, `payload_hash`, `codec`, `size`, `payload`, `modified`)
+            values {", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))}
+            on duplicate key update
+                `payload_hash`=values(`payload_hash`), `codec`=values(`codec`), `size`=values(`size`),
+                `payload`=values(`payload`), `modified`=values(`modified`)""",
+            [value for row in chunk for value in row]
+        )
+
+def offload_response_updates(transaction_updates, signed_payloads=None):
+    """Move anaf_response values out of bulk update dicts into the store, along with signed XML"""
+    entries = [(name, "signed_xml", data) for name, data in (signed_payloads or {}).items()]
+    for name, values in transaction_updates.items():
+        response = values.pop("anaf_response", None)
+        if response:
+            entries.append((name, "anaf_response", response))
+    save_payloads(entries)
+
+def load_payload(transaction, kind):
+    """Decompressed payload as text, or None if nothing was stored"""
+    return load_payloads([transaction], kind).get(transaction)
+
+def load_payloads(transactions, kind):
+    """Payloads of one kind for many transactions in one query"""
+    if not transactions:
+        return {}
+    rows = frappe.db.sql(
+        f"""select `transaction`, `codec`, `payload` from `{PAYLOAD_TABLE}`
+        where `kind`=%s and `transaction` in %s""",
+        (kind, tuple(transactions))
+    )
+    return {name: _decompress(codec, payload).decode("utf-8") for name, codec, payload in rows}
+
+def delete_payloads(transaction):
+    frappe.db.sql(f"delete from `{PAYLOAD_TABLE}` where `transaction`=%s", transaction)
+
+def _check_kind(kind):
+    if kind not in PAYLOAD_KINDS:
+        frappe.throw(_("Unknown e-Factura payload kind: {0}").format(kind))
+
+def _compress(data):
+    if zstandard:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=6)
+
+def _decompress(codec, payload):
+    if codec == "zstd":
+        if not zstandard:
+            frappe.throw(_("The zstandard package is required to read this e-Factura payload"))
+        # Streamed frames carry no content size, which one-shot decompress() requires
+        return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    if codec == "gzip":
+        return gzip.decompress(payload)
+    return payload
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
@@ -0,0 +1,267 @@
+## pdf_renderer.py
+import frappe
+import io
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from frappe import _
+from frappe.utils import cint, get_datetime, now_datetime
+from frappe.utils.background_jobs import enqueue
+from frappe.utils.jinja import get_jenv
+from frappe.utils.pdf import cleanup, prepare_options, scrub_urls
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Frappe 14 ships PyPDF2
+    from PyPDF2 import PdfReader, PdfWriter
+from .efactura_settings import get_efactura_settings
+from .invoice_loader import load_invoice_documents
+from .metrics import get_recorder, timer
+
+logger = logging.getLogger(__name__)
+PDF_TEMPLATE = "efactura_template.html"
+DEFAULT_PDF_BATCH_SIZE = 50  # invoices per wkhtmltopdf run
+DEFAULT_PDF_CONCURRENCY = 2  # wkhtmltopdf processes one job runs at a time
+PDF_JOB_TIMEOUT = 3600
+MARKER_PATTERN = re.compile(r"EFACTURA-PDF-DOC-(\d+)-END")
+
+# Compiled PDF template per site of this worker
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_pdf_template():
+    """efactura_template.html compiled once per worker, instead of once per request through get_jenv()"""
+    site = getattr(frappe.local, "site", None)
+    with _templates_lock:
+        if site not in _templates:
+            _templates[site] = get_jenv().get_template(PDF_TEMPLATE)
+        return _templates[site]
+
+def render_transaction_pdfs(names, merge=False):
+    """Render the PDFs of many transactions with few wkhtmltopdf runs and attach them as File documents.
+
+    Returns {transaction: File name}; with merge, also one combined File under the key None.
+    Transactions that fail to render are logged and left out. The caller commits.
+    """
+    settings = get_efactura_settings()
+    batch_size = cint(settings.get("pdf_batch_size")) or DEFAULT_PDF_BATCH_SIZE
+    concurrency = cint(settings.get("pdf_render_concurrency")) or DEFAULT_PDF_CONCURRENCY
+
+    transactions = frappe.get_all(
+        "EFactura Transaction",
+        filters={"name": ["in", list(names)]},
+        fields=["*"]
+    )
+    order = {name: i for i, name in enumerate(names)}
+    transactions.sort(key=lambda row: order[row.name])
+
+    invoices = load_invoice_documents([row.invoice_link for row in transactions])
+    template = get_pdf_template()
+    nowdate = get_datetime().strftime("%d-%m-%Y")
+    documents = []
+    for row in transactions:
+        try:
+            if row.invoice_link not in invoices:
+                raise frappe.DoesNotExistError(_("Sales Invoice {0} not found").format(row.invoice_link))
+            html = template.render({
+                "invoice": invoices[row.invoice_link],
+                "transaction": row,
+                "nowdate": nowdate
+            })
+            documents.append((row.name, html))
+        except Exception as e:
+            _log_render_error(row.name, e)
+
+    with timer("pdf_render"):
+        pdfs = render_pdfs(documents, batch_size, concurrency)
+
+    files = attach_pdfs(pdfs)
+    if merge and pdfs:
+        files[None] = attach_pdfs({None: merge_pdfs([pdfs[name] for name, _html in documents if name in pdfs])})[None]
+    return files
+
+def render_pdfs(documents, batch_size=DEFAULT_PDF_BATCH_SIZE, concurrency=DEFAULT_PDF_CONCURRENCY):
+    """Render [(key, html)] into {key: pdf bytes}, batch_size documents per wkhtmltopdf run.
+
+    A batch whose output cannot be split back per document is rendered again
+    document by document, so one broken invoice does not lose the others.
+    """
+    batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+    # wkhtmltopdf options read the Print Settings, which worker threads have no site context for
+    prepared = [_prepare(_combine([html for _key, html in batch])) for batch in batches]
+
+    pdfs = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            outputs = list(executor.map(_run_wkhtmltopdf, prepared))
+    finally:
+        for _html, options in prepared:
+            cleanup(options)
+
+    for batch, output in zip(batches, outputs):
+        pages = _split_pdf(output, len(batch)) if not isinstance(output, Exception) else None
+        if pages is None:
+            reason = "render_error" if isinstance(output, Exception) else "marker_mismatch"
+            _record_fallback(reason, len(batch), output)
+            pdfs.update(_render_one_by_one(batch))
+            continue
+        pdfs.update((key, pdf) for (key, _html), pdf in zip(batch, pages))
+    return pdfs
+
+def merge_pdfs(pdfs):
+    """Concatenate PDFs into one document"""
+    writer = PdfWriter()
+    for pdf in pdfs:
+        for page in PdfReader(io.BytesIO(pdf)).pages:
+            writer.add_page(page)
+    return _to_bytes(writer)
+
+def attach_pdfs(pdfs):
+    """Save PDFs as private File documents, attached to their transactions.
+
+    pdfs maps transaction name -> bytes; the None key is stored unattached.
+    Returns {key: File name}. If one insert fails, the files already written
+    for this call are removed from disk before the error propagates.
+    """
+    stamp = now_datetime().strftime('%Y%m%d%H%M%S')
+    files, created = {}, []
+    try:
+        for key, content in pdfs.items():
+            file_doc = frappe.get_doc({
+                "doctype": "File",
+                "file_name": f"{key or f'efactura-invoices-{stamp}'}.pdf",
+                "content": content,
+                "is_private": 1,
+                "attached_to_doctype": "EFactura Transaction" if key else None,
+                "attached_to_name": key
+            }).insert(ignore_permissions=True)
+            created.append(file_doc)
+            files[key] = file_doc.name
+    except Exception:
+        for file_doc in created:
+            _remove_written_file(file_doc)
+        raise
+    return files
+
+@frappe.whitelist()
+def render_pdfs_in_background(names, merge=0):
+    """Queue PDF rendering of the given transactions; the user is notified when the files are attached"""
+    names = frappe.parse_json(names)
+    readable = frappe.get_list("EFactura Transaction", filters={"name": ["in", names]}, pluck="name")
+    if len(readable) != len(set(names)):
+        frappe.throw(_("Not permitted to read all selected e-Factura transactions"), frappe.PermissionError)
+
+    enqueue(
+        "frappe_ro_efactura.pdf_renderer.render_pdfs_job",
+        queue="long",
+        timeout=PDF_JOB_TIMEOUT,
+        names=names,
+        merge=cint(merge),
+        user=frappe.session.user,
+        enqueue_after_commit=True
+    )
+
+def render_pdfs_job(names, merge=0, user=None):
+    files = render_transaction_pdfs(names, merge=cint(merge))
+    rendered = len([key for key in files if key])
+    frappe.publish_realtime(
+        "efactura_pdfs_ready",
+        {"count": rendered, "merged": files.get(None), "failed": len(set(names)) - rendered},
+        user=user,
+        after_commit=True
+    )
+
+def _combine(documents):
+    """One HTML document holding every invoice on its own pages, each tagged with an invisible end marker.
+
+    The marker sits on the last page of each invoice, so the combined PDF can
+    be cut after it; styles come from the first document's head.
+    """
+    head = re.search(r"<head[^>]*>(.*?)</head>", documents[0], re.S | re.I)
+    bodies = []
+    for i, html in enumerate(documents):
+        body = re.search(r"<body[^>]*>(.*)</body>", html, re.S | re.I)
+        bodies.append(
+            f'<div style="page-break-after: always">{body.group(1) if body else html}'
+            f'<span style="color: #fff; font-size: 1px">EFACTURA-PDF-DOC-{i}-END</span></div>'
+        )
+    return f"<html><head>{head.group(1) if head else ''}</head><body>{''.join(bodies)}</body></html>"
+
+def _prepare(html):
+    """The HTML and wkhtmltopdf options get_pdf would use, resolved on the calling thread"""
+    html, options = prepare_options(scrub_urls(html), {})
+    options.update({"disable-javascript": "", "disable-local-file-access": ""})
+    return html, options
+
+def _run_wkhtmltopdf(prepared):
+    import pdfkit
+
+    html, options = prepared
+    try:
+        return pdfkit.from_string(html, False, options=options)
+    except Exception as e:
+        return e
+
+def _split_pdf(pdf, count):
+    """Cut a combined PDF after each end marker; None if the markers do not match the document count"""
+    reader = PdfReader(io.BytesIO(pdf))
+    writers, writer, expected = [], PdfWriter(), 0
+    for page in reader.pages:
+        writer.add_page(page)
+        markers = [int(index) for index in MARKER_PATTERN.findall(page.extract_text() or "")]
+        if not markers:
+            continue
+        if markers != [expected]:
+            return None
+        writers.append(writer)
+        writer, expected = PdfWriter(), expected + 1
+
+    if expected != count:
+        return None
+    return [_to_bytes(w) for w in writers]
+
+def _render_one_by_one(batch):
+    pdfs = {}
+    for key, html in batch:
+        prepared = _prepare(html)
+        try:
+            output = _run_wkhtmltopdf(prepared)
+        finally:
+            cleanup(prepared[1])
+        if isinstance(output, Exception):
+            _log_render_error(key, output)
+        else:
+            pdfs[key] = output
+    return pdfs
+
+def _remove_written_file(file_doc):
+    """Delete a File's content from disk unless another File row shares it (identical content is deduplicated)"""
+    if frappe.db.exists("File", {"file_url": file_doc.file_url, "name": ["!=", file_doc.name]}):
+        return
+    try:
+        os.remove(file_doc.get_full_path())
+    except OSError as e:
+        logger.warning(f"Could not remove orphaned PDF {file_doc.file_url}: {str(e)}")
+
+def _record_fallback(reason, count, output):
+    """A combined batch could not be used; its invoices are rendered one by one"""
+    detail = str(output) if isinstance(output, Exception) else "end markers did not match the documents"
+    logger.warning(f"PDF batch of {count} invoices rendered one by one ({reason}): {detail}")
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.increment("efactura_pdf_fallbacks_total", 1, {"reason": reason})
+
+def _log_render_error(name, error):
+    logger.error(f"PDF rendering failed for {name}: {str(error)}")
+    frappe.log_error(
+        title=_("e-Factura PDF Error"),
+        message=f"{name}: {str(error)}",
+        reference_doctype="EFactura Transaction",
+        reference_name=name
+    )
+
+def _to_bytes(writer):
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,186 @@
+## rate_limiter.py
+import frappe
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
+THROTTLE_STATUS_CODES = (429, 503)
+MIN_RATE_RATIO = 0.05  # adaptive rate never drops below this share of the configured rate
+INCREASE_RATIO = 0.02  # additive increase per accepted request, as a share of the configured rate
+MAX_WAIT = 120  # seconds a caller may wait for a token before giving up
+STATE_TTL_MS = 3600 * 1000
+
+# KEYS[1] bucket hash; ARGV: now_ms, default_rate, burst
+# Returns 0 when a token was taken, otherwise the milliseconds to wait
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local rate = tonumber(state[3]) or tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local blocked_until = tonumber(state[4]) or 0
+if blocked_until > now then
+    return math.ceil(blocked_until - now)
+end
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'rate', tostring(rate))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return wait
+"""
+
+# KEYS[1] bucket hash; ARGV: now_ms, throttled, default_rate, min_rate, max_rate, increase, decrease, retry_after_ms
+FEEDBACK_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[3])
+if ARGV[2] == '1' then
+    rate = math.max(tonumber(ARGV[4]), rate * tonumber(ARGV[7]))
+    local retry_after = tonumber(ARGV[8])
+    if retry_after > 0 then
+        local blocked_until = tonumber(ARGV[1]) + retry_after
+        local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+        if blocked_until > current then
+            redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+        end
+    end
+else
+    rate = math.min(tonumber(ARGV[5]), rate + tonumber(ARGV[6]))
+end
+redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+return tostring(rate)
+"""
+
+class RateLimitTimeout(RequestException):
+    """Raised when no token could be obtained within MAX_WAIT"""
+
+class RateLimiter:
+    """Cluster-wide token bucket with AIMD rate adaptation, shared through Redis.
+
+    Built on the calling thread so the site-scoped key and the Redis client are
+    resolved while Frappe context exists; afterwards it is safe to use from
+    worker threads. Falls back to an in-process bucket when Redis is unreachable.
+    """
+
+    def __init__(self, bucket, rate, burst, backoff):
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.backoff = float(backoff)
+        self.min_rate = self.rate * MIN_RATE_RATIO
+        self.increase = self.rate * INCREASE_RATIO
+        self._local = _LocalBucket(self.rate, self.burst)
+        self._redis = None
+        try:
+            cache = frappe.cache()
+            self.key = cache.make_key(f"efactura:ratelimit:{bucket}")
+            self._acquire_script = cache.register_script(ACQUIRE_SCRIPT)
+            self._feedback_script = cache.register_script(FEEDBACK_SCRIPT)
+            self._redis = cache
+        except Exception as e:
+            logger.warning(f"Rate limiter for {bucket} using in-process bucket: {str(e)}")
+
+    def acquire(self):
+        """Block until a request may be sent under the shared rate"""
+        deadline = time.monotonic() + MAX_WAIT
+        while True:
+            wait_ms = self._try_acquire()
+            if not wait_ms:
+                return
+            if time.monotonic() + wait_ms / 1000 > deadline:
+                raise RateLimitTimeout("ANAF rate limit wait exceeded")
+            time.sleep(wait_ms / 1000)
+
+    def on_response(self, status_code, retry_after=None):
+        """Adapt the shared rate: multiplicative decrease when throttled, additive increase otherwise"""
+        throttled = status_code in THROTTLE_STATUS_CODES
+        retry_after_ms = int(parse_retry_after(retry_after) * 1000) if throttled else 0
+        if throttled:
+            logger.warning(f"ANAF throttled request ({status_code}), retry after {retry_after_ms} ms")
+
+        if self._redis:
+            try:
+                self._feedback_script(
+                    keys=[self.key],
+                    args=[_now_ms(), int(throttled), self.rate, self.min_rate, self.rate,
+                          self.increase, self.backoff, retry_after_ms]
+                )
+                return
+            except Exception as e:
+                logger.warning(f"Rate limiter feedback fell back to in-process bucket: {str(e)}")
+        self._local.feedback(throttled, self.min_rate, self.rate, self.increase, self.backoff, retry_after_ms)
+
+    def _try_acquire(self):
+        """Take a token, returning 0 or the milliseconds to wait"""
+        if self._redis:
+            try:
+                return int(self._acquire_script(
+                    keys=[self.key],
+                    args=[_now_ms(), self.rate, self.burst, STATE_TTL_MS]
+                ))
+            except Exception as e:
+                logger.warning(f"Rate limiter acquire fell back to in-process bucket: {str(e)}")
+        return self._local.acquire()
+
+class _LocalBucket:
+    """In-process equivalent of the Redis scripts, used when Redis is unavailable"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.ts = _now_ms()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = _now_ms()
+            if self.blocked_until > now:
+                return self.blocked_until - now
+            self.tokens = min(self.burst, self.tokens + max(0, now - self.ts) * self.rate / 1000)
+            self.ts = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return int((1 - self.tokens) * 1000 / self.rate) + 1
+
+    def feedback(self, throttled, min_rate, max_rate, increase, backoff, retry_after_ms):
+        with self.lock:
+            if throttled:
+                self.rate = max(min_rate, self.rate * backoff)
+                self.blocked_until = max(self.blocked_until, _now_ms() + retry_after_ms)
+            else:
+                self.rate = min(max_rate, self.rate + increase)
+
+def get_rate_limiter(bucket, config):
+    """Build the limiter for an ANAF endpoint group from the connection config"""
+    limits = config.get('rate_limits') or {}
+    return RateLimiter(
+        bucket,
+        rate=limits.get(bucket) or 1,
+        burst=limits.get('burst') or 1,
+        backoff=limits.get('backoff') or 0.5
+    )
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header given as delta-seconds or HTTP date"""
+    if not value:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _now_ms():
+    return int(time.time() * 1000)
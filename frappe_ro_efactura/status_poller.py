@@ -0,0 +1,108 @@
+## status_poller.py
+import frappe
+import logging
+import time
+from frappe.utils import add_to_date, cint, now_datetime
+from .anaf_client import get_pooled_client
+from .efactura_settings import get_efactura_settings
+from .payload_store import save_payloads
+from .invoice_status_sync import sync_invoice_statuses
+from .metrics import record_queue_wait, timer
+
+logger = logging.getLogger(__name__)
+DEFAULT_PAGE_SIZE = 500
+POLL_TIME_BUDGET = 240  # seconds, keeps one run inside the 5 minute schedule
+BASE_INTERVAL_MINUTES = 5
+MAX_INTERVAL_MINUTES = 6 * 60
+
+# ANAF processing states ("stare") mapped to transaction statuses
+FINAL_STATES = {
+    "ok": "Accepted",
+    "nok": "Rejected"
+}
+
+def poll_submitted_transactions():
+    """Scheduled job polling ANAF for due Submitted transactions, page by page within a time budget"""
+    record_queue_wait("poll_submitted_transactions")
+    settings = get_efactura_settings()
+    if not settings.is_configured():
+        return
+
+    client = get_pooled_client(settings)
+    page_size = cint(settings.get("status_poll_page_size")) or DEFAULT_PAGE_SIZE
+    deadline = time.monotonic() + POLL_TIME_BUDGET
+
+    while time.monotonic() < deadline:
+        rows = _get_due_transactions(page_size)
+        if not rows:
+            break
+
+        responses = client.check_status_many([row.anaf_uuid for row in rows])
+        with timer("db_write"):
+            _apply_results(rows, responses)
+            frappe.db.commit()
+
+        if len(rows) < page_size:
+            break
+
+def _get_due_transactions(limit):
+    """Submitted transactions whose next status check is due, most overdue first.
+
+    Every polled row gets its next check pushed into the future, so repeated
+    calls advance through the backlog without an offset.
+    """
+    return frappe.db.sql(
+        """select name, anaf_uuid, invoice_link, ifnull(status_checks, 0) as status_checks
+        from `tabEFactura Transaction`
+        where status='Submitted' and ifnull(anaf_uuid, '') != ''
+            and (next_status_check is null or next_status_check <= %s)
+        order by next_status_check
+        limit %s""",
+        (now_datetime(), limit),
+        as_dict=True
+    )
+
+def _apply_results(rows, responses):
+    """Write status changes and rescheduled checks back in bulk"""
+    now = now_datetime()
+    transaction_updates, invoice_updates, status_responses = {}, {}, []
+
+    for row in rows:
+        response = responses.get(row.anaf_uuid) or {}
+        new_status = _final_status(response)
+        checks = row.status_checks + 1
+
+        if new_status:
+            transaction_updates[row.name] = {
+                "status": new_status,
+                "status_checks": checks,
+                "next_status_check": None
+            }
+            # The upload response in anaf_response is kept; the verdict is stored next to it
+            status_responses.append((row.name, "status_response", frappe.as_json(response.get("details"))))
+            invoice_updates[row.invoice_link] = {"efactura_status": new_status}
+        else:
+            transaction_updates[row.name] = {
+                "status_checks": checks,
+                "next_status_check": add_to_date(now, minutes=next_interval(checks))
+            }
+
+    save_payloads(status_responses)
+    frappe.db.bulk_update("EFactura Transaction", transaction_updates)
+    sync_invoice_statuses(invoice_updates)
+
+    if invoice_updates:
+        logger.info(f"Status poller resolved {len(invoice_updates)} of {len(rows)} transactions")
+
+def _final_status(response):
+    """Transaction status for a final ANAF verdict, None while still processing or on errors"""
+    if response.get("status") != "success":
+        return None
+    details = response.get("details")
+    if not isinstance(details, dict):
+        return None
+    return FINAL_STATES.get(str(details.get("stare", "")).lower())
+
+def next_interval(checks):
+    """Exponential backoff between status checks of one transaction, in minutes"""
+    return min(BASE_INTERVAL_MINUTES * 2 ** max(checks - 1, 0), MAX_INTERVAL_MINUTES)
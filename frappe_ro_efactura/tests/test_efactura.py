@@ -0,0 +1,26 @@
+## test_efactura.py
+from unittest.mock import Mock
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe_ro_efactura.efactura import handle_invoice_cancellation
+from frappe_ro_efactura.tests.test_transitions import delete_test_transactions, make_transaction, row
+
+class TestInvoiceCancellation(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_transaction_being_uploaded_refuses_cancellation(self):
+        transaction = make_transaction("Processing", lease_token="worker")
+        invoice = Mock(efactura_transaction=transaction.name)
+
+        self.assertRaises(frappe.ValidationError, handle_invoice_cancellation, invoice, "on_cancel")
+        self.assertEqual((row(transaction.name).status, row(transaction.name).lease_token), ("Processing", "worker"))
+        invoice.db_set.assert_not_called()
+
+    def test_failed_transaction_is_cancelled_with_the_invoice(self):
+        transaction = make_transaction("Failed")
+        invoice = Mock(efactura_transaction=transaction.name)
+
+        handle_invoice_cancellation(invoice, "on_cancel")
+        self.assertEqual(row(transaction.name).status, "Cancelled")
+        invoice.db_set.assert_called_once_with("efactura_status", "Cancelled")
@@ -0,0 +1,180 @@
+## test_invoice_rules.py
+import copy
+import unittest
+from pathlib import Path
+import frappe
+from lxml import etree
+from frappe_ro_efactura.benchmarks.synthetic import make_invoice, make_invoices, make_rule_corpus
+from frappe_ro_efactura.invoice_rules import SCHEMATRON_RULES, check_invoice, rule_id
+from frappe_ro_efactura.unit_codes import UOM_UNIT_CODES, unit_code
+from frappe_ro_efactura.xml_generator import XMLGenerator
+
+PARITY_SCHEMATRON = Path(__file__).parent / "rules" / "en16931_subset.sch"
+PRODUCTION_SCHEMATRON = Path(__file__).parents[1] / "schemas" / "eFactura.sch"
+
+def as_invoice(snapshot):
+    invoice = frappe._dict(snapshot)
+    invoice["items"] = [frappe._dict(item) for item in snapshot["items"]]
+    return invoice
+
+def rules(invoice):
+    return {violation["rule"] for violation in check_invoice(invoice)}
+
+def variants():
+    """Rule-breaking variants of sample invoices, plus edge cases where a loose check would disagree with Schematron"""
+    invoice = make_invoice(0, lines=3, seed=1)
+    corpus = [(case, snapshot) for case, _rule, snapshot in make_rule_corpus(make_invoices(3, lines=3, seed=1))]
+    edge_cases = {
+        "whitespace_number": lambda invoice: invoice.update(name=" "),
+        "padded_currency": lambda invoice: invoice.update(currency=" RON "),
+        "split_currency": lambda invoice: invoice.update(currency="R ON"),
+        "whitespace_currency": lambda invoice: invoice.update(currency=" "),
+        "no_currency_value": lambda invoice: invoice.update(currency=None),
+        "lowercase_uom": lambda invoice: invoice["items"][0].update(uom="kg"),
+        "uom_named_by_code": lambda invoice: invoice["items"][0].update(uom="MTQ"),
+        "uom_shaped_like_code": lambda invoice: invoice["items"][0].update(uom="ZZX"),
+        "unmapped_uom": lambda invoice: invoice["items"][0].update(uom="Litri"),
+        "uom_with_spaces": lambda invoice: invoice["items"][0].update(uom="Square Foot"),
+        "no_uom": lambda invoice: invoice["items"][0].update(uom=None),
+        "zero_quantity": lambda invoice: invoice["items"][0].update(qty=0),
+        "registration_id_only": lambda invoice: invoice["supplier_party"].update(tax_id="", registration_id="J40/1/2020"),
+        "cui_without_prefix": lambda invoice: invoice["supplier_party"].update(tax_id="12345674"),
+    }
+    for case, mutate in edge_cases.items():
+        snapshot = copy.deepcopy(invoice)
+        mutate(snapshot)
+        corpus.append((case, snapshot))
+    return corpus
+
+class TestInvoiceRules(unittest.TestCase):
+    def setUp(self):
+        self.invoice = as_invoice(make_invoice(0, lines=3, seed=1))
+
+    def test_sample_invoice_is_valid(self):
+        self.assertEqual(check_invoice(self.invoice), [])
+
+    def test_erpnext_uoms_are_mapped_before_the_code_check(self):
+        for uom in ("Nos", "Unit", "Kg", "Box", "Hour", "buc", "kgm"):
+            self.invoice["items"][0]["uom"] = uom
+            self.assertEqual(rules(self.invoice), set(), uom)
+        self.assertEqual(unit_code("Nos"), "H87")
+        self.assertEqual(unit_code("kgm"), "KGM")
+
+    def test_unmapped_uom_is_reported_not_sent_as_pieces(self):
+        for uom in ("Palet", "Litri", "ZZX"):
+            self.invoice["items"][0]["uom"] = uom
+            self.assertEqual(unit_code(uom), uom)
+            self.assertEqual(rules(self.invoice), {"BR-CL-23"}, uom)
+
+    def test_line_without_uom_has_no_unit_code(self):
+        self.invoice["items"][0]["uom"] = None
+        self.assertEqual(rules(self.invoice), {"BR-23"})
+
+    def test_missing_quantity_has_no_unit_code_either(self):
+        self.invoice["items"][1]["qty"] = None
+        self.assertEqual(rules(self.invoice) & {"BR-22", "BR-23"}, {"BR-22", "BR-23"})
+
+    def test_blank_currency_fails_both_currency_rules(self):
+        self.invoice["currency"] = ""
+        self.assertTrue({"BR-05", "BR-CL-04"} <= rules(self.invoice))
+
+    def test_seller_without_any_identifier(self):
+        self.invoice["supplier_party"]["tax_id"] = ""
+        self.assertIn("BR-CO-26", rules(self.invoice))
+        self.invoice["supplier_party"]["registration_id"] = "J40/1/2020"
+        self.assertNotIn("BR-CO-26", rules(self.invoice))
+
+    def test_grand_total_discount_is_already_in_net_total_and_taxes(self):
+        # ERPNext spreads a Grand Total discount over the net amounts and the tax rows
+        discounted(self.invoice, 100)
+        self.assertEqual(rules(self.invoice), set())
+
+    def test_wrong_grand_total(self):
+        self.invoice["grand_total"] = flt2(self.invoice["grand_total"] - 1)
+        self.assertIn("BR-CO-15", rules(self.invoice))
+
+    def test_grand_total_with_rounding_adjustment(self):
+        self.invoice["rounding_adjustment"] = 0.4
+        self.invoice["grand_total"] = flt2(self.invoice["grand_total"] + 0.4)
+        self.assertNotIn("BR-CO-15", rules(self.invoice))
+
+    def test_vat_breakdown_uses_amounts_after_discount(self):
+        discounted(self.invoice, 100)
+        self.assertNotIn("BR-CO-14", rules(self.invoice))
+        self.invoice["taxes"][0]["tax_amount_after_discount_amount"] = self.invoice["taxes"][0]["tax_amount"]
+        self.assertIn("BR-CO-14", rules(self.invoice))
+
+    def test_vat_rate_only_on_vat_rows(self):
+        shipping = {"idx": 2, "charge_type": "Actual", "account_head": "Transport", "account_type": "Chargeable",
+                    "rate": 0, "tax_amount": 25, "tax_amount_after_discount_amount": 25}
+        stamp = {"idx": 3, "charge_type": "On Net Total", "account_head": "Timbru verde", "account_type": "Income Account",
+                 "rate": 2, "tax_amount": 10, "tax_amount_after_discount_amount": 10}
+        self.invoice["taxes"] += [shipping, stamp]
+        self.invoice["total_taxes_and_charges"] = flt2(self.invoice["total_taxes_and_charges"] + 35)
+        self.invoice["grand_total"] = flt2(self.invoice["grand_total"] + 35)
+        self.assertEqual(rules(self.invoice), set())
+
+        self.invoice["taxes"][0]["rate"] = 20
+        self.assertEqual(rules(self.invoice), {"RO-VAT-RATE"})
+
+    def test_rule_id_of_official_and_native_messages(self):
+        self.assertEqual(rule_id("[BR-CL-23]-Unit code MUST be coded according to..."), "BR-CL-23")
+        self.assertEqual(rule_id("BR-CO-26: The Seller shall have..."), "BR-CO-26")
+
+class TestSchematronParity(unittest.TestCase):
+    """The native rules that have a Schematron twin must report exactly what the official asserts report"""
+
+    def assert_parity(self, schematron_file):
+        generator = XMLGenerator(schematron_file)
+        mismatches = []
+        for case, snapshot in variants():
+            invoice = as_invoice(snapshot)
+            native = rules(invoice) & SCHEMATRON_RULES
+            xml = generator.generate_ubl_21(invoice)
+            schematron = {rule_id(error["message"]) for error in generator.schematron_errors(xml)}
+            if native != schematron:
+                mismatches.append((case, sorted(native), sorted(schematron)))
+        self.assertEqual(mismatches, [], "(case, native, schematron)")
+
+    def test_parity_with_en16931_asserts(self):
+        self.assert_parity(PARITY_SCHEMATRON)
+
+    def test_every_mapped_uom_is_accepted(self):
+        generator = XMLGenerator(PARITY_SCHEMATRON)
+        invoice = as_invoice(make_invoice(0, lines=1, seed=1))
+        for uom in sorted(UOM_UNIT_CODES):
+            invoice["items"][0]["uom"] = uom
+            errors = generator.schematron_errors(generator.generate_ubl_21(invoice))
+            self.assertEqual([error["message"] for error in errors], [], uom)
+
+    def test_parity_with_production_schematron(self):
+        # schemas/eFactura.sch is deployed per site; the repository only carries a placeholder, if anything
+        if not PRODUCTION_SCHEMATRON.exists():
+            self.skipTest("schemas/eFactura.sch is not installed")
+        content = PRODUCTION_SCHEMATRON.read_text(errors="replace")
+        if not all(rule in content for rule in SCHEMATRON_RULES):
+            self.skipTest("schemas/eFactura.sch is a placeholder without the EN 16931 asserts")
+        try:
+            etree.Schematron(etree.parse(str(PRODUCTION_SCHEMATRON)))
+        except etree.LxmlError as e:
+            self.skipTest(f"schemas/eFactura.sch does not compile with lxml: {e}")
+        self.assert_parity(PRODUCTION_SCHEMATRON)
+
+def discounted(invoice, discount):
+    """Apply a Grand Total discount the way ERPNext does: line net amounts and tax amounts both shrink"""
+    share = discount / invoice["grand_total"]
+    net_discount = flt2(invoice["net_total"] * share)
+    for item in invoice["items"]:
+        item["net_amount"] = item["amount"]
+    invoice["items"][0]["net_amount"] = flt2(invoice["items"][0]["amount"] - net_discount)
+    tax = invoice["taxes"][0]
+    tax["tax_amount_after_discount_amount"] = flt2(tax["tax_amount"] - (discount - net_discount))
+    invoice.update(
+        apply_discount_on="Grand Total", discount_amount=discount,
+        net_total=flt2(invoice["net_total"] - net_discount),
+        total_taxes_and_charges=tax["tax_amount_after_discount_amount"],
+        grand_total=flt2(invoice["grand_total"] - discount)
+    )
+
+def flt2(value):
+    return round(value, 2)
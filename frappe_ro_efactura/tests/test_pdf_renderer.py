@@ -0,0 +1,108 @@
+## test_pdf_renderer.py
+import importlib.util
+import io
+import shutil
+import unittest
+from unittest.mock import patch
+from frappe_ro_efactura import pdf_renderer
+from frappe_ro_efactura.pdf_renderer import PdfReader, _combine, _split_pdf, render_pdfs
+
+def make_pdf(page_texts):
+    """Minimal PDF with one Helvetica text line per page, enough for extract_text()"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        content = f"BT /F1 1 Tf 10 10 Td ({text}) Tj ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    pdf, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def page_texts(pdf):
+    return [page.extract_text().strip() for page in PdfReader(io.BytesIO(pdf)).pages]
+
+class TestSplitPdf(unittest.TestCase):
+    def test_cuts_after_each_end_marker(self):
+        combined = make_pdf([
+            "Invoice A page 1", "Invoice A page 2 EFACTURA-PDF-DOC-0-END",
+            "Invoice B EFACTURA-PDF-DOC-1-END",
+            "Invoice C page 1", "Invoice C page 2", "Invoice C page 3 EFACTURA-PDF-DOC-2-END"
+        ])
+        parts = _split_pdf(combined, 3)
+
+        self.assertEqual([len(page_texts(part)) for part in parts], [2, 1, 3])
+        self.assertEqual(page_texts(parts[1]), ["Invoice B EFACTURA-PDF-DOC-1-END"])
+        self.assertTrue(page_texts(parts[2])[0].startswith("Invoice C page 1"))
+
+    def test_missing_marker_is_a_mismatch(self):
+        combined = make_pdf(["A EFACTURA-PDF-DOC-0-END", "B without its marker"])
+        self.assertIsNone(_split_pdf(combined, 2))
+
+    def test_markers_out_of_order_are_a_mismatch(self):
+        combined = make_pdf(["A EFACTURA-PDF-DOC-1-END", "B EFACTURA-PDF-DOC-0-END"])
+        self.assertIsNone(_split_pdf(combined, 2))
+
+    def test_two_documents_on_one_page_are_a_mismatch(self):
+        # A page break that wkhtmltopdf dropped puts two markers on one page
+        combined = make_pdf(["A EFACTURA-PDF-DOC-0-END B EFACTURA-PDF-DOC-1-END"])
+        self.assertIsNone(_split_pdf(combined, 2))
+
+class TestRenderPdfs(unittest.TestCase):
+    def setUp(self):
+        # wkhtmltopdf options are read from Print Settings, which needs a site
+        for patcher in (patch.object(pdf_renderer, "_prepare", side_effect=lambda html: (html, {})),
+                        patch.object(pdf_renderer, "cleanup")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_batch_is_split_per_document(self):
+        combined = make_pdf(["first EFACTURA-PDF-DOC-0-END", "second EFACTURA-PDF-DOC-1-END"])
+        with patch.object(pdf_renderer, "_run_wkhtmltopdf", return_value=combined) as run, \
+                patch.object(pdf_renderer, "_record_fallback") as fallback:
+            pdfs = render_pdfs([("T1", "<p>1</p>"), ("T2", "<p>2</p>")], batch_size=10)
+
+        self.assertEqual(run.call_count, 1)
+        fallback.assert_not_called()
+        self.assertEqual(page_texts(pdfs["T2"]), ["second EFACTURA-PDF-DOC-1-END"])
+
+    def test_marker_mismatch_falls_back_and_is_recorded(self):
+        single = make_pdf(["one invoice"])
+        outputs = [make_pdf(["no markers at all"]), single, single]
+        with patch.object(pdf_renderer, "_run_wkhtmltopdf", side_effect=outputs), \
+                patch.object(pdf_renderer, "_record_fallback") as fallback:
+            pdfs = render_pdfs([("T1", "<p>1</p>"), ("T2", "<p>2</p>")], batch_size=10)
+
+        fallback.assert_called_once()
+        self.assertEqual(fallback.call_args[0][:2], ("marker_mismatch", 2))
+        self.assertEqual(set(pdfs), {"T1", "T2"})
+
+    def test_combined_html_tags_each_document(self):
+        html = _combine(["<html><head><style>p{}</style></head><body><p>A</p></body></html>", "<p>B</p>"])
+        self.assertIn("<style>p{}</style>", html)
+        self.assertIn("EFACTURA-PDF-DOC-0-END", html)
+        self.assertIn("EFACTURA-PDF-DOC-1-END", html)
+
+    @unittest.skipUnless(shutil.which("wkhtmltopdf") and importlib.util.find_spec("pdfkit"), "wkhtmltopdf is not installed")
+    def test_wkhtmltopdf_keeps_the_markers_extractable(self):
+        # The markers are 1px white text; this proves the real renderer keeps them in the text layer
+        documents = [(f"T{i}", f"<html><body><p>Invoice {i}</p></body></html>") for i in range(3)]
+        with patch.object(pdf_renderer, "_run_wkhtmltopdf", wraps=pdf_renderer._run_wkhtmltopdf) as run, \
+                patch.object(pdf_renderer, "_record_fallback") as fallback:
+            pdfs = render_pdfs(documents, batch_size=3)
+
+        self.assertEqual(run.call_count, 1)
+        fallback.assert_not_called()
+        self.assertEqual(set(pdfs), {"T0", "T1", "T2"})
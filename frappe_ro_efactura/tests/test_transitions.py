@@ -0,0 +1,96 @@
+## test_transitions.py
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+from frappe_ro_efactura.efactura_transaction import lock_transactions, renew_leases, transition_status
+
+TEST_INVOICE_PREFIX = "_Test eFactura"
+
+def make_transaction(status="Draft", **values):
+    """EFactura Transaction row written directly, skipping XML generation and the Sales Invoice lookup"""
+    doc = frappe.get_doc(dict(
+        {"doctype": "EFactura Transaction", "invoice_link": f"{TEST_INVOICE_PREFIX} {frappe.generate_hash(length=8)}",
+         "status": status, "xml_hash": "0" * 64, "retry_count": 0},
+        **values
+    ))
+    doc.name = frappe.generate_hash(length=10)
+    doc.db_insert()
+    frappe.db.commit()
+    return doc
+
+def delete_test_transactions():
+    frappe.db.delete("EFactura Transaction", {"invoice_link": ["like", f"{TEST_INVOICE_PREFIX}%"]})
+    frappe.db.commit()
+
+def row(name):
+    return frappe.db.get_value("EFactura Transaction", name, ["status", "lease_token", "lease_expires_at", "retry_count",
+                                                                 "next_attempt_at"], as_dict=True)
+
+class TestTransitionStatus(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_only_one_of_two_claims_wins(self):
+        transaction = make_transaction("Draft")
+        first = frappe.get_doc("EFactura Transaction", transaction.name)
+        second = frappe.get_doc("EFactura Transaction", transaction.name)
+
+        self.assertTrue(first.claim_for_submission())
+        # The second worker still believes the row is a Draft
+        self.assertFalse(second.claim_for_submission())
+        self.assertEqual(row(transaction.name).lease_token, first.lease_token)
+
+    def test_wrong_source_status_is_refused(self):
+        transaction = make_transaction("Failed")
+        self.assertFalse(transition_status(transaction.name, "Processing", from_status="Draft"))
+        self.assertEqual(row(transaction.name).status, "Failed")
+
+    def test_transition_not_in_the_table_throws(self):
+        transaction = make_transaction("Submitted")
+        self.assertRaises(frappe.ValidationError, transition_status, transaction.name, "Draft", from_status="Submitted")
+
+    def test_any_allowed_source_when_none_given(self):
+        transaction = make_transaction("Failed")
+        self.assertTrue(transition_status(transaction.name, "Cancelled"))
+        self.assertFalse(transition_status(make_transaction("Accepted").name, "Cancelled"))
+
+    def test_any_of_several_given_sources(self):
+        transaction = make_transaction("Rejected")
+        self.assertTrue(transition_status(transaction.name, "Cancelled", from_status=("Draft", "Rejected")))
+        self.assertEqual(row(transaction.name).status, "Cancelled")
+        self.assertFalse(transition_status(transaction.name, "Cancelled", from_status=("Draft", "Rejected")))
+
+    def test_lease_guard(self):
+        transaction = make_transaction("Processing", lease_token="owner")
+        self.assertFalse(transition_status(transaction.name, "Submitted", from_status="Processing", lease_token="stale"))
+        self.assertEqual(row(transaction.name).status, "Processing")
+
+        self.assertTrue(transition_status(transaction.name, "Submitted", from_status="Processing",
+                                          values={"lease_token": None}, lease_token="owner"))
+        self.assertEqual(row(transaction.name).status, "Submitted")
+        self.assertIsNone(row(transaction.name).lease_token)
+
+    def test_renew_leases_only_extends_the_holders_rows(self):
+        expires = add_to_date(now_datetime(), seconds=30)
+        held = make_transaction("Processing", lease_token="owner", lease_expires_at=expires)
+        other = make_transaction("Processing", lease_token="someone else", lease_expires_at=expires)
+
+        renew_leases([held.name, other.name], "owner", 600)
+
+        self.assertGreater(row(held.name).lease_expires_at, add_to_date(now_datetime(), seconds=500))
+        self.assertLess(row(other.name).lease_expires_at, add_to_date(now_datetime(), seconds=60))
+
+class TestLockTransactions(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_returns_current_values_of_existing_rows(self):
+        transaction = make_transaction("Processing", lease_token="owner")
+        rows = lock_transactions([transaction.name, "missing"])
+        frappe.db.rollback()
+
+        self.assertEqual(set(rows), {transaction.name})
+        self.assertEqual((rows[transaction.name].status, rows[transaction.name].lease_token), ("Processing", "owner"))
+
+    def test_no_names_no_query(self):
+        self.assertEqual(lock_transactions([]), {})
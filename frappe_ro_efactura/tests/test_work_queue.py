@@ -0,0 +1,98 @@
+## test_work_queue.py
+from unittest.mock import patch
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+from frappe_ro_efactura import batch_submission
+from frappe_ro_efactura.batch_submission import _claim_transactions, _write_results
+from frappe_ro_efactura.efactura_transaction import transition_status
+from frappe_ro_efactura.tests.test_transitions import delete_test_transactions, make_transaction, row
+from frappe_ro_efactura.work_queue import LEASE_SECONDS, claim_due_transactions, release_expired_leases
+
+# Every claim and release is limited to the test's own rows, so other transactions on the site are never touched
+class TestClaims(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_due_rows_are_leased_once(self):
+        due = make_transaction("Failed", retry_count=1)
+        waiting = make_transaction("Failed", retry_count=1, next_attempt_at=add_to_date(now_datetime(), minutes=10))
+        exhausted = make_transaction("Failed", retry_count=3)
+
+        fixtures = [due.name, waiting.name, exhausted.name]
+        claimed = {claim.name: claim for claim in claim_due_transactions(1000, names=fixtures)}
+        self.assertIn(due.name, claimed)
+        self.assertFalse({waiting.name, exhausted.name} & set(claimed))
+        self.assertEqual(row(due.name).status, "Processing")
+        self.assertEqual(row(due.name).lease_token, claimed[due.name].lease_token)
+
+        # A second worker finds nothing left to take
+        self.assertEqual(claim_due_transactions(1000, names=fixtures), [])
+
+    def test_batch_claim_drops_rows_taken_since_they_were_read(self):
+        kept, taken = make_transaction("Draft"), make_transaction("Draft")
+        real_now = batch_submission.now_datetime
+
+        def another_worker_claims_first():
+            # Runs between the batch's read and its conditional update
+            transition_status(taken.name, "Processing", from_status="Draft", values={"lease_token": "other worker"})
+            frappe.db.commit()
+            return real_now()
+
+        with patch.object(batch_submission, "now_datetime", side_effect=another_worker_claims_first):
+            rows = _claim_transactions([kept.name, taken.name])
+
+        self.assertEqual([claim.name for claim in rows], [kept.name])
+        self.assertEqual(row(taken.name).lease_token, "other worker")
+
+    def test_batch_claim_honours_backoff(self):
+        waiting = make_transaction("Failed", retry_count=1, next_attempt_at=add_to_date(now_datetime(), minutes=10))
+        self.assertEqual(_claim_transactions([waiting.name]), [])
+        self.assertEqual(row(waiting.name).status, "Failed")
+
+class TestLeaseExpiry(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_expired_leases_are_failed_with_backoff(self):
+        now = now_datetime()
+        expired = make_transaction("Processing", lease_token="dead", lease_expires_at=add_to_date(now, seconds=-1))
+        live = make_transaction("Processing", lease_token="alive", lease_expires_at=add_to_date(now, minutes=5))
+
+        release_expired_leases(names=[expired.name, live.name])
+
+        released = row(expired.name)
+        self.assertEqual((released.status, released.retry_count, released.lease_token), ("Failed", 1, None))
+        self.assertGreater(released.next_attempt_at, now)
+        self.assertEqual(row(live.name).status, "Processing")
+
+    def test_claims_from_before_leases_expire_by_submission_time(self):
+        now = now_datetime()
+        stale = make_transaction("Processing", submission_time=add_to_date(now, seconds=-LEASE_SECONDS - 60))
+        recent = make_transaction("Processing", submission_time=add_to_date(now, seconds=-60))
+
+        release_expired_leases(names=[stale.name, recent.name])
+
+        self.assertEqual(row(stale.name).status, "Failed")
+        self.assertEqual(row(recent.name).status, "Processing")
+
+    def test_outcome_recorded_first_is_not_overwritten(self):
+        transaction = make_transaction("Submitted", lease_expires_at=add_to_date(now_datetime(), seconds=-1))
+        release_expired_leases(names=[transaction.name])
+        self.assertEqual(row(transaction.name).status, "Submitted")
+
+class TestWriteResults(FrappeTestCase):
+    def tearDown(self):
+        delete_test_transactions()
+
+    def test_only_rows_still_held_are_written(self):
+        expires = add_to_date(now_datetime(), minutes=5)
+        held = make_transaction("Processing", lease_token="batch", lease_expires_at=expires)
+        lost = make_transaction("Processing", lease_token="new owner", lease_expires_at=expires)
+        rows = [frappe._dict(name=held.name, invoice_link=held.invoice_link, lease_token="batch"),
+                frappe._dict(name=lost.name, invoice_link=lost.invoice_link, lease_token="batch")]
+
+        _write_results(rows, {held.name: {"status": "Submitted"}, lost.name: {"status": "Submitted"}}, {})
+
+        self.assertEqual((row(held.name).status, row(held.name).lease_token), ("Submitted", None))
+        self.assertEqual((row(lost.name).status, row(lost.name).lease_token), ("Processing", "new owner"))
@@ -0,0 +1,184 @@
+## work_queue.py
+import frappe
+import logging
+import time
+from frappe.utils import add_to_date, cint, now_datetime
+from frappe.utils.background_jobs import enqueue
+try:
+    from frappe.utils.background_jobs import is_job_enqueued
+except ImportError:  # Frappe 14: enqueue takes no job_id or deduplicate
+    is_job_enqueued = None
+from .batch_submission import BATCH_JOB_TIMEOUT, DEFAULT_BATCH_SIZE, submit_claimed_transactions
+from .efactura_settings import get_efactura_settings
+from .efactura_transaction import MAX_RETRIES, MAX_RETRY_INTERVAL_MINUTES, RETRY_BASE_MINUTES
+from .metrics import record_queue_wait
+from .pagination import iter_pages
+from .xml_engine import regenerate_transactions_xml
+
+logger = logging.getLogger(__name__)
+DEFAULT_QUEUE_WORKERS = 2
+WORKER_TIME_BUDGET = 240  # seconds a worker loop keeps claiming before handing over to a fresh job
+LEASE_SECONDS = BATCH_JOB_TIMEOUT  # a claim outliving its job timeout belongs to a dead worker
+JOB_GUARD_KEY = "efactura:job_guard:{}"
+
+# The queue, like transition_status, relies on MariaDB SQL (for update skip locked,
+# row_count(), date_add, rand()); on other databases the scheduler leaves it idle instead of failing each tick
+
+# Work that is due: failed transactions with retries left and, in batch mode, generated drafts
+DUE_CONDITION = """(
+        (status='Failed' and retry_count < %(max_retries)s)
+        or (status='Draft' and %(include_drafts)s and (ifnull(xml_hash, '') != '' or ifnull(xml_data, '') != ''))
+    ) and (next_attempt_at is null or next_attempt_at <= %(now)s)"""
+
+def drain_submission_queue():
+    """Scheduled every minute: recover expired leases and keep a fixed number of worker loops running"""
+    settings = get_efactura_settings()
+    if not settings.is_configured():
+        return
+    if frappe.db.db_type != "mariadb":
+        logger.warning(f"e-Factura submission queue needs MariaDB, not {frappe.db.db_type}; skipping")
+        return
+
+    release_expired_leases()
+    include_drafts = cint(settings.get("batch_submission"))
+    if include_drafts:
+        _enqueue_once("frappe_ro_efactura.work_queue.generate_deferred_xml", "efactura-deferred-xml")
+
+    if not _has_due_work(include_drafts):
+        return
+
+    # Fixed job ids: a loop that is still queued or running is never enqueued a second time
+    for worker in range(cint(settings.get("queue_workers")) or DEFAULT_QUEUE_WORKERS):
+        _enqueue_once("frappe_ro_efactura.work_queue.run_queue_worker", f"efactura-submission-worker-{worker}")
+
+def run_queue_worker(job_guard=None):
+    """Claim and submit due transactions batch by batch until the queue is empty or the time budget is spent"""
+    record_queue_wait("run_queue_worker")
+    try:
+        settings = get_efactura_settings()
+        if not settings.is_configured():
+            return
+
+        include_drafts = cint(settings.get("batch_submission"))
+        batch_size = cint(settings.get("submission_batch_size")) or DEFAULT_BATCH_SIZE
+        deadline = time.monotonic() + WORKER_TIME_BUDGET
+
+        while time.monotonic() < deadline:
+            rows = claim_due_transactions(batch_size, include_drafts)
+            if not rows:
+                break
+            submit_claimed_transactions(rows, settings)
+    finally:
+        _release_job_guard(job_guard)
+
+def claim_due_transactions(limit, include_drafts=True, names=None):
+    """Lease up to limit due transactions to this worker, skipping rows other workers hold locked.
+
+    names restricts the claim to those transactions.
+    """
+    now = now_datetime()
+    rows = frappe.db.sql(
+        f"""select name, status, invoice_link, xml_data, xml_hash, retry_count
+        from `tabEFactura Transaction`
+        where {DUE_CONDITION}{_names_condition(names)}
+        order by next_attempt_at, creation
+        limit %(limit)s
+        for update skip locked""",
+        {"max_retries": MAX_RETRIES, "include_drafts": include_drafts, "now": now, "limit": limit,
+         "names": tuple(names or ())},
+        as_dict=True
+    )
+    if rows:
+        token = frappe.generate_hash(length=16)
+        frappe.db.sql(
+            """update `tabEFactura Transaction`
+            set status='Processing', submission_time=%(now)s, lease_token=%(token)s, lease_expires_at=%(expires)s
+            where name in %(names)s""",
+            {
+                "now": now,
+                "token": token,
+                "expires": add_to_date(now, seconds=LEASE_SECONDS),
+                "names": tuple(row.name for row in rows)
+            }
+        )
+        for row in rows:
+            row.lease_token = token
+    frappe.db.commit()
+    return rows
+
+def release_expired_leases(names=None):
+    """Count claims abandoned by crashed workers as a failed attempt, so they re-enter the queue with backoff.
+
+    One guarded UPDATE: a row only changes while it is still Processing under an
+    expired lease, so an outcome recorded meanwhile is never overwritten. Claims
+    from before leases existed have none and expire by their submission time.
+    names restricts the release to those transactions.
+    """
+    now = now_datetime()
+    # Backoff with jitter as in next_attempt_time, computed per row by the database
+    frappe.db.sql(
+        f"""update `tabEFactura Transaction`
+        set status='Failed', retry_count=ifnull(retry_count, 0) + 1, last_failure_date=%(now)s,
+            next_attempt_at=date_add(%(now)s, interval floor(
+                least(%(base)s * pow(2, ifnull(retry_count, 0)), %(max_interval)s) * 60 * (0.8 + rand() * 0.4)
+            ) second),
+            lease_token=null, lease_expires_at=null, modified=%(now)s
+        where status='Processing' and (
+            lease_expires_at < %(now)s
+            or (lease_expires_at is null and submission_time < %(stale_before)s)
+        ){_names_condition(names)}""",
+        {
+            "now": now,
+            "base": RETRY_BASE_MINUTES,
+            "max_interval": MAX_RETRY_INTERVAL_MINUTES,
+            "stale_before": add_to_date(now, seconds=-LEASE_SECONDS),
+            "names": tuple(names or ())
+        }
+    )
+    released = frappe.db.sql("select row_count()")[0][0]
+    frappe.db.commit()
+    if released > 0:
+        logger.warning(f"Released {released} expired e-Factura submission leases")
+
+def generate_deferred_xml(job_guard=None):
+    """Generate XML for Drafts recorded by deferred on_submit; they are submitted once it exists"""
+    record_queue_wait("generate_deferred_xml")
+    try:
+        for rows in iter_pages(
+            "EFactura Transaction",
+            [["status", "=", "Draft"], ["xml_data", "is", "not set"], ["xml_hash", "is", "not set"]]
+        ):
+            regenerate_transactions_xml(names=[row.name for row in rows])
+    finally:
+        _release_job_guard(job_guard)
+
+def _enqueue_once(method, job_id):
+    """Enqueue a long job unless one with the same id is still queued or running"""
+    if is_job_enqueued is not None:
+        enqueue(method, queue="long", timeout=BATCH_JOB_TIMEOUT, job_id=job_id, deduplicate=True)
+        return
+
+    # Frappe 14 has no job ids: a Redis key set here and released by the job stands in,
+    # expiring with the job timeout should a worker die without releasing it
+    cache = frappe.cache()
+    if not cache.set(cache.make_key(JOB_GUARD_KEY.format(job_id)), 1, nx=True, ex=BATCH_JOB_TIMEOUT):
+        return
+    try:
+        enqueue(method, queue="long", timeout=BATCH_JOB_TIMEOUT, job_name=job_id, job_guard=job_id)
+    except Exception:
+        _release_job_guard(job_id)
+        raise
+
+def _release_job_guard(job_id):
+    if job_id:
+        cache = frappe.cache()
+        cache.delete(cache.make_key(JOB_GUARD_KEY.format(job_id)))
+
+def _names_condition(names):
+    return " and name in %(names)s" if names else ""
+
+def _has_due_work(include_drafts):
+    return bool(frappe.db.sql(
+        f"""select name from `tabEFactura Transaction` where {DUE_CONDITION} limit 1""",
+        {"max_retries": MAX_RETRIES, "include_drafts": include_drafts, "now": now_datetime()}
+    ))
@@ -0,0 +1,210 @@
+## xml_engine.py
+import frappe
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from frappe.utils import cint
+from frappe.utils.background_jobs import enqueue
+from .invoice_loader import load_invoice_snapshots
+from .efactura_settings import schematron_on_drafts
+from .efactura_transaction import lock_transactions
+from .invoice_rules import check_invoice, format_violations
+from .invoice_status_sync import sync_invoice_statuses
+from .metrics import record_queue_wait, timed, timer
+from .pagination import iter_pages
+from .party_cache import get_party_snapshot
+from .payload_cache import store_generated_xml
+from .payload_store import save_payloads
+from .xml_generator import XMLGenerator, get_compiled_schematron
+
+logger = logging.getLogger(__name__)
+PROCESS_POOL_MIN_INVOICES = 20  # below this, process fan-out costs more than it saves
+REGENERATE_CHUNK_SIZE = 500
+REGENERATE_JOB_TIMEOUT = 3600
+REGENERATE_STATUSES = ("Draft", "Validation Failed")
+
+# Generator of a process-pool worker, set up once by _init_pool_worker
+_pool_generator = None
+_pool_validate = True
+
+class XMLEngine:
+    """Generates and validates UBL for many invoice snapshots, fanning out to a process pool"""
+
+    def __init__(self, processes=None, schematron_file=None, validate=True):
+        self.processes = cint(processes) if processes is not None else (os.cpu_count() or 1)
+        self.schematron_file = str(schematron_file or XMLGenerator().schematron_file)
+        self.validate = validate
+        self._pool = None
+        self._pool_pid = None
+
+    @timed("engine_batch")
+    def run(self, snapshots):
+        """Results in input order, each {name, xml, content_hash, errors}; errors is empty when valid"""
+        snapshots = [_to_plain(snapshot) for snapshot in snapshots]
+        if self.processes > 1 and len(snapshots) >= PROCESS_POOL_MIN_INVOICES:
+            try:
+                chunksize = max(len(snapshots) // (self.processes * 4), 1)
+                return list(self._get_pool().map(_process_in_pool_worker, snapshots, chunksize=chunksize))
+            except Exception as e:
+                logger.warning(f"Process pool XML generation failed, generating inline: {str(e)}")
+                self.close()
+
+        generator = XMLGenerator(self.schematron_file)
+        return [_process_snapshot(generator, snapshot, self.validate) for snapshot in snapshots]
+
+    def close(self):
+        """Shut down the process pool, if one was started by this process"""
+        if self._pool and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def _get_pool(self):
+        """Spawned workers compile the Schematron once at start-up instead of on their first invoice"""
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pool_worker,
+                initargs=(self.schematron_file, self.validate)
+            )
+            self._pool_pid = os.getpid()
+        return self._pool
+
+def build_engine_snapshots(invoice_names):
+    """Plain-dict invoice snapshots with party data resolved, ready to cross a process boundary"""
+    invoices = load_invoice_snapshots(invoice_names)
+    parties = {}
+
+    def party(party_type, party_name, address_name):
+        key = (party_type, party_name, address_name)
+        if key not in parties:
+            parties[key] = get_party_snapshot(party_type, party_name, address_name) or {'name': party_name}
+        return parties[key]
+
+    snapshots = []
+    for invoice in invoices.values():
+        invoice["supplier_party"] = party("Company", invoice.company, invoice.get("company_address"))
+        invoice["customer_party"] = party("Customer", invoice.customer, invoice.get("customer_address"))
+        snapshots.append(_to_plain(invoice))
+    return snapshots
+
+def regenerate_transactions_xml(names=None, processes=None, chunk_size=REGENERATE_CHUNK_SIZE):
+    """Regenerate and validate XML of unsubmitted transactions, chunk by chunk, using all cores"""
+    record_queue_wait("regenerate_transactions_xml")
+    filters = [["status", "in", REGENERATE_STATUSES]]
+    if names:
+        filters.append(["name", "in", names])
+
+    engine = XMLEngine(processes=processes, validate=schematron_on_drafts())
+    summary = {"valid": 0, "invalid": {}}
+    try:
+        for rows in iter_pages("EFactura Transaction", filters, ["name", "invoice_link"], page_size=chunk_size):
+            _regenerate_chunk(engine, rows, summary)
+    finally:
+        engine.close()
+
+    logger.info(f"Regenerated XML for {summary['valid']} transactions, {len(summary['invalid'])} failed validation")
+    return summary
+
+@frappe.whitelist()
+def regenerate_xml(names=None):
+    """Queue a background regeneration of unsubmitted transactions"""
+    frappe.only_for("System Manager")
+    enqueue(
+        "frappe_ro_efactura.xml_engine.regenerate_transactions_xml",
+        queue="long",
+        names=frappe.parse_json(names) if names else None,
+        timeout=REGENERATE_JOB_TIMEOUT,
+        enqueue_after_commit=True
+    )
+
+def _regenerate_chunk(engine, rows, summary):
+    """Generate one chunk and write payloads and statuses back in bulk"""
+    transactions_by_invoice = defaultdict(list)
+    for row in rows:
+        transactions_by_invoice[row.invoice_link].append(row.name)
+    results = engine.run(build_engine_snapshots(list(transactions_by_invoice)))
+
+    outcomes = {}
+    for result in results:
+        for transaction in transactions_by_invoice[result["name"]]:
+            outcomes[transaction] = result
+        if not result["errors"]:
+            store_generated_xml(result["content_hash"], result["xml"])
+
+    with timer("db_write"):
+        # Transactions claimed or cancelled while their XML was generated keep their newer state
+        current = lock_transactions(list(outcomes))
+        outcomes = {
+            transaction: result for transaction, result in outcomes.items()
+            if transaction in current and current[transaction].status in REGENERATE_STATUSES
+        }
+
+        transaction_updates, invoice_updates, valid = {}, {}, []
+        for transaction, result in outcomes.items():
+            if result["errors"]:
+                summary["invalid"][transaction] = result["errors"]
+                transaction_updates[transaction] = {"status": "Validation Failed"}
+                invoice_updates[result["name"]] = {
+                    "efactura_status": "Validation Failed",
+                    "efactura_remarks": format_violations(result["errors"])
+                }
+            else:
+                valid.append((transaction, result))
+
+        payloads = [(transaction, "xml", result["xml"]) for transaction, result in valid]
+        for (transaction, result), xml_hash in zip(valid, save_payloads(payloads)):
+            transaction_updates[transaction] = {
+                "status": "Draft",
+                "xml_data": None,
+                "xml_hash": xml_hash,
+                "content_hash": result["content_hash"]
+            }
+            invoice_updates[result["name"]] = {"efactura_status": "Draft", "efactura_remarks": None}
+
+        if transaction_updates:
+            frappe.db.bulk_update("EFactura Transaction", transaction_updates)
+        sync_invoice_statuses(invoice_updates)
+        frappe.db.commit()
+    summary["valid"] += len(valid)
+
+def _init_pool_worker(schematron_file, validate):
+    global _pool_generator, _pool_validate
+    _pool_generator = XMLGenerator(schematron_file)
+    _pool_validate = validate
+    if validate:
+        get_compiled_schematron(schematron_file)
+
+def _process_in_pool_worker(snapshot):
+    return _process_snapshot(_pool_generator, snapshot, _pool_validate)
+
+def _process_snapshot(generator, snapshot, validate):
+    """Check, generate and validate one snapshot; failures become structured errors, never exceptions.
+
+    The native invoice rules run first and report every violation; the
+    Schematron pass only runs on invoices that passed them.
+    """
+    invoice = frappe._dict(snapshot)
+    invoice["items"] = [frappe._dict(item) for item in snapshot.get("items") or []]
+    result = {"name": invoice.name, "xml": None, "content_hash": None, "errors": []}
+    try:
+        result["errors"] = check_invoice(invoice)
+        if result["errors"]:
+            return result
+        result["content_hash"] = generator.content_hash(invoice)
+        result["xml"] = generator.generate_ubl_21(invoice)
+        if validate:
+            result["errors"] = generator.schematron_errors(result["xml"])
+    except Exception as e:
+        result["errors"] = [{"message": str(e), "line": None, "column": None, "path": None, "level": "FATAL"}]
+    return result
+
+def _to_plain(value):
+    """Strip frappe._dict wrappers so snapshots pickle as ordinary dicts and lists"""
+    if isinstance(value, dict):
+        return {key: _to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(item) for item in value]
+    return value
@@ -1,91 +1,267 @@
 ## xml_generator.py
-```python
-## xml_generator.py
 from lxml import etree
 from pathlib import Path
 import frappe
+import hashlib
+import io
+import json
 import logging
+import os
+import threading
 from frappe import _
+from .invoice_rules import format_violations
+from .metrics import timed
+from .party_cache import get_party_snapshot
+from .unit_codes import unit_code
 
 logger = logging.getLogger(__name__)
 
+XML_FORMAT_VERSION = "4"  # bump whenever generated output changes, to retire cached XML
+STREAMING_LINE_THRESHOLD = 2000  # invoice lines above which XML is written incrementally
+HASHED_INVOICE_FIELDS = ("name", "posting_date", "currency", "company", "customer", "net_total", "grand_total")
+HASHED_ITEM_FIELDS = ("idx", "item_name", "qty", "uom")
+
+# Process-wide cache of compiled Schematron validators, keyed by resolved rules path
+_schematron_cache = {}
+_schematron_cache_lock = threading.Lock()
+_schematron_stats = {"compiles": 0, "hits": 0}
+
+def get_compiled_schematron(schematron_file):
+    """Return a compiled Schematron validator, recompiling only when the rules file changes"""
+    path = str(Path(schematron_file).resolve())
+    stat = os.stat(path)
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _schematron_cache_lock:
+        entry = _schematron_cache.get(path)
+        if entry and entry["stamp"] == stamp:
+            _schematron_stats["hits"] += 1
+            return entry["validator"]
+
+        # File was touched or replaced: only recompile if the rules actually differ
+        content = Path(path).read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        if entry and entry["digest"] == digest:
+            entry["stamp"] = stamp
+            _schematron_stats["hits"] += 1
+            return entry["validator"]
+
+        validator = etree.Schematron(etree.parse(io.BytesIO(content), base_url=path))
+        _schematron_cache[path] = {"stamp": stamp, "digest": digest, "validator": validator}
+        _schematron_stats["compiles"] += 1
+        logger.info(f"Compiled Schematron rules {path} ({digest[:12]}) in process {os.getpid()}")
+        return validator
+
+def get_schematron_cache_stats():
+    """Compile vs. hit counters for the Schematron cache of this process"""
+    with _schematron_cache_lock:
+        return {
+            "pid": os.getpid(),
+            "compiles": _schematron_stats["compiles"],
+            "hits": _schematron_stats["hits"],
+            "entries": {path: entry["digest"] for path, entry in _schematron_cache.items()}
+        }
+
+def clear_schematron_cache():
+    """Drop all compiled validators and reset counters"""
+    with _schematron_cache_lock:
+        _schematron_cache.clear()
+        _schematron_stats.update(compiles=0, hits=0)
+
 class XMLGenerator:
-    def __init__(self):
+    def __init__(self, schematron_file=None):
         self.namespaces = {
             'ubl': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
             'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
             'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
             'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
         }
-        self.schematron_path = Path(frappe.get_app_path('frappe_ro_efactura')) / 'schemas'
+        self.schematron_file = Path(schematron_file) if schematron_file else (
+            Path(frappe.get_app_path('frappe_ro_efactura')) / 'schemas' / 'eFactura.sch')
 
+    @timed("generate")
     def generate_ubl_21(self, invoice):
         """Generate UBL 2.1 compliant XML from SalesInvoice document"""
-        root = etree.Element('ubl:Invoice', nsmap=self.namespaces)
-        
-        # Add basic invoice information
-        self._add_element(root, 'cbc:ID', invoice.name)
-        self._add_element(root, 'cbc:IssueDate', invoice.posting_date)
-        self._add_element(root, 'cbc:DocumentCurrencyCode', invoice.currency)
-
-        # Add parties with proper structure
-        self._add_party(root, 'AccountingSupplierParty', invoice.company)
-        self._add_party(root, 'AccountingCustomerParty', invoice.customer)
-
-        # Add invoice lines
-        for item in invoice.get('items', []):
-            line = etree.SubElement(root, 'cac:InvoiceLine')
-            self._add_element(line, 'cbc:ID', item.idx)
-            item_root = etree.SubElement(line, 'cac:Item')
-            self._add_element(item_root, 'cbc:Name', item.item_name)
-            
-            quantity = etree.SubElement(line, 'cbc:InvoicedQuantity', 
-                                      attrib={'unitCode': item.get('uom', 'UNIT')})
-            quantity.text = str(item.qty)
-
-        # Add monetary totals
-        monetary_total = etree.SubElement(root, 'cac:LegalMonetaryTotal')
+        items = invoice.get('items', [])
+        if len(items) >= STREAMING_LINE_THRESHOLD:
+            # Very large invoices skip the in-memory tree
+            buffer = io.BytesIO()
+            self.stream_ubl_21(invoice, items, buffer)
+            return buffer.getvalue()
+
+        root = etree.Element(self._qname('ubl:Invoice'), nsmap=self.namespaces)
+        root.extend(self._iter_invoice_elements(invoice, items))
+        return etree.tostring(root, pretty_print=True, encoding='utf-8', xml_declaration=True)
+
+    def content_hash(self, invoice):
+        """Hash of everything the generated XML depends on: header, lines, party data and format version"""
+        content = {
+            "version": XML_FORMAT_VERSION,
+            "invoice": {field: invoice.get(field) for field in HASHED_INVOICE_FIELDS},
+            "items": [[item.get(field) for field in HASHED_ITEM_FIELDS] for item in invoice.get('items', [])],
+            "parties": [
+                self._party_snapshot(invoice, party_type)
+                for party_type in ('AccountingSupplierParty', 'AccountingCustomerParty')
+            ]
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    @timed("generate_stream")
+    def stream_ubl_21(self, invoice, items, output):
+        """Write UBL 2.1 XML incrementally to a file path or file-like object.
+
+        items may be any iterable, e.g. iter_invoice_items(); only one invoice
+        line is held in memory at a time.
+        """
+        with etree.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element(self._qname('ubl:Invoice'), nsmap=self.namespaces):
+                for element in self._iter_invoice_elements(invoice, items):
+                    self._stream_element(xf, element)
+
+    def _iter_invoice_elements(self, invoice, items):
+        """Yield the top-level invoice elements in document order"""
+        # Basic invoice information
+        yield self._make_element('cbc:ID', invoice.name)
+        yield self._make_element('cbc:IssueDate', invoice.posting_date)
+        yield self._make_element('cbc:DocumentCurrencyCode', invoice.currency)
+
+        # Parties with proper structure
+        for party_type in ('AccountingSupplierParty', 'AccountingCustomerParty'):
+            yield self._build_party(party_type, self._party_snapshot(invoice, party_type))
+
+        for item in items:
+            yield self._build_line(item)
+
+        # Monetary totals
+        monetary_total = self._make_element('cac:LegalMonetaryTotal')
         self._add_element(monetary_total, 'cbc:TaxExclusiveAmount', 
                          invoice.net_total, {'currencyID': invoice.currency})
         self._add_element(monetary_total, 'cbc:TaxInclusiveAmount', 
                          invoice.grand_total, {'currencyID': invoice.currency})
+        yield monetary_total
 
-        return etree.tostring(root, pretty_print=True, encoding='utf-8', xml_declaration=True)
+    def _build_line(self, item):
+        """Build one cac:InvoiceLine element"""
+        line = self._make_element('cac:InvoiceLine')
+        self._add_element(line, 'cbc:ID', item.idx)
+        item_root = self._add_element(line, 'cac:Item', None)
+        self._add_element(item_root, 'cbc:Name', item.item_name)
+        code = unit_code(item.get('uom'))
+        self._add_optional(line, 'cbc:InvoicedQuantity', item.qty, {'unitCode': code} if code else None)
+        return line
+
+    def _stream_element(self, xf, element):
+        """Serialise a built element through xmlfile so it reuses the root namespace declarations"""
+        with xf.element(element.tag, dict(element.attrib)):
+            if element.text:
+                xf.write(element.text)
+            for child in element:
+                self._stream_element(xf, child)
 
     def validate_with_schematron(self, xml_str):
         """Validate XML against ANAF Schematron rules"""
-        schematron_file = self.schematron_path / 'eFactura.sch'
-        if not schematron_file.exists():
-            frappe.throw(_("Schematron rules file missing at: {0}").format(schematron_file))
+        if not self.schematron_file.exists():
+            frappe.throw(_("Schematron rules file missing at: {0}").format(self.schematron_file))
 
         try:
-            # Parse and prepare Schematron validator
-            schematron = etree.Schematron(etree.parse(str(schematron_file)))
-            doc = etree.fromstring(xml_str)
-            
-            if not schematron.validate(doc):
-                report = schematron.error_log
-                logger.error(f"Schematron validation failed: {report}")
-                frappe.throw(_("XML validation failed: {0}").format(report.last_error))
+            errors = self.schematron_errors(xml_str)
+            if errors:
+                logger.error(f"Schematron validation failed: {errors}")
+                frappe.throw(_("XML validation failed: {0}").format(format_violations(errors, "<br>")))
             return True
         except etree.XMLSyntaxError as e:
             logger.error(f"XML syntax error: {str(e)}")
             frappe.throw(_("Invalid XML structure: {0}").format(str(e)))
 
+    @timed("validate")
+    def schematron_errors(self, xml_str):
+        """Schematron violations as plain dicts, empty when the XML is valid; raises XMLSyntaxError"""
+        # Compiled once per process and reused until the rules file changes
+        schematron = get_compiled_schematron(self.schematron_file)
+        if schematron.validate(etree.fromstring(xml_str)):
+            return []
+        return [
+            {"message": entry.message, "line": entry.line, "column": entry.column,
+             "path": entry.path, "level": entry.level_name}
+            for entry in schematron.error_log
+        ]
+
+    def _qname(self, tag):
+        """Expand a prefixed tag such as 'cbc:ID' to lxml's {namespace}local form"""
+        prefix, local = tag.split(':', 1)
+        return f"{{{self.namespaces[prefix]}}}{local}"
+
+    def _make_element(self, tag, value=None, attrs=None):
+        """Helper to create a detached XML element with text and attributes"""
+        element = etree.Element(self._qname(tag))
+        self._fill_element(element, value, attrs)
+        return element
+
     def _add_element(self, parent, tag, value, attrs=None):
         """Helper to create XML elements with text and attributes"""
-        element = etree.SubElement(parent, tag)
+        element = etree.SubElement(parent, self._qname(tag))
+        self._fill_element(element, value, attrs)
+        return element
+
+    def _add_optional(self, parent, tag, value, attrs=None):
+        """Add an element only when there is a value for it"""
+        if value not in (None, ''):
+            return self._add_element(parent, tag, value, attrs)
+
+    def _fill_element(self, element, value, attrs):
         if attrs:
             for k, v in attrs.items():
-                element.set(k, v)
+                element.set(k, str(v))
         if value is not None:
             element.text = str(value)
-        return element
 
-    def _add_party(self, root, party_type, party):
-        """Add structured party information with nested elements"""
-        party_root = etree.SubElement(root, f'cac:{party_type}')
-        party_element = etree.SubElement(party_root, 'cac:Party')
-        self._add_element(party_element, 'cbc:Name', party)
-        # Additional fields can be added here:
-        # self._add_element(party_element, 'cbc:CompanyID', party.tax_id)
+    def _build_party(self, party_type, party):
+        """Build the full party block (name, address, VAT scheme, legal entity, contact) from a snapshot"""
+        party_root = self._make_element(f'cac:{party_type}')
+        party_element = self._add_element(party_root, 'cac:Party', None)
+        name = party.get('party_name') or party.get('name')
+
+        party_name = self._add_element(party_element, 'cac:PartyName', None)
+        self._add_element(party_name, 'cbc:Name', name)
+
+        address = party.get('address')
+        if address:
+            postal = self._add_element(party_element, 'cac:PostalAddress', None)
+            street = ", ".join(filter(None, [address.get('address_line1'), address.get('address_line2')]))
+            self._add_optional(postal, 'cbc:StreetName', street)
+            self._add_optional(postal, 'cbc:CityName', address.get('city'))
+            self._add_optional(postal, 'cbc:PostalZone', address.get('pincode'))
+            self._add_optional(postal, 'cbc:CountrySubentity', address.get('state'))
+            country = self._add_element(postal, 'cac:Country', None)
+            self._add_element(country, 'cbc:IdentificationCode', address.get('country_code') or 'RO')
+
+        tax_id = (party.get('tax_id') or '').replace(' ', '').upper()
+        if tax_id[:2].isalpha():
+            # VAT-registered parties carry a country-prefixed VAT identifier
+            tax_scheme = self._add_element(party_element, 'cac:PartyTaxScheme', None)
+            self._add_element(tax_scheme, 'cbc:CompanyID', tax_id)
+            scheme = self._add_element(tax_scheme, 'cac:TaxScheme', None)
+            self._add_element(scheme, 'cbc:ID', 'VAT')
+
+        legal_entity = self._add_element(party_element, 'cac:PartyLegalEntity', None)
+        self._add_element(legal_entity, 'cbc:RegistrationName', name)
+        cui = tax_id[2:] if tax_id.startswith('RO') else tax_id
+        self._add_optional(legal_entity, 'cbc:CompanyID', party.get('registration_id') or cui)
+
+        if party.get('phone') or party.get('email'):
+            contact = self._add_element(party_element, 'cac:Contact', None)
+            self._add_optional(contact, 'cbc:Telephone', party.get('phone'))
+            self._add_optional(contact, 'cbc:ElectronicMail', party.get('email'))
+        return party_root
+
+    def _party_snapshot(self, invoice, party_type):
+        """Party data for the invoice: precomputed on the snapshot, else from the party cache"""
+        if party_type == 'AccountingSupplierParty':
+            snapshot = invoice.get('supplier_party') or get_party_snapshot(
+                'Company', invoice.company, invoice.get('company_address'))
+            return snapshot or {'name': invoice.company}
+
+        snapshot = invoice.get('customer_party') or get_party_snapshot(
+            'Customer', invoice.customer, invoice.get('customer_address'))
+        return snapshot or {'name': invoice.customer}